@@ -27,7 +27,6 @@ import subprocess
 from datetime import datetime
 from pytz import timezone
 from bot import bot
-import sqlite3
 
 from cogs.utils.checks import is_developer, is_moderator
 
@@ -99,10 +98,42 @@ async def restart(ctx):
     """
     bot.dev_logger.info("Bot restart")
     await ctx.send("https://streamable.com/dli1")
+    # os.execl replaces the process without going through bot.close()
+    await bot.write_queue.flush()
     python = sys.executable
     os.execl(python, python, *sys.argv)
 
 
+@bot.command(aliases=["dispatcherstats"])
+@is_developer()
+async def dispatcher_stats(ctx):
+    """
+    Show delivery statistics of outbound messages, and the interactive messages open
+    """
+    await ctx.send(f"```{bot.message_dispatcher.stats()}\n{bot.interactions.stats()}```")
+
+
+@bot.command(aliases=["scheduledjobs", "jobs"])
+@is_moderator()
+async def scheduled_jobs(ctx, limit: int = 20):
+    """
+    List the next scheduled jobs (reminders, banner contest reminder, verification purge...)
+    """
+    # keeps the list within Discord's message length limit
+    jobs = await bot.scheduler.upcoming(min(limit, 30))
+    if not jobs:
+        await ctx.send("No jobs are scheduled.")
+        return
+    await ctx.send(
+        "```"
+        + "\n".join(
+            f"{datetime.fromtimestamp(due).strftime('%Y-%m-%d %H:%M:%S')}  {handler}" + (f" ({key})" if key else "")
+            for handler, key, due in jobs
+        )
+        + "```"
+    )
+
+
 @bot.command()
 @is_moderator()
 async def sleep(ctx):
@@ -130,11 +161,7 @@ async def backup(ctx):
 async def on_member_join(member):
     member_id = member.id
     name = str(member)
-    conn = sqlite3.connect(bot.config.db_path)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO Members VALUES (?,?)", (member_id, name))
-    conn.commit()
-    conn.close()
+    bot.write_queue.upsert_member(member_id, name)
 
 
 @bot.listen()
@@ -144,11 +171,7 @@ async def on_user_update(before, after):
 
     user_id = after.id
     new_name = str(after)
-    conn = sqlite3.connect(bot.config.db_path)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO Members VALUES (?,?)", (user_id, new_name))
-    conn.commit()
-    conn.close()
+    bot.write_queue.upsert_member(user_id, new_name)
 
 
 def main():
@@ -0,0 +1,120 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+# Compares handing images to the image filter workers through files which
+# they map (apply_transforms) with the previous approach (pickling a BytesIO of
+# the attachment to the worker, copying it into a bytearray to decode it, and
+# pickling the encoded result back), on a large PNG, with a filter which does
+# nothing so that only the hand-off is measured. Memory is the peak of Python
+# and numpy allocations in the bot's process and in the worker:
+#
+#     python -m benchmarks.image_handoff [--size-mb N] [--repeat N]
+
+import argparse
+import concurrent.futures
+import os
+import tempfile
+import time
+import tracemalloc
+
+from io import BytesIO
+
+import cv2
+import numpy as np
+
+from cogs.utils.image_helpers import apply_transforms
+
+
+def identity(image):
+    return image
+
+
+def legacy_apply_transform(buffer):
+    img_bytes = np.asarray(bytearray(buffer.read()), np.uint8)
+    result = cv2.imdecode(img_bytes, cv2.IMREAD_UNCHANGED)
+    _, buffer = cv2.imencode(".png", identity(result))
+    return buffer
+
+
+def measured(fn, *args):
+    # Runs in the worker, returning fn's result and its peak memory
+    tracemalloc.start()
+    result = fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+
+def legacy_command(pool, data: bytes, tmp_dir: str):
+    buffer = BytesIO(data)
+    result, worker_peak = pool.submit(measured, legacy_apply_transform, buffer).result()
+    upload = BytesIO(result)
+    return len(upload.getbuffer()), worker_peak
+
+
+def current_command(pool, data: bytes, tmp_dir: str):
+    fd, in_path = tempfile.mkstemp(suffix=".png", dir=tmp_dir)
+    out_path = f"{in_path}.png"
+    try:
+        # As Attachment.save() does
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        _, worker_peak = pool.submit(
+            measured, apply_transforms, [(identity,)], in_path, out_path, "png", None, None, 2**62
+        ).result()
+        with open(out_path, "rb") as upload:
+            return os.fstat(upload.fileno()).st_size, worker_peak
+    finally:
+        for path in (in_path, out_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the hand-off of images to the image filter workers")
+    arg_parser.add_argument("--size-mb", type=float, default=10, help="approximate size of the PNG to filter")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="number of commands per approach")
+    args = arg_parser.parse_args()
+
+    # Noise does not compress, so the PNG is about as large as the pixels
+    side = int((args.size_mb * 2**20 / 3) ** 0.5)
+    pixels = np.random.default_rng(0).integers(0, 256, (side, side, 3), np.uint8)
+    data = cv2.imencode(".png", pixels)[1].tobytes()
+    print(f"{side}x{side} PNG, {len(data) / 2**20:.1f} MB")
+
+    with concurrent.futures.ProcessPoolExecutor(1) as pool, tempfile.TemporaryDirectory() as tmp_dir:
+        # Started before measuring, as the bot's pool is
+        pool.submit(identity, None).result()
+        for name, command in (("legacy", legacy_command), ("current", current_command)):
+            latencies, bot_peaks, worker_peaks = [], [], []
+            for _ in range(args.repeat):
+                tracemalloc.start()
+                start = time.perf_counter()
+                size, worker_peak = command(pool, data, tmp_dir)
+                latencies.append(time.perf_counter() - start)
+                bot_peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                worker_peaks.append(worker_peak)
+            print(
+                f"{name:>8}: {min(latencies) * 1000:.0f} ms per command (best of {args.repeat}), "
+                f"peak memory {max(bot_peaks) / 2**20:.1f} MB in the bot, "
+                f"{max(worker_peaks) / 2**20:.1f} MB in the worker, result {size / 2**20:.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+# Compares the matching of custom reaction prompts by PStringEncodings with
+# the previous approach (searching the alternation of every prompt pattern,
+# then every pattern one by one), on the custom reactions and quotes of the
+# bot's database or on given files:
+#
+#     python -m benchmarks.p_strings_parser [--prompts FILE] [--corpus FILE] [--synthetic N] [--budget MS]
+
+import argparse
+import random
+import sqlite3
+import time
+
+import regex as re
+
+from functools import partial
+
+from cogs.utils.p_strings import PStringEncodings
+
+
+def legacy_matching_keys(encodings: PStringEncodings, content: str) -> list[int]:
+    patterns = [(key, pattern) for key, (pattern, _) in encodings.patterns_and_p_strings.items()]
+    patterns_string = f"({'|'.join(pattern.pattern for _, pattern in patterns)})"
+    if not re.search(patterns_string, content) or len(patterns_string) <= 2:
+        return []
+    return [key for key, pattern in patterns if pattern.search(content) is not None]
+
+
+def current_matching_keys(encodings: PStringEncodings, content: str, budget: float = None) -> list[int]:
+    return sorted(encodings.matching_keys(content, budget=budget))
+
+
+def synthetic_prompts(corpus: list[str], count: int) -> list[tuple[str, bool]]:
+    """Prompts made of words of the corpus, with a few placeholders and
+    choice lists, similar to those of actual custom reactions."""
+    words = [word for message in corpus for word in message.split() if word.isalnum()] or ["marty"]
+    prompts = []
+    for _ in range(count):
+        prompt = " ".join(random.choices(words, k=random.randint(1, 4)))
+        kind = random.random()
+        if kind < 0.2:
+            prompt += " %1%"
+        elif kind < 0.3:
+            prompt = f"%[{random.choice(words)}, {random.choice(words)}]% {prompt}"
+        prompts.append((prompt, random.random() < 0.7))
+    return prompts
+
+
+def _read_lines(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as fp:
+        return [line.rstrip("\n").lower() for line in fp if line.strip()]
+
+
+def main():
+    from config import parser
+
+    arg_parser = argparse.ArgumentParser(description="Benchmark the custom reaction prompt matching")
+    arg_parser.add_argument("--prompts", help="file with one prompt per line (default: the database's)")
+    arg_parser.add_argument("--corpus", help="file with one message per line (default: the database's quotes)")
+    arg_parser.add_argument("--synthetic", type=int, default=0, help="add this many synthetic prompts")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="number of passes over the corpus")
+    arg_parser.add_argument("--budget", type=int, help="time budget per message, in milliseconds (default: none)")
+    args = arg_parser.parse_args()
+
+    conn = None if args.prompts and args.corpus else sqlite3.connect(parser.Parser().db_path)
+    if args.prompts:
+        prompts = [(prompt, True) for prompt in _read_lines(args.prompts)]
+    else:
+        prompts = [
+            (prompt.lower(), bool(anywhere))
+            for prompt, anywhere in conn.execute("SELECT Prompt, Anywhere FROM CustomReactions WHERE Proposal = 0")
+        ]
+    if args.corpus:
+        corpus = _read_lines(args.corpus)
+    else:
+        corpus = [quote.lower() for (quote,) in conn.execute("SELECT Quote FROM Quotes") if quote]
+    if conn:
+        conn.close()
+    prompts += synthetic_prompts(corpus, args.synthetic)
+
+    if not prompts or not corpus:
+        print("Nothing to benchmark: no prompts or no messages")
+        return
+
+    start = time.perf_counter()
+    encodings = PStringEncodings(
+        [prompt for prompt, _ in prompts], [""] * len(prompts), [anywhere for _, anywhere in prompts]
+    )
+    build_time = time.perf_counter() - start
+    print(
+        f"{len(prompts)} prompts ({len(prompts) - len(encodings.other_keys)} prefiltered by literal), "
+        f"{len(corpus)} messages, built in {build_time:.3f}s"
+    )
+
+    results = {}
+    budget = args.budget / 1000 if args.budget is not None else None
+    current = partial(current_matching_keys, budget=budget)
+    for name, fn in (("legacy", legacy_matching_keys), ("current", current)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            matches = [fn(encodings, message) for message in corpus]
+        elapsed = (time.perf_counter() - start) / (args.repeat * len(corpus))
+        results[name] = (elapsed, matches)
+        print(f"{name:>8}: {elapsed * 1e6:.1f} µs per message")
+
+    print(f" speedup: {results['legacy'][0] / results['current'][0]:.1f}x")
+    mismatches = sum(legacy != current for legacy, current in zip(results["legacy"][1], results["current"][1]))
+    print(f"messages with different matches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+# Compares filling custom reaction responses with their precompiled templates
+# (PString) with the previous approach (substituting every placeholder with a
+# regex, then converting the choice lists), on the custom reactions of the
+# bot's database or on a given file:
+#
+#     python -m benchmarks.p_strings_render [--responses FILE] [--repeat N]
+
+import argparse
+import sqlite3
+import time
+
+import regex as re
+
+from cogs.utils.p_strings import PLACEHOLDERS_ARGS, PString, _convert_choice_list
+
+USER = "<@236324254412111872>"
+CHANNEL = "<#236668784948019202>"
+GROUPS = ["apples", "oranges", "pears"]
+
+LEGACY_PATTERNS = tuple(re.compile(f"%{arg}%") for arg in PLACEHOLDERS_ARGS)
+
+
+def legacy_render(string: str, user: str, channel: str, groups: list[str]) -> str:
+    for pattern, value in zip(LEGACY_PATTERNS, (user, channel, *groups)):
+        if value:
+            string = pattern.sub(value, string)
+    return _convert_choice_list(string)
+
+
+def current_render(p_string: PString, user: str, channel: str, groups: list[str]) -> str:
+    p_string.user, p_string.channel, p_string.groups = user, channel, groups
+    return str(p_string)
+
+
+def main():
+    from config import parser
+
+    arg_parser = argparse.ArgumentParser(description="Benchmark the filling of custom reaction responses")
+    arg_parser.add_argument("--responses", help="file with one response per line (default: the database's)")
+    arg_parser.add_argument("--repeat", type=int, default=20, help="number of passes over the responses")
+    args = arg_parser.parse_args()
+
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as fp:
+            responses = [line.rstrip("\n") for line in fp if line.strip()]
+    else:
+        conn = sqlite3.connect(parser.Parser().db_path)
+        responses = [response for (response,) in conn.execute("SELECT Response FROM CustomReactions") if response]
+        conn.close()
+
+    if not responses:
+        print("Nothing to benchmark: no responses")
+        return
+
+    start = time.perf_counter()
+    p_strings = [PString(response) for response in responses]
+    print(f"{len(responses)} responses, compiled in {time.perf_counter() - start:.3f}s")
+
+    results = {}
+    for name, fn, items in (("legacy", legacy_render, responses), ("current", current_render, p_strings)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for item in items:
+                fn(item, USER, CHANNEL, GROUPS)
+        elapsed = (time.perf_counter() - start) / (args.repeat * len(items))
+        results[name] = elapsed
+        print(f"{name:>8}: {elapsed * 1e6:.1f} µs per response")
+
+    print(f" speedup: {results['legacy'] / results['current']:.1f}x")
+
+    # Responses without choice lists must be filled identically
+    mismatches = sum(
+        legacy_render(response, USER, CHANNEL, GROUPS) != current_render(p_string, USER, CHANNEL, GROUPS)
+        for response, p_string in zip(responses, p_strings)
+        if "%[" not in response
+    )
+    print(f"responses filled differently: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
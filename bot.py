@@ -26,6 +26,12 @@ import sqlite3
 import traceback
 import requests
 from discord import Webhook, RequestsWebhookAdapter, Intents
+from cogs.utils.database import Database
+from cogs.utils.interactions import InteractionDispatcher, TooManyInteractions
+from cogs.utils.message_dispatcher import MessageDispatcher
+from cogs.utils.migrations import run_migrations
+from cogs.utils.scheduler import Scheduler
+from cogs.utils.write_behind import WriteBehindQueue
 
 __all__ = ["bot", "developer_role", "moderator_role", "muted_role"]
 
@@ -92,7 +98,19 @@ class Canary(commands.Bot):
         self.dev_logger = _dev_logger
         self.mod_logger = _mod_logger
         self.config = _parser
+        self.db = None
+        self.write_queue = None
+        self.scheduler = None
+        self._scheduler_task = None
         self._start_database()
+        self.message_dispatcher = MessageDispatcher(
+            self.dev_logger, self.config.message_concurrency, self.config.message_retries
+        )
+        self.interactions = InteractionDispatcher(
+            self, self.config.interactions["max_sessions_per_user"], self.config.interactions["max_sessions"]
+        )
+        self.add_listener(self.interactions.on_reaction_add, "on_reaction_add")
+        self.add_listener(self.interactions.on_message, "on_message")
 
     def _start_database(self):
         if not self.config.db_path:
@@ -105,9 +123,34 @@ class Canary(commands.Bot):
         with open(self.config.db_schema_path) as fp:
             c.executescript(fp.read())
         conn.commit()
+        run_migrations(conn, self.config.db_migrations_path, self.dev_logger)
         conn.close()
+        self.db = Database(self.config.db_path)
+        self.write_queue = WriteBehindQueue(
+            self.db, self.dev_logger, self.config.db_flush_interval, self.config.db_flush_rows
+        )
+        self.scheduler = Scheduler(self.db, self.dev_logger)
         self.dev_logger.debug("Database is ready")
 
+    async def _run_scheduler(self):
+        # Handlers use the guild's channels and members, so jobs only start
+        # running once the bot is ready
+        await self.wait_until_ready()
+        await self.scheduler.run()
+
+    async def start(self, *args, **kwargs):
+        if self.scheduler:
+            self._scheduler_task = self.loop.create_task(self._run_scheduler())
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        if self._scheduler_task:
+            self._scheduler_task.cancel()
+        await super().close()
+        if self.db:
+            await self.write_queue.flush()
+            await self.db.close()
+
     def log_traceback(self, exception):
         self.dev_logger.error("".join(traceback.format_exception(type(exception), exception, exception.__traceback__)))
 
@@ -138,6 +181,9 @@ class Canary(commands.Bot):
             if ctx.command.qualified_name == "tag list":
                 return await ctx.send("I could not find that member. Please try again.")
 
+        elif isinstance(error, TooManyInteractions):
+            return await ctx.send(str(error), delete_after=60)
+
         elif isinstance(error, commands.MaxConcurrencyReached):
             return await ctx.send(
                 f"The {ctx.command} command cannot be used "
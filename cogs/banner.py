@@ -17,19 +17,23 @@
 
 # discord-py requirements
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import utils
 
 # Other utilities
 from io import BytesIO
 import datetime
-import sqlite3
 import requests
 from PIL import Image, UnidentifiedImageError, ImageSequence
 import json
 from .utils.checks import is_moderator
+from .utils.interactions import interactive
+from .utils.scheduler import RetryJob
 import asyncio
 
+# Name of the scheduler's handler sending the reminder that a banner contest started
+CONTEST_REMINDER_JOB = "banner_contest_reminder"
+
 
 class Banner(commands.Cog):
     # Written by @le-potate
@@ -46,9 +50,12 @@ class Banner(commands.Cog):
         self.start_datetime = None
         self.week_name = None
         self.send_reminder = None
+        self.bot.loop.create_task(self.bot.scheduler.register(CONTEST_REMINDER_JOB, self.banner_contest_reminder))
 
-    @commands.Cog.listener()
-    async def on_ready(self):
+    def cog_unload(self):
+        self.bot.scheduler.unregister(CONTEST_REMINDER_JOB)
+
+    def _get_guild_objects(self):
         self.guild = self.bot.get_guild(self.bot.config.server_id)
         self.banner_of_the_week_channel = utils.get(
             self.guild.text_channels, name=self.bot.config.banner_of_the_week_channel
@@ -64,10 +71,11 @@ class Banner(commands.Cog):
         self.banner_winner_role = utils.get(self.guild.roles, name=self.bot.config.banner_winner_role)
         self.banner_vote_emoji = utils.get(self.guild.emojis, name=self.bot.config.banner_vote_emoji)
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("SELECT Value FROM Settings WHERE Key = ?", ("BannerContestInfo",))
-        fetched = c.fetchone()
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self._get_guild_objects()
+
+        fetched = await self.bot.db.fetchone("SELECT Value FROM Settings WHERE Key = ?", ("BannerContestInfo",))
         if fetched:
             banner_dict = json.loads(fetched[0])
             timestamp = banner_dict["timestamp"]
@@ -75,21 +83,16 @@ class Banner(commands.Cog):
                 self.start_datetime = datetime.datetime.fromtimestamp(timestamp)
                 self.week_name = banner_dict["week_name"]
                 self.send_reminder = banner_dict["send_reminder"]
-        conn.close()
 
-        self.check_banner_contest_reminder.start()
-
-    @tasks.loop(minutes=1.0)
-    async def check_banner_contest_reminder(self):
-        # todo: make general scheduled events db instead
-        if not all((self.guild, self.banner_reminders_role, self.banner_submissions_channel, self.start_datetime)):
-            return
-
-        if datetime.datetime.now() < self.start_datetime or not self.send_reminder:
+    async def banner_contest_reminder(self, _key, _payload):
+        # Scheduler handler, which can run before on_ready
+        if not self.guild:
+            self._get_guild_objects()
+        if not self.guild:
+            raise RetryJob("the guild is not available")
+        if not all((self.guild, self.banner_reminders_role, self.banner_submissions_channel)):
             return
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
         await self.banner_submissions_channel.send(
             f"{self.banner_reminders_role.mention} "
             f"Submissions are now open for the banner picture of the week! "
@@ -97,15 +100,14 @@ class Banner(commands.Cog):
             f"The winner will be chosen in around 12 hours "
             f"(To get these reminders, type `.iam Banner Submissions` in {self.bots_channel.mention})"
         )
-        c.execute("SELECT Value FROM Settings WHERE Key = ?", ("BannerContestInfo",))
-        fetched = c.fetchone()
+        fetched = await self.bot.db.fetchone("SELECT Value FROM Settings WHERE Key = ?", ("BannerContestInfo",))
         if fetched:
             self.send_reminder = False
             banner_dict = json.loads(fetched[0])
             banner_dict["send_reminder"] = False
-            c.execute("REPLACE INTO Settings VALUES (?, ?)", ("BannerContestInfo", json.dumps(banner_dict)))
-            conn.commit()
-        conn.close()
+            await self.bot.db.execute(
+                "REPLACE INTO Settings VALUES (?, ?)", ("BannerContestInfo", json.dumps(banner_dict))
+            )
 
     async def reset_banner_contest(self):
         self.start_datetime = None
@@ -113,15 +115,14 @@ class Banner(commands.Cog):
         self.send_reminder = None
 
         banner_dict = {"timestamp": None, "week_name": None, "send_reminder": None}
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("REPLACE INTO Settings VALUES (?, ?)", ("BannerContestInfo", json.dumps(banner_dict)))
-        c.execute("DELETE FROM BannerSubmissions")
-        conn.commit()
-        conn.close()
+        async with self.bot.db.transaction() as txn:
+            await txn.execute("REPLACE INTO Settings VALUES (?, ?)", ("BannerContestInfo", json.dumps(banner_dict)))
+            await txn.execute("DELETE FROM BannerSubmissions")
+            await self.bot.scheduler.cancel(CONTEST_REMINDER_JOB, "")
 
     @commands.command(aliases=["setbannercontest"])
     @is_moderator()
+    @interactive
     async def set_banner_contest(self, ctx):
         """
         Set a Banner Picture of the Week contest for the server.
@@ -161,7 +162,7 @@ class Banner(commands.Cog):
             return all((msg.author == ctx.message.author, msg.channel == ctx.channel))
 
         try:
-            date_msg = await self.bot.wait_for("message", check=msg_check, timeout=60)
+            date_msg = await self.bot.interactions.wait_for_message(ctx.channel, check=msg_check, timeout=60)
         except asyncio.TimeoutError:
             await ctx.send("Command timed out.")
             return
@@ -185,18 +186,17 @@ class Banner(commands.Cog):
         )
 
         try:
-            week_msg = await self.bot.wait_for("message", check=msg_check, timeout=60)
+            week_msg = await self.bot.interactions.wait_for_message(ctx.channel, check=msg_check, timeout=60)
         except asyncio.TimeoutError:
             await ctx.send("Command timed out.")
             return
         week_name = week_msg.content
 
         banner_dict = {"timestamp": timestamp, "week_name": week_name, "send_reminder": True}
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("REPLACE INTO Settings VALUES (?, ?)", ("BannerContestInfo", json.dumps(banner_dict)))
-        c.execute("DELETE FROM BannerSubmissions")
-        conn.commit()
+        async with self.bot.db.transaction() as txn:
+            await txn.execute("REPLACE INTO Settings VALUES (?, ?)", ("BannerContestInfo", json.dumps(banner_dict)))
+            await txn.execute("DELETE FROM BannerSubmissions")
+            await self.bot.scheduler.schedule(CONTEST_REMINDER_JOB, "", timestamp)
 
         self.start_datetime = datetime.datetime.fromtimestamp(timestamp)
         self.week_name = week_name
@@ -206,10 +206,10 @@ class Banner(commands.Cog):
             f"Start time for the banner contest of the week of `{week_name}` successfully set to "
             f"`{self.start_datetime.strftime('%Y-%m-%d %H:%M')}`."
         )
-        conn.close()
 
     @commands.command(aliases=["bannerwinner", "setbannerwinner", "set_banner_winner"])
     @is_moderator()
+    @interactive
     async def banner_winner(self, ctx, winner: discord.Member = None):
         """
         Select the winner for an ongoing Banner Picture of the Week contest
@@ -245,7 +245,7 @@ class Banner(commands.Cog):
             )
 
             try:
-                winner_msg = await self.bot.wait_for("message", check=msg_check, timeout=60)
+                winner_msg = await self.bot.interactions.wait_for_message(ctx.channel, check=msg_check, timeout=60)
             except asyncio.TimeoutError:
                 await ctx.send("Command timed out.")
                 return
@@ -270,11 +270,7 @@ class Banner(commands.Cog):
             return
 
         winner_id = winner.id
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("SELECT * FROM BannerSubmissions WHERE UserID = ?", (winner_id,))
-        fetched = c.fetchone()
-        conn.close()
+        fetched = await self.bot.db.fetchone("SELECT * FROM BannerSubmissions WHERE UserID = ?", (winner_id,))
 
         if not fetched:
             await ctx.send("No submission by this user in database. Exiting command.")
@@ -323,7 +319,7 @@ class Banner(commands.Cog):
             )
 
         try:
-            confirmation_msg = await self.bot.wait_for("message", check=msg_check, timeout=60)
+            confirmation_msg = await self.bot.interactions.wait_for_message(ctx.channel, check=msg_check, timeout=60)
         except asyncio.TimeoutError:
             await ctx.send("Command timed out.")
             return
@@ -391,9 +387,6 @@ class Banner(commands.Cog):
 
         You must be a verified user to use this command.
         """
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-
         if not (
             discord.utils.get(ctx.author.roles, name=self.bot.config.mcgillian_role)
             or discord.utils.get(ctx.author.roles, name=self.bot.config.honorary_mcgillian_role)
@@ -405,9 +398,7 @@ class Banner(commands.Cog):
             await ctx.send("You cannot submit banners if you have the Trash Tier Banner Submissions role")
             return
 
-        c.execute("SELECT Value FROM Settings WHERE Key = ?", ("BannerContestInfo",))
-
-        fetched = c.fetchone()
+        fetched = await self.bot.db.fetchone("SELECT Value FROM Settings WHERE Key = ?", ("BannerContestInfo",))
         if not fetched:
             await ctx.send("No banner contest is currently set")
             return
@@ -525,8 +516,9 @@ class Banner(commands.Cog):
             return
 
         replaced_message = False
-        c.execute("SELECT PreviewMessageID FROM BannerSubmissions WHERE UserID = ?", (ctx.author.id,))
-        fetched = c.fetchone()
+        fetched = await self.bot.db.fetchone(
+            "SELECT PreviewMessageID FROM BannerSubmissions WHERE UserID = ?", (ctx.author.id,)
+        )
         if fetched:
             try:
                 message_to_replace = await self.banner_submissions_channel.fetch_message(fetched[0])
@@ -563,11 +555,9 @@ class Banner(commands.Cog):
         )
         await preview_message.add_reaction(self.banner_vote_emoji)
 
-        c.execute(
+        await self.bot.db.execute(
             "REPLACE INTO BannerSubmissions VALUES (?, ?, ?)", (ctx.author.id, preview_message.id, converted_message.id)
         )
-        conn.commit()
-        conn.close()
         await ctx.send(f"Banner successfully {'resubmitted' if replaced_message else 'submitted'}!")
 
 
@@ -25,13 +25,15 @@ from discord.ext import commands
 from typing import Dict, List, Optional, Tuple
 
 # For DB functionality
-import sqlite3
 import datetime
 from .utils.members import add_member_if_needed
+from .utils.checks import is_developer
+from .utils.ledger_compaction import compact_ledger_online
 
 # For tables
+import math
 from tabulate import tabulate
-from .utils.paginator import Pages
+from .utils.paginator import Pages, PageSource, SQLPageSource
 
 # For general currency shenanigans
 from decimal import Decimal, InvalidOperation
@@ -57,6 +59,8 @@ ACTION_GIFTER = "gifter"
 ACTION_GIFTEE = "giftee"
 HANGMAN_REWARD = "hangman_reward"
 
+LEADERBOARD_TABLE_ROWS = 7
+
 TRANSACTION_ACTIONS = (
     ACTION_INITIAL_CLAIM,
     ACTION_CLAIM,
@@ -68,43 +72,85 @@ TRANSACTION_ACTIONS = (
 )
 
 
+class LeaderboardPageSource(PageSource):
+    def __init__(self, currency_cog):
+        """The pages of the currency leaderboard: each item is a table of
+        LEADERBOARD_TABLE_ROWS balances, only built when its page is shown."""
+        self.currency_cog = currency_cog
+        # Sorted from richest to poorest, walking the balances_balance index
+        self.balances = SQLPageSource(
+            currency_cog.bot.db,
+            "SELECT M.Name, B.Balance, B.Balance, B.UserID FROM Balances AS B, Members as M "
+            "WHERE B.UserID = M.ID AND {after} ORDER BY B.Balance DESC, B.UserID DESC",
+            key_condition="(B.Balance, B.UserID) < (?, ?)",
+            key_columns=2,
+        )
+        self.prefetch = self.balances.prefetch
+
+    def reset(self) -> None:
+        self.balances.reset()
+
+    async def count(self) -> int:
+        return math.ceil(await self.balances.count() / LEADERBOARD_TABLE_ROWS)
+
+    async def fetch(self, offset: int, limit: int) -> List[str]:
+        first_rank = offset * LEADERBOARD_TABLE_ROWS + 1
+        rows = await self.balances.fetch(first_rank - 1, limit * LEADERBOARD_TABLE_ROWS)
+        table = [
+            (rank, name, self.currency_cog.format_symbol_currency(self.currency_cog.db_to_currency(balance)))
+            for rank, (name, balance) in enumerate(rows, first_rank)
+        ]
+        return [
+            tabulate(table[i : i + LEADERBOARD_TABLE_ROWS], headers=["Rank", "Name", "Balance"], tablefmt="fancy_grid")
+            for i in range(0, len(table), LEADERBOARD_TABLE_ROWS)
+        ]
+
+
 class Currency(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.currency = self.bot.config.currency
         self.prec = self.currency["precision"]
 
-    async def fetch_all_balances(self) -> List[Tuple[str, str, Decimal]]:
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute(
-            "SELECT BT.UserID, M.Name, IFNULL(SUM(BT.Amount), 0) "
-            "FROM BankTransactions AS BT, Members as M "
-            "WHERE BT.UserID = M.ID GROUP BY UserID"
-        )
-
-        results = [(user_id, name, self.db_to_currency(balance)) for user_id, name, balance in c.fetchall()]
-
-        conn.close()
-
-        return results
-
     async def fetch_bank_balance(self, user: discord.Member) -> Decimal:
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("SELECT IFNULL(SUM(Amount), 0) FROM BankTransactions WHERE " "UserID = ?", (user.id,))
+        fetched = await self.bot.db.fetchone("SELECT Balance FROM Balances WHERE UserID = ?", (user.id,))
+
+        if fetched is None:
+            return Decimal(0)
 
-        balance = self.db_to_currency(c.fetchone()[0])
-        if balance is None:
-            balance = Decimal(0)
+        return self.db_to_currency(fetched[0])
 
-        conn.close()
+    async def find_balance_mismatches(self, fix: bool = False) -> List[Tuple[int, int, int]]:
+        """
+        Re-derives every balance from the BankTransactions ledger and returns
+        the (user ID, snapshot balance, ledger balance) of each user whose
+        entry in the Balances snapshot doesn't match. If fix is True, the
+        snapshot is corrected to match the ledger.
+        """
+        async with self.bot.db.transaction() as txn:
+            mismatches = await txn.fetchall(
+                "SELECT L.UserID, B.Balance, L.Balance "
+                "FROM (SELECT UserID, SUM(Amount) AS Balance FROM BankTransactions GROUP BY UserID) AS L "
+                "LEFT JOIN Balances AS B ON B.UserID = L.UserID "
+                "WHERE B.Balance IS NULL OR B.Balance != L.Balance "
+                "UNION ALL "
+                "SELECT B.UserID, B.Balance, NULL FROM Balances AS B "
+                "WHERE B.UserID NOT IN (SELECT UserID FROM BankTransactions)"
+            )
+            if fix and mismatches:
+                await txn.executemany(
+                    "DELETE FROM Balances WHERE UserID = ?", ((user_id,) for user_id, _, _ in mismatches)
+                )
+                await txn.executemany(
+                    "INSERT INTO Balances VALUES (?, ?)",
+                    ((user_id, ledger) for user_id, _, ledger in mismatches if ledger is not None),
+                )
 
-        return balance
+        return mismatches
 
-    async def create_bank_transaction(self, c, user: discord.Member, amount: Decimal, action: str, metadata: Dict):
-        # Don't create another connection in this function in order to properly
-        # transaction-ify a series of bank "transactions".
+    async def create_bank_transaction(self, db, user: discord.Member, amount: Decimal, action: str, metadata: Dict):
+        # Pass in a transaction from self.bot.db.transaction() in order to
+        # properly transaction-ify a series of bank "transactions".
 
         if action not in TRANSACTION_ACTIONS:
             self.bot.logger.info("Error: Invalid bank transaction '{}'".format(action))
@@ -112,10 +158,20 @@ class Currency(commands.Cog):
 
         now = int(datetime.datetime.now().timestamp())
 
-        c.execute("PRAGMA foreign_keys = ON")
-        await add_member_if_needed(self, c, user.id)
-        t = (user.id, self.currency_to_db(amount), action, json.dumps(metadata), now)
-        c.execute("INSERT INTO BankTransactions(UserID, Amount, Action, " "Metadata, Date) VALUES(?, ?, ?, ?, ?)", t)
+        await add_member_if_needed(self, db, user.id, str(user))
+        db_amount = self.currency_to_db(amount)
+        t = (user.id, db_amount, action, json.dumps(metadata), now)
+
+        # The Balances snapshot must change in the same transaction as the
+        # ledger; this joins the caller's transaction if there is one
+        async with self.bot.db.transaction() as txn:
+            await txn.execute(
+                "INSERT INTO BankTransactions(UserID, Amount, Action, " "Metadata, Date) VALUES(?, ?, ?, ?, ?)", t
+            )
+            await txn.execute(
+                "INSERT INTO Balances VALUES (?, ?) ON CONFLICT(UserID) DO UPDATE SET Balance = Balance + ?",
+                (user.id, db_amount, db_amount),
+            )
 
     def parse_currency(self, amount: str, balance: Decimal):
         if amount.lower().strip() in CURRENCY_ALL:
@@ -172,38 +228,33 @@ class Currency(commands.Cog):
         # Start bot typing
         await ctx.trigger_typing()
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
+        author_name = ctx.message.author.display_name
 
-        c.execute(
-            "SELECT IFNULL(MAX(Date), 0) FROM BankTransactions " "WHERE UserID = ? AND Action = ?",
-            (ctx.message.author.id, ACTION_INITIAL_CLAIM),
-        )
+        async with self.bot.db.transaction() as txn:
+            fetched = await txn.fetchone(
+                "SELECT IFNULL(MAX(Date), 0) FROM BankTransactions " "WHERE UserID = ? AND Action = ?",
+                (ctx.message.author.id, ACTION_INITIAL_CLAIM),
+            )
 
-        claim_time = c.fetchone()[0]
+            claim_time = fetched[0]
 
-        author_name = ctx.message.author.display_name
+            if claim_time == 0:
+                metadata = {"channel": ctx.message.channel.id}
+
+                await self.create_bank_transaction(
+                    txn, ctx.message.author, self.currency["initial_amount"], ACTION_INITIAL_CLAIM, metadata
+                )
 
         if claim_time > 0:
             await ctx.send("{} has already claimed their initial " "currency.".format(author_name))
             return
 
-        metadata = {"channel": ctx.message.channel.id}
-
-        await self.create_bank_transaction(
-            c, ctx.message.author, self.currency["initial_amount"], ACTION_INITIAL_CLAIM, metadata
-        )
-
-        conn.commit()
-
         await ctx.send(
             "{} claimed their initial {}!".format(
                 author_name, self.format_symbol_currency(self.currency["initial_amount"])
             )
         )
 
-        conn.close()
-
     @commands.command()
     async def claim(self, ctx):
         """
@@ -213,26 +264,21 @@ class Currency(commands.Cog):
         # Start bot typing
         await ctx.trigger_typing()
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
+        async with self.bot.db.transaction() as txn:
+            fetched = await txn.fetchone(
+                "SELECT IFNULL(MAX(Date), 0) FROM BankTransactions " "WHERE UserID = ? AND Action = ?",
+                (ctx.message.author.id, ACTION_CLAIM),
+            )
 
-        c.execute(
-            "SELECT IFNULL(MAX(Date), 0) FROM BankTransactions " "WHERE UserID = ? AND Action = ?",
-            (ctx.message.author.id, ACTION_CLAIM),
-        )
+            last_claimed = datetime.datetime.fromtimestamp(fetched[0])
+            threshold = datetime.datetime.now() - CLAIM_WAIT_TIME
 
-        last_claimed = datetime.datetime.fromtimestamp(c.fetchone()[0])
-        threshold = datetime.datetime.now() - CLAIM_WAIT_TIME
+            if last_claimed < threshold:
+                metadata = {"channel": ctx.message.channel.id}
+                await self.create_bank_transaction(txn, ctx.message.author, CLAIM_AMOUNT, ACTION_CLAIM, metadata)
 
         if last_claimed < threshold:
             author_name = ctx.message.author.display_name if ctx.message.author else ":b:roken bot"
-
-            metadata = {"channel": ctx.message.channel.id}
-
-            await self.create_bank_transaction(c, ctx.message.author, CLAIM_AMOUNT, ACTION_CLAIM, metadata)
-
-            conn.commit()
-
             await ctx.send("{} claimed {}!".format(author_name, self.format_symbol_currency(CLAIM_AMOUNT)))
 
         else:
@@ -241,8 +287,6 @@ class Currency(commands.Cog):
                 "Please wait {}h {}m to claim again!".format(time_left.seconds // 3600, time_left.seconds // 60 % 60)
             )
 
-        conn.close()
-
     @commands.command(aliases=["$", "bal"])
     async def balance(self, ctx, user: discord.Member = None):
         """
@@ -290,16 +334,13 @@ class Currency(commands.Cog):
 
         # If all cases pass, perform the gamble
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-
         result = random.choice(COIN_FLIP_CHOICES)
 
         metadata = {"result": result, "channel": ctx.message.channel.id}
 
         amount = bet_dec if choice == result else -bet_dec
-        await self.create_bank_transaction(c, ctx.message.author, amount, ACTION_BET_FLIP, metadata)
-        conn.commit()
+        async with self.bot.db.transaction() as txn:
+            await self.create_bank_transaction(txn, ctx.message.author, amount, ACTION_BET_FLIP, metadata)
 
         message = "Sorry! {} lost {} (result was **{}**)."
         if choice == result:
@@ -309,8 +350,6 @@ class Currency(commands.Cog):
 
         await ctx.send(message.format(author_name, self.format_symbol_currency(bet_dec), result))
 
-        conn.close()
-
     @commands.command(aliases=["br"])
     async def bet_roll(self, ctx, bet: str = None):
         """
@@ -335,9 +374,6 @@ class Currency(commands.Cog):
 
         # If all cases pass, perform the gamble
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-
         result = random.randrange(1, 101)
         amount_returned = Decimal(0)
 
@@ -353,9 +389,10 @@ class Currency(commands.Cog):
             "channel": ctx.message.channel.id,
         }
 
-        await self.create_bank_transaction(c, ctx.message.author, amount_returned - bet_dec, ACTION_BET_ROLL, metadata)
-
-        conn.commit()
+        async with self.bot.db.transaction() as txn:
+            await self.create_bank_transaction(
+                txn, ctx.message.author, amount_returned - bet_dec, ACTION_BET_ROLL, metadata
+            )
 
         message = "Sorry! {un} lost {am} (result was **{re}**)."
         if amount_returned == bet_dec:
@@ -370,8 +407,6 @@ class Currency(commands.Cog):
 
         await ctx.send(message.format(un=author_name, am=bet_str, re=result))
 
-        conn.close()
-
     @commands.command()
     async def give(self, ctx, user: discord.Member = None, amount: str = None):
         """
@@ -420,18 +455,14 @@ class Currency(commands.Cog):
 
         giftee_metadata = {"gifter": ctx.message.author.id, "channel": ctx.message.channel.id}
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-
-        await self.create_bank_transaction(c, ctx.message.author, -amount_dec, ACTION_GIFTER, gifter_metadata)
+        async with self.bot.db.transaction() as txn:
+            await self.create_bank_transaction(txn, ctx.message.author, -amount_dec, ACTION_GIFTER, gifter_metadata)
 
-        await self.create_bank_transaction(c, user, amount_dec, ACTION_GIFTEE, giftee_metadata)
+            await self.create_bank_transaction(txn, user, amount_dec, ACTION_GIFTEE, giftee_metadata)
 
-        conn.commit()
-
-        await ctx.send("{} gave {} to {}!".format(grn, self.format_symbol_currency(amount_dec), gen))
-
-        conn.close()
+        await self.bot.message_dispatcher.send(
+            ctx, "{} gave {} to {}!".format(grn, self.format_symbol_currency(amount_dec), gen)
+        )
 
     @commands.command(aliases=["lb"])
     async def leaderboard(self, ctx):
@@ -441,26 +472,64 @@ class Currency(commands.Cog):
 
         await ctx.trigger_typing()
 
-        balances = sorted(await self.fetch_all_balances(), reverse=True, key=lambda b: b[2])
+        source = LeaderboardPageSource(self)
 
-        if len(balances) == 0:
+        if not await source.count():
             await ctx.send("Leaderboards are not yet available for this server, please " "collect some currency.")
             return
 
-        table = []
-        table_list = []
-        counter = 1
+        p = Pages(ctx, page_source=source, title="Currency ranking", display_option=(0, 1), editable_content=False)
 
-        for (_user_id, name, balance) in balances:
-            table.append((counter, name, self.format_symbol_currency(balance)))
-            if counter % 7 == 0 or counter == len(balances):
-                table_list.append(tabulate(table[:counter], headers=["Rank", "Name", "Balance"], tablefmt="fancy_grid"))
-                del table[:]
-            counter += 1
+        await p.paginate()
 
-        p = Pages(ctx, item_list=table_list, title="Currency ranking", display_option=(0, 1), editable_content=False)
+    @commands.command(aliases=["checkbalances"])
+    @is_developer()
+    async def check_balances(self, ctx, fix: str = None):
+        """
+        Checks the balance snapshot against the transaction ledger.
+        Use ?check_balances fix to correct any mismatch found.
+        """
 
-        await p.paginate()
+        await ctx.trigger_typing()
+
+        mismatches = await self.find_balance_mismatches(fix=fix == "fix")
+
+        if not mismatches:
+            await ctx.send("All balances match the transaction ledger.")
+            return
+
+        for user_id, snapshot, ledger in mismatches:
+            self.bot.dev_logger.warning(f"Balance mismatch for user {user_id}: snapshot {snapshot}, ledger {ledger}")
+
+        await ctx.send(
+            f"Found {len(mismatches)} balance{'s' if len(mismatches) != 1 else ''} not matching the ledger"
+            f"{' (fixed)' if fix == 'fix' else ''}. See the dev logs for details."
+        )
+
+    @commands.command(aliases=["compactledger"])
+    @is_developer()
+    async def compact_ledger(self, ctx, days: int = None):
+        """
+        Rolls bank transactions older than the given number of days (by
+        default, the configured compaction horizon) into one checkpoint
+        transaction per user and action. Balances are unchanged and the
+        replaced transactions are archived.
+        """
+
+        await ctx.trigger_typing()
+
+        if days is None:
+            days = self.currency["compaction_horizon"]
+        horizon = datetime.datetime.now() - datetime.timedelta(days=days)
+        replaced, checkpoints = await compact_ledger_online(self.bot.db, horizon, self.currency["ledger_archive_path"])
+
+        self.bot.dev_logger.info(
+            f"Ledger compaction: replaced {replaced} transactions older than {horizon:%Y-%m-%d} "
+            f"with {checkpoints} checkpoints"
+        )
+        await ctx.send(
+            f"Replaced {replaced} transactions older than {horizon:%Y-%m-%d} with {checkpoints} checkpoints."
+        )
 
 
 def setup(bot):
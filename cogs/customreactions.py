@@ -21,11 +21,12 @@ from discord.ext import commands
 import asyncio
 
 # Other utilities
+import bisect
 import random
-import sqlite3
+from .utils.interactions import interactive
 from .utils.paginator import Pages
 import time
-from .utils.p_strings import PStringEncodings
+from .utils.p_strings import PStringEncodings, get_input_string_problem
 
 EMOJI = {
     "new": "🆕",
@@ -63,40 +64,88 @@ class CustomReactions(commands.Cog):
         self.reaction_list = []
         self.proposal_list = []
         self.p_strings = None
-        self.rebuild_lists()
+        # keys of the prompts already reported as slow (None for the
+        # combined prompts), so that they are not reported for every message
+        self.reported_slow_prompts = set()
+        self.bot.loop.create_task(self.rebuild_lists())
 
-    def rebuild_lists(self):
-        self.rebuild_reaction_list()
-        self.rebuild_proposal_list()
+    async def rebuild_lists(self):
+        await self.rebuild_reaction_list()
+        await self.rebuild_proposal_list()
 
-    def rebuild_reaction_list(self):
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("SELECT * FROM CustomReactions WHERE Proposal = 0")
-        self.reaction_list = c.fetchall()
+    async def rebuild_reaction_list(self):
+        self.reaction_list = await self.bot.db.fetchall("SELECT * FROM CustomReactions WHERE Proposal = 0")
         prompts = [row[1].lower() for row in self.reaction_list]
         responses = [row[2] for row in self.reaction_list]
         anywhere_values = [row[5] for row in self.reaction_list]
         additional_info_list = [(row[4], row[6]) for row in self.reaction_list]
         self.p_strings = PStringEncodings(
-            prompts, responses, anywhere_values, additional_info_list=additional_info_list
+            prompts,
+            responses,
+            anywhere_values,
+            additional_info_list=additional_info_list,
+            keys=[row[0] for row in self.reaction_list],
+            on_slow_pattern=self.report_slow_prompt,
+            slow_pattern_threshold=self.bot.config.regex["slow_pattern_threshold"],
         )
-        conn.close()
+        self.reported_slow_prompts.clear()
 
-    def rebuild_proposal_list(self):
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("SELECT * FROM CustomReactions WHERE Proposal = 1")
-        self.proposal_list = c.fetchall()
-        conn.close()
+    def report_slow_prompt(self, custom_react_id, elapsed, timed_out):
+        if custom_react_id in self.reported_slow_prompts:
+            return
+        self.reported_slow_prompts.add(custom_react_id)
+        if custom_react_id is None:
+            self.bot.dev_logger.warning(
+                f"Matching a message against the custom reaction prompts ran out of time ({elapsed * 1000:.0f} ms)"
+            )
+            return
+        prompt = self.p_strings.patterns_and_p_strings[custom_react_id][0].pattern
+        self.bot.dev_logger.warning(
+            f"Custom reaction {custom_react_id} is slow to match "
+            f"({elapsed * 1000:.0f} ms{', ran out of time' if timed_out else ''}): {prompt}"
+        )
+
+    async def get_prompt_problem(self, prompt):
+        # run in an executor since checking a slow prompt takes a while
+        return await asyncio.get_running_loop().run_in_executor(
+            None, get_input_string_problem, prompt.lower(), self.bot.config.regex["message_budget"]
+        )
+
+    async def rebuild_proposal_list(self):
+        self.proposal_list = await self.bot.db.fetchall("SELECT * FROM CustomReactions WHERE Proposal = 1")
+
+    async def update_custom_reaction(self, custom_react_id):
+        """
+        Updates the lists and the prompt matcher after the custom reaction
+        (or proposal) with the given ID was added, modified or deleted,
+        without reloading the other ones.
+        """
+        if self.p_strings is None:
+            # still being loaded, which will include this change
+            return
+        row = await self.bot.db.fetchone("SELECT * FROM CustomReactions WHERE CustomReactionID = ?", (custom_react_id,))
+        self.reaction_list = [reaction for reaction in self.reaction_list if reaction[0] != custom_react_id]
+        self.proposal_list = [proposal for proposal in self.proposal_list if proposal[0] != custom_react_id]
+        self.p_strings.remove(custom_react_id)
+        self.reported_slow_prompts.discard(custom_react_id)
+        if row is None:
+            return
+        if row[7]:
+            bisect.insort(self.proposal_list, row, key=lambda reaction: reaction[0])
+        else:
+            bisect.insort(self.reaction_list, row, key=lambda reaction: reaction[0])
+            self.p_strings.set(custom_react_id, row[1].lower(), row[2], row[5], additional_info=(row[4], row[6]))
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.author == self.bot.user:
+        if message.author == self.bot.user or self.p_strings is None:
             return
 
         response = self.p_strings.parser(
-            message.content.lower(), user=message.author.mention, channel=str(message.channel)
+            message.content.lower(),
+            user=message.author.mention,
+            channel=str(message.channel),
+            budget=self.bot.config.regex["message_budget"],
         )
         if response:
             # delete the prompt if DeletePrompt option is activated
@@ -112,6 +161,7 @@ class CustomReactions(commands.Cog):
 
     @commands.max_concurrency(1, per=commands.BucketType.user, wait=False)
     @commands.command(aliases=["customreaction", "customreacts", "customreact"])
+    @interactive
     async def customreactions(self, ctx):
         current_options = []
         main_user = ctx.message.author
@@ -162,8 +212,8 @@ class CustomReactions(commands.Cog):
 
         async def wait_for_reaction(message):
             try:
-                reaction, user = await self.bot.wait_for(
-                    "reaction_add", check=get_reaction_check(reaction_user=main_user), timeout=60
+                reaction, user = await self.bot.interactions.wait_for_reaction(
+                    initial_message, check=get_reaction_check(reaction_user=main_user), timeout=60
                 )
             except asyncio.TimeoutError:
                 await message.clear_reactions()
@@ -173,7 +223,9 @@ class CustomReactions(commands.Cog):
 
         async def wait_for_message(message):
             try:
-                msg = await self.bot.wait_for("message", check=get_msg_check(msg_user=main_user), timeout=60)
+                msg = await self.bot.interactions.wait_for_message(
+                    ctx.channel, check=get_msg_check(msg_user=main_user), timeout=60
+                )
             except asyncio.TimeoutError:
                 await message.clear_reactions()
                 await message.edit(embed=discord.Embed(title=CUSTOM_REACTION_TIMEOUT), delete_after=60)
@@ -283,6 +335,13 @@ class CustomReactions(commands.Cog):
             if prompt_message.lower() == STOP_TEXT:
                 await leave(message)
                 return True
+            problem = await self.get_prompt_problem(prompt_message)
+            if problem:
+                await message.edit(
+                    embed=discord.Embed(title="This prompt cannot be used", description=f"Because {problem}."),
+                    delete_after=60,
+                )
+                return
             description = f"Prompt: {prompt_message}\nWrite the response " f"the bot will send"
             await message.edit(
                 embed=discord.Embed(title=title, description=description).set_footer(
@@ -341,18 +400,14 @@ class CustomReactions(commands.Cog):
 
                 current_options.clear()
                 await message.clear_reactions()
-                conn = sqlite3.connect(self.bot.config.db_path)
-                c = conn.cursor()
                 t = (prompt_message, response, main_user.id, delete, anywhere, dm, not is_moderator)
-                c.execute(
+                cursor = await self.bot.db.execute(
                     "INSERT INTO CustomReactions(Prompt, Response, UserID, "
                     "DeletePrompt, Anywhere, DM, Proposal) "
                     "VALUES(?,?,?,?,?,?,?)",
                     t,
                 )
-                conn.commit()
-                conn.close()
-                self.rebuild_lists()
+                await self.update_custom_reaction(cursor.lastrowid)
 
                 if is_moderator:
                     title = "Custom reaction successfully added!"
@@ -462,8 +517,8 @@ class CustomReactions(commands.Cog):
                 await message.edit(embed=message.embeds[0])
                 number = 0
                 try:
-                    msg = await self.bot.wait_for(
-                        "message",
+                    msg = await self.bot.interactions.wait_for_message(
+                        ctx.channel,
                         check=get_number_check(msg_user=user_modifying, number_range=range(1, len(current_list) + 1)),
                         timeout=60,
                     )
@@ -637,8 +692,8 @@ class CustomReactions(commands.Cog):
             await message.edit(embed=discord.Embed(title=title, description=description))
 
             try:
-                reaction, user = await self.bot.wait_for(
-                    "reaction_add", check=get_reaction_check(moderators=True), timeout=40
+                reaction, user = await self.bot.interactions.wait_for_reaction(
+                    initial_message, check=get_reaction_check(moderators=True), timeout=40
                 )
                 left = await edit_custom_react(message, reaction, user, custom_react, proposals)
                 if left:
@@ -655,8 +710,6 @@ class CustomReactions(commands.Cog):
             delete = custom_react[4]
             anywhere = custom_react[5]
             dm = custom_react[6]
-            conn = sqlite3.connect(self.bot.config.db_path)
-            c = conn.cursor()
 
             # Edit the prompt
             if reaction.emoji == EMOJI["one"]:
@@ -679,7 +732,9 @@ class CustomReactions(commands.Cog):
                     )
                 )
                 try:
-                    msg = await self.bot.wait_for("message", check=get_msg_check(msg_user=user), timeout=60)
+                    msg = await self.bot.interactions.wait_for_message(
+                        ctx.channel, check=get_msg_check(msg_user=user), timeout=60
+                    )
 
                 except asyncio.TimeoutError:
                     if proposals:
@@ -695,7 +750,6 @@ class CustomReactions(commands.Cog):
                             "Returning to list of current reactions..."
                         )
                     await message.edit(embed=discord.Embed(title=title))
-                    conn.close()
                     await asyncio.sleep(5)
                     return
 
@@ -706,10 +760,19 @@ class CustomReactions(commands.Cog):
                     await leave(message)
                     return True
 
+                problem = await self.get_prompt_problem(prompt)
+                if problem:
+                    if proposals:
+                        title = "This prompt cannot be used. Returning to list of reaction proposals..."
+                    else:
+                        title = "This prompt cannot be used. Returning to list of current reactions..."
+                    await message.edit(embed=discord.Embed(title=title, description=f"Because {problem}."))
+                    await asyncio.sleep(5)
+                    return
+
                 t = (prompt, custom_react_id)
-                c.execute("UPDATE CustomReactions SET Prompt = ? " "WHERE CustomReactionID = ?", t)
-                conn.commit()
-                self.rebuild_lists()
+                await self.bot.db.execute("UPDATE CustomReactions SET Prompt = ? " "WHERE CustomReactionID = ?", t)
+                await self.update_custom_reaction(custom_react_id)
                 if proposals:
                     title = "Prompt successfully modified! " "Returning to list of reaction proposals..."
                 else:
@@ -717,7 +780,6 @@ class CustomReactions(commands.Cog):
                 await message.edit(
                     embed=discord.Embed(title=title).set_footer(text=f"Modified by {user}.", icon_url=user.avatar_url)
                 )
-                conn.close()
                 await asyncio.sleep(5)
 
             # Edit the response
@@ -742,7 +804,9 @@ class CustomReactions(commands.Cog):
                 )
 
                 try:
-                    msg = await self.bot.wait_for("message", check=get_msg_check(msg_user=user), timeout=60)
+                    msg = await self.bot.interactions.wait_for_message(
+                        ctx.channel, check=get_msg_check(msg_user=user), timeout=60
+                    )
 
                 except asyncio.TimeoutError:
                     if proposals:
@@ -758,7 +822,6 @@ class CustomReactions(commands.Cog):
                             "Returning to list of current reactions..."
                         )
                     await message.edit(embed=discord.Embed(title=title))
-                    conn.close()
                     await asyncio.sleep(5)
                     return
 
@@ -770,9 +833,8 @@ class CustomReactions(commands.Cog):
                     return True
 
                 t = (response, custom_react_id)
-                c.execute("UPDATE CustomReactions SET Response = ? " "WHERE CustomReactionID = ?", t)
-                conn.commit()
-                self.rebuild_lists()
+                await self.bot.db.execute("UPDATE CustomReactions SET Response = ? " "WHERE CustomReactionID = ?", t)
+                await self.update_custom_reaction(custom_react_id)
                 if proposals:
                     title = "Response successfully modified! " "Returning to list of reaction proposals..."
                 else:
@@ -780,7 +842,6 @@ class CustomReactions(commands.Cog):
                 await message.edit(
                     embed=discord.Embed(title=title).set_footer(text=f"Modified by {user}.", icon_url=user.avatar_url)
                 )
-                conn.close()
                 await asyncio.sleep(5)
 
             # Edit the "delete" option
@@ -809,8 +870,8 @@ class CustomReactions(commands.Cog):
                 )
 
                 try:
-                    reaction, reaction_user = await self.bot.wait_for(
-                        "reaction_add", check=get_reaction_check(reaction_user=user), timeout=60
+                    reaction, reaction_user = await self.bot.interactions.wait_for_reaction(
+                        initial_message, check=get_reaction_check(reaction_user=user), timeout=60
                     )
 
                 except asyncio.TimeoutError:
@@ -827,7 +888,6 @@ class CustomReactions(commands.Cog):
                             "Returning to list of current reactions..."
                         )
                     await message.edit(embed=discord.Embed(title=title))
-                    conn.close()
                     await asyncio.sleep(5)
                     current_options.clear()
                     await message.clear_reactions()
@@ -847,13 +907,13 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
                     else:
                         t = (0, custom_react_id)
-                        c.execute("UPDATE CustomReactions SET DeletePrompt = ? " "WHERE CustomReactionID = ?", t)
-                        conn.commit()
-                        self.rebuild_lists()
+                        await self.bot.db.execute(
+                            "UPDATE CustomReactions SET DeletePrompt = ? " "WHERE CustomReactionID = ?", t
+                        )
+                        await self.update_custom_reaction(custom_react_id)
                         if proposals:
                             title = (
                                 "Option successfully modified! " "Returning to list of current " "reaction proposals..."
@@ -865,7 +925,6 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
 
                 # Activate the "delete" option
@@ -880,13 +939,13 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
                     else:
                         t = (1, custom_react_id)
-                        c.execute("UPDATE CustomReactions SET DeletePrompt = ? " "WHERE CustomReactionID = ?", t)
-                        conn.commit()
-                        self.rebuild_lists()
+                        await self.bot.db.execute(
+                            "UPDATE CustomReactions SET DeletePrompt = ? " "WHERE CustomReactionID = ?", t
+                        )
+                        await self.update_custom_reaction(custom_react_id)
                         if proposals:
                             title = (
                                 "Option successfully modified! " "Returning to list of current " "reaction proposals..."
@@ -898,7 +957,6 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
                 # Stop
                 elif reaction.emoji == EMOJI["stop_button"]:
@@ -930,8 +988,8 @@ class CustomReactions(commands.Cog):
                     )
                 )
                 try:
-                    reaction, reaction_user = await self.bot.wait_for(
-                        "reaction_add", check=get_reaction_check(reaction_user=user), timeout=60
+                    reaction, reaction_user = await self.bot.interactions.wait_for_reaction(
+                        initial_message, check=get_reaction_check(reaction_user=user), timeout=60
                     )
 
                 except asyncio.TimeoutError:
@@ -948,7 +1006,6 @@ class CustomReactions(commands.Cog):
                             "Returning to list of current reactions..."
                         )
                     await message.edit(embed=discord.Embed(title=title))
-                    conn.close()
                     await asyncio.sleep(5)
                     current_options.clear()
                     await message.clear_reactions()
@@ -968,13 +1025,13 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
                     else:
                         t = (0, custom_react_id)
-                        c.execute("UPDATE CustomReactions SET Anywhere = ? " "WHERE CustomReactionID = ?", t)
-                        conn.commit()
-                        self.rebuild_lists()
+                        await self.bot.db.execute(
+                            "UPDATE CustomReactions SET Anywhere = ? " "WHERE CustomReactionID = ?", t
+                        )
+                        await self.update_custom_reaction(custom_react_id)
                         if proposals:
                             title = (
                                 "Option successfully modified! " "Returning to list of current " "reaction proposals..."
@@ -986,7 +1043,6 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
 
                 # Activate "anywhere" option
@@ -1001,13 +1057,13 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
                     else:
                         t = (1, custom_react_id)
-                        c.execute("UPDATE CustomReactions SET Anywhere = ? " "WHERE CustomReactionID = ?", t)
-                        conn.commit()
-                        self.rebuild_lists()
+                        await self.bot.db.execute(
+                            "UPDATE CustomReactions SET Anywhere = ? " "WHERE CustomReactionID = ?", t
+                        )
+                        await self.update_custom_reaction(custom_react_id)
                         if proposals:
                             title = (
                                 "Option successfully modified! " "Returning to list of current " "reaction proposals..."
@@ -1019,7 +1075,6 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
                 # Stop
                 elif reaction.emoji == EMOJI["stop_button"]:
@@ -1052,8 +1107,8 @@ class CustomReactions(commands.Cog):
                     )
                 )
                 try:
-                    reaction, reaction_user = await self.bot.wait_for(
-                        "reaction_add", check=get_reaction_check(reaction_user=user), timeout=60
+                    reaction, reaction_user = await self.bot.interactions.wait_for_reaction(
+                        initial_message, check=get_reaction_check(reaction_user=user), timeout=60
                     )
 
                 except asyncio.TimeoutError:
@@ -1070,7 +1125,6 @@ class CustomReactions(commands.Cog):
                             "Returning to list of current reactions..."
                         )
                     await message.edit(embed=discord.Embed(title=title))
-                    conn.close()
                     await asyncio.sleep(5)
                     current_options.clear()
                     await message.clear_reactions()
@@ -1090,13 +1144,11 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
                     else:
                         t = (0, custom_react_id)
-                        c.execute("UPDATE CustomReactions SET DM = ? " "WHERE CustomReactionID = ?", t)
-                        conn.commit()
-                        self.rebuild_lists()
+                        await self.bot.db.execute("UPDATE CustomReactions SET DM = ? " "WHERE CustomReactionID = ?", t)
+                        await self.update_custom_reaction(custom_react_id)
                         if proposals:
                             title = (
                                 "Option successfully modified! " "Returning to list of current " "reaction proposals..."
@@ -1108,7 +1160,6 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
                 # Activate "dm" option
                 elif reaction.emoji == EMOJI["one"]:
@@ -1122,13 +1173,11 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
                     else:
                         t = (1, custom_react_id)
-                        c.execute("UPDATE CustomReactions SET DM = ? " "WHERE CustomReactionID = ?", t)
-                        conn.commit()
-                        self.rebuild_lists()
+                        await self.bot.db.execute("UPDATE CustomReactions SET DM = ? " "WHERE CustomReactionID = ?", t)
+                        await self.update_custom_reaction(custom_react_id)
                         if proposals:
                             title = (
                                 "Option successfully modified! " "Returning to list of current " "reaction proposals..."
@@ -1140,7 +1189,6 @@ class CustomReactions(commands.Cog):
                                 text=f"Modified by {user}.", icon_url=user.avatar_url
                             )
                         )
-                        conn.close()
                         await asyncio.sleep(5)
                 # Stop
                 elif reaction.emoji == EMOJI["stop_button"]:
@@ -1150,23 +1198,20 @@ class CustomReactions(commands.Cog):
             # Approve a custom reaction proposal
             if reaction.emoji == EMOJI["white_check_mark"]:
                 t = (0, custom_react_id)
-                c.execute("UPDATE CustomReactions SET Proposal = ? " "WHERE CustomReactionID = ?", t)
-                conn.commit()
-                self.rebuild_lists()
+                await self.bot.db.execute("UPDATE CustomReactions SET Proposal = ? " "WHERE CustomReactionID = ?", t)
+                await self.update_custom_reaction(custom_react_id)
                 title = (
                     "Custom reaction proposal successfully approved! "
                     "Returning to list of current reaction proposals..."
                 )
                 footer = f"Approved by {user}."
                 await message.edit(embed=discord.Embed(title=title).set_footer(text=footer, icon_url=user.avatar_url))
-                conn.close()
                 await asyncio.sleep(5)
 
             # Delete a custom reaction or proposal
             if reaction.emoji == EMOJI["put_litter_in_its_place"] or reaction.emoji == EMOJI["x"]:
                 t = (custom_react_id,)
-                c.execute("DELETE FROM CustomReactions WHERE CustomReactionID = ?", t)
-                conn.commit()
+                await self.bot.db.execute("DELETE FROM CustomReactions WHERE CustomReactionID = ?", t)
                 if proposals:
                     title = (
                         "Custom reaction proposal successfully "
@@ -1178,8 +1223,7 @@ class CustomReactions(commands.Cog):
                     title = "Custom reaction successfully deleted! " "Returning to list of current reactions..."
                     footer = f"Deleted by {user}."
                 await message.edit(embed=discord.Embed(title=title).set_footer(text=footer, icon_url=user.avatar_url))
-                conn.close()
-                self.rebuild_lists()
+                await self.update_custom_reaction(custom_react_id)
                 await asyncio.sleep(5)
 
             # Stop
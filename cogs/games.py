@@ -24,7 +24,6 @@ from discord.ext import commands
 # Other utilities
 import re
 import os
-import sqlite3
 from time import time
 import pickle
 import random
@@ -34,6 +33,7 @@ from functools import partial
 from .utils.dice_roll import dice_roll
 from .utils.clamp_default import clamp_default
 from .utils.hangman import HangmanState
+from .utils.interactions import interactive
 from .currency import HANGMAN_REWARD
 
 ROLL_PATTERN = re.compile(r"^(\d*)d(\d*)([+-]?\d*)$")
@@ -75,6 +75,7 @@ class Games(commands.Cog):
         )
 
     @commands.command(aliases=["hm"])
+    @interactive
     async def hangman(self, ctx, command: Optional[str] = None):
         """
         play a nice game of hangman with internet strangers!
@@ -130,7 +131,9 @@ class Games(commands.Cog):
 
         while True:
 
-            msg_task = asyncio.create_task(self.bot.wait_for("message", check=msg_check, timeout=self.hm_timeout))
+            msg_task = asyncio.create_task(
+                self.bot.interactions.wait_for_message(ctx.channel, check=msg_check, timeout=self.hm_timeout)
+            )
             quit_task = asyncio.create_task(channel_lock.acquire())
             done, _ = await asyncio.wait([msg_task, quit_task], return_when=asyncio.FIRST_COMPLETED)
 
@@ -171,13 +174,14 @@ class Games(commands.Cog):
                 if game_state.img:
                     game_state.embed.set_image(url=game_state.img)
                 await ctx.send(embed=game_state.embed)
-                await ctx.send(
+                await self.bot.message_dispatcher.send(
+                    ctx,
                     f"congratulations `{winner}`, you solved the hangman"
                     + (
                         f" (in a cool way), earning you {self.hm_cool_win} cheeps"
                         if cool_win
                         else f", earning you {self.hm_norm_win} cheeps"
-                    )
+                    ),
                 )
                 break
 
@@ -197,8 +201,10 @@ class Games(commands.Cog):
                     if game_state.img:
                         game_state.embed.set_image(url=game_state.img)
                     await ctx.send(embed=game_state.embed)
-                    await ctx.send(
-                        f"congratulations `{winner}`, you solved the hangman, " f"earning you {self.hm_norm_win} cheeps"
+                    await self.bot.message_dispatcher.send(
+                        ctx,
+                        f"congratulations `{winner}`, you solved the hangman, "
+                        f"earning you {self.hm_norm_win} cheeps",
                     )
                     break
             else:
@@ -222,16 +228,14 @@ class Games(commands.Cog):
         del self.hm_locks[ctx.message.channel]
 
         if winner is not None:
-            conn = sqlite3.connect(self.bot.config.db_path)
-            await self.bot.get_cog("Currency").create_bank_transaction(
-                conn.cursor(),
-                winner,
-                self.hm_cool_win if cool_win else self.hm_norm_win,
-                HANGMAN_REWARD,
-                {"cool": cool_win},
-            )
-            conn.commit()
-            conn.close()
+            async with self.bot.db.transaction() as txn:
+                await self.bot.get_cog("Currency").create_bank_transaction(
+                    txn,
+                    winner,
+                    self.hm_cool_win if cool_win else self.hm_norm_win,
+                    HANGMAN_REWARD,
+                    {"cool": cool_win},
+                )
 
     @commands.command()
     async def roll(self, ctx, arg: str = "", mpr: str = ""):
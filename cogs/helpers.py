@@ -32,16 +32,16 @@ import googletrans
 import os
 
 # Other utilities
+import asyncio
 import re
 import math
 import time
 import datetime
 import random
-from .utils.paginator import Pages
+from .utils.paginator import Pages, PageSource
 from .utils.custom_requests import fetch
 from .utils.site_save import site_save
 from .utils.checks import is_moderator, is_developer
-import sqlite3
 from .utils.arg_converter import ArgConverter, StrConverter
 from discord.ext.commands import MessageConverter
 
@@ -69,6 +69,40 @@ LATEX_PREAMBLE = r"""\documentclass[varwidth,12pt]{standalone}
 
 MAIN_WEBHOOKS_PREFIX = "Main webhook for #"
 
+# Maximum number of pages of McGill course search results fetched
+COURSE_SEARCH_PAGE_LIMIT = 5
+
+
+class CourseSearchPageSource(PageSource):
+    def __init__(self, search_template, keyword):
+        """The (course code, title) of the McGill courses found for a keyword.
+        Pages of search results are only fetched from the McGill website
+        when the paginator gets to them."""
+        self.search_template = search_template
+        self.keyword = keyword
+        self.courses = []
+        self.pages_fetched = 0
+        self.exhausted = False
+        self._lock = asyncio.Lock()
+
+    async def _fetch_results_page(self):
+        r = await fetch(self.search_template.format(self.keyword, self.pages_fetched), "content")
+        soup = BeautifulSoup(r, "html.parser")
+        found = soup.find_all("div", {"class": "views-row"})
+        self.pages_fetched += 1
+        if len(found) < 1 or self.pages_fetched >= COURSE_SEARCH_PAGE_LIMIT:
+            self.exhausted = True
+        for course in found:
+            # split results into titles + information
+            title = course.find_all("h4")[0].get_text().split(" ")
+            self.courses.append((" ".join(title[:2]), " ".join(title[2:])))
+
+    async def fetch(self, offset, limit):
+        async with self._lock:
+            while len(self.courses) < offset + limit and not self.exhausted:
+                await self._fetch_results_page()
+        return self.courses[offset : offset + limit]
+
 
 class Helpers(commands.Cog):
     def __init__(self, bot):
@@ -417,37 +451,17 @@ class Helpers(commands.Cog):
         """Shows results for the queried keyword(s) in McGill courses"""
 
         keyword = query.replace(" ", "+")
-        pagelimit = 5
-        pagenum = 0
-        courses = []
+        source = CourseSearchPageSource(self.bot.config.course_search_tpl, keyword)
 
         await ctx.trigger_typing()
 
-        while pagenum < pagelimit:
-            r = await fetch(self.bot.config.course_search_tpl.format(keyword, pagenum), "content")
-            soup = BeautifulSoup(r, "html.parser")
-            found = soup.find_all("div", {"class": "views-row"})
-
-            if len(found) < 1:
-                break
-            else:
-                courses = courses + found
-                pagenum += 1
-
-        if len(courses) < 1:
+        if not await source.fetch(0, 1):
             await ctx.send("No course found for: {}.".format(query))
             return
 
-        course_list = {"names": [], "values": []}
-        for course in courses:
-            # split results into titles + information
-            title = course.find_all("h4")[0].get_text().split(" ")
-            course_list["names"].append(" ".join(title[:2]))
-            course_list["values"].append(" ".join(title[2:]))
-
         p = Pages(
             ctx,
-            item_list=course_list,
+            page_source=source,
             title="Courses found for {}".format(query),
             display_option=(2, 10),
             editable_content=False,
@@ -729,12 +743,10 @@ class Helpers(commands.Cog):
                 await webhook.send(files=files, username=author.display_name, avatar_url=author.avatar_url, wait=True)
             )
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        for spoilerized_message in spoilerized_messages:
-            c.execute("REPLACE INTO SpoilerizedMessages VALUES (?, ?)", (spoilerized_message.id, author.id))
-        conn.commit()
-        conn.close()
+        await self.bot.db.executemany(
+            "REPLACE INTO SpoilerizedMessages VALUES (?, ?)",
+            ((spoilerized_message.id, author.id) for spoilerized_message in spoilerized_messages),
+        )
 
         # delete original message
         await message.delete()
@@ -745,18 +757,14 @@ class Helpers(commands.Cog):
             return
         # if the put_litter_in_its_place react was used check if it was
         # on a spoilerized message by its original author, and if so delete it
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute(
+        found = await self.bot.db.fetchone(
             "SELECT * From SpoilerizedMessages WHERE MessageID=? AND UserID=?",
             (int(payload.message_id), int(payload.member.id)),
         )
-        found = c.fetchone()
         if found:
             channel = utils.get(self.guild.text_channels, id=payload.channel_id)
             message = await channel.fetch_message(payload.message_id)
             await message.delete()
-        conn.close()
 
     @commands.command(alias=["spoiler"])
     async def spoilerize(self, ctx, *args):
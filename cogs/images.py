@@ -21,83 +21,155 @@ from discord.ext import commands
 # misc imports
 import os
 from .utils import image_helpers as ih
+from .utils.result_cache import ResultCache
+from .utils.worker_pool import WorkerPool
 
 
 class Images(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.max_size = self.bot.config.images["max_image_size"]
+        self.max_pixels = self.bot.config.images["max_pixels"]
         self.hist_lim = self.bot.config.images["image_history_limit"]
         self.max_rad = self.bot.config.images["max_radius"]
         self.max_itr = self.bot.config.images["max_iterations"]
+        self.max_cost = self.bot.config.images["max_filter_cost"]
+        self.max_steps = self.bot.config.images["max_filter_steps"]
+        # Filters of ?filter, with the default and maximum of their argument
+        self.filters = {
+            "polar": (ih.polar, None, None),
+            "cart": (ih.cart, None, None),
+            "blur": (ih.blur, 1, self.max_itr),
+            "hblur": (ih.hblur, 10, self.max_rad),
+            "vblur": (ih.vblur, 10, self.max_rad),
+            "rblur": (ih.rblur, 10, self.max_rad),
+            "cblur": (ih.cblur, 10, self.max_rad),
+            "deepfry": (ih.deepfry, 1, self.max_itr),
+            "noise": (ih.noise, 1, self.max_itr),
+        }
+        # Started when the cog is loaded, so that filters do not wait for the
+        # workers to start and import their libraries
+        self.pool = WorkerPool(
+            self.bot.config.images["workers"],
+            self.bot.config.images["max_jobs"],
+            self.bot.config.images["max_jobs_per_user"],
+            self.bot.config.images["recycle_workers_after"],
+            initializer=ih.warm_up,
+        )
+        self.pool.start()
+        self.results = ResultCache(
+            self.bot.config.images["result_cache_memory"],
+            self.bot.config.images["result_cache_path"],
+            self.bot.config.images["result_cache_disk"],
+        )
+
+    def cog_unload(self):
+        self.pool.shutdown()
 
     @commands.Cog.listener()
     async def on_ready(self):
-        if not os.path.exists("./tmp/"):
-            os.mkdir("./tmp/", mode=0o755)
+        if not os.path.exists(ih.IMAGE_TMP_DIR):
+            os.mkdir(ih.IMAGE_TMP_DIR, mode=0o755)
+
+    async def _filter(self, ctx, *steps):
+        await ih.filter_image(self.pool, self.results, steps, ctx, self.hist_lim, self.max_pixels, self.max_cost)
+
+    @commands.command(name="filter")
+    async def filter_pipeline(self, ctx, *steps: str):
+        """
+        Apply several filters one after the other, e.g. ?filter blur:3 deepfry:2 polar
+        Filters: polar, cart, blur, hblur, vblur, rblur, cblur, deepfry and noise, optionally followed by
+        their number of iterations or radius (same defaults as their own commands).
+        """
+        if not steps:
+            await ctx.send("no filter was given, e.g. `?filter blur:3 deepfry:2 polar`.")
+            return
+        if len(steps) > self.max_steps:
+            await ctx.send(f"at most {self.max_steps} filters can be applied at once.")
+            return
+
+        pipeline = []
+        for step in steps:
+            name, _, argument = step.lower().partition(":")
+            if name not in self.filters:
+                await ctx.send(f"`{name}` is not a filter, the filters are: {', '.join(self.filters)}.")
+                return
+            transform, default, maximum = self.filters[name]
+            if maximum is None:
+                if argument:
+                    await ctx.send(f"`{name}` does not take an argument.")
+                    return
+                pipeline.append((transform,))
+                continue
+            try:
+                pipeline.append((transform, int(argument) if argument else default, maximum))
+            except ValueError:
+                await ctx.send(f"the argument of `{name}` must be a whole number.")
+                return
+
+        await self._filter(ctx, *pipeline)
 
     @commands.command()
     async def polar(self, ctx):
         """
         Transform Cartesian to polar coordinates.
         """
-        await ih.filter_image(self.bot.loop, ih.polar, ctx, self.hist_lim, self.max_size)
+        await self._filter(ctx, (ih.polar,))
 
     @commands.command()
     async def cart(self, ctx):
         """
         Transform from polar to Cartesian coordinates.
         """
-        await ih.filter_image(self.bot.loop, ih.cart, ctx, self.hist_lim, self.max_size)
+        await self._filter(ctx, (ih.cart,))
 
     @commands.command()
     async def blur(self, ctx, iterations: int = 1):
         """
         Blur the image
         """
-        await ih.filter_image(self.bot.loop, ih.blur, ctx, self.hist_lim, self.max_size, iterations, self.max_itr)
+        await self._filter(ctx, (ih.blur, iterations, self.max_itr))
 
     @commands.command(aliases=["left", "right"])
     async def hblur(self, ctx, radius: int = 10):
         """
         Blur the image horizontally
         """
-        await ih.filter_image(self.bot.loop, ih.hblur, ctx, self.hist_lim, self.max_size, radius, self.max_rad)
+        await self._filter(ctx, (ih.hblur, radius, self.max_rad))
 
     @commands.command(aliases=["up", "down"])
     async def vblur(self, ctx, radius: int = 10):
         """
         Blur the image vertically
         """
-        await ih.filter_image(self.bot.loop, ih.vblur, ctx, self.hist_lim, self.max_size, radius, self.max_rad)
+        await self._filter(ctx, (ih.vblur, radius, self.max_rad))
 
     @commands.command(aliases=["zoom", "radial"])
     async def rblur(self, ctx, radius: int = 10):
         """
         Radial blur
         """
-        await ih.filter_image(self.bot.loop, ih.rblur, ctx, self.hist_lim, self.max_size, radius, self.max_rad)
+        await self._filter(ctx, (ih.rblur, radius, self.max_rad))
 
     @commands.command(aliases=["circle", "circular", "spin"])
     async def cblur(self, ctx, radius: int = 10):
         """
         Circular blur
         """
-        await ih.filter_image(self.bot.loop, ih.cblur, ctx, self.hist_lim, self.max_size, radius, self.max_rad)
+        await self._filter(ctx, (ih.cblur, radius, self.max_rad))
 
     @commands.command(aliases=["df", "dfry", "fry"])
     async def deepfry(self, ctx, iterations: int = 1):
         """
         Deep fry an image, mhmm
         """
-        await ih.filter_image(self.bot.loop, ih.deepfry, ctx, self.hist_lim, self.max_size, iterations, self.max_itr)
+        await self._filter(ctx, (ih.deepfry, iterations, self.max_itr))
 
     @commands.command()
     async def noise(self, ctx, iterations: int = 1):
         """
         Add some noise to tha image!!
         """
-        await ih.filter_image(self.bot.loop, ih.noise, ctx, self.hist_lim, self.max_size, iterations, self.max_itr)
+        await self._filter(ctx, (ih.noise, iterations, self.max_itr))
 
 
 def setup(bot):
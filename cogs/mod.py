@@ -16,11 +16,10 @@
 # along with Canary. If not, see <https://www.gnu.org/licenses/>.
 
 import discord
-import sqlite3
 import random
 from bidict import bidict
 from discord import utils
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 from .utils.checks import is_moderator
 from datetime import datetime, timedelta
@@ -34,6 +33,10 @@ from .utils.role_restoration import (
 )
 from .utils.mock_context import MockContext
 
+# Name of the scheduler's handler for the weekly purge of the verification channel
+VERIFICATION_PURGE_JOB = "verification_purge"
+VERIFICATION_PURGE_INTERVAL = timedelta(days=7)
+
 
 class Mod(commands.Cog):
     def __init__(self, bot):
@@ -44,6 +47,10 @@ class Mod(commands.Cog):
         self.muted_users_to_appeal_channels: bidict = bidict()
         self.appeals_log_channel: discord.TextChannel | None = None
         self.muted_role: discord.Role | None = None
+        self.bot.loop.create_task(self.bot.scheduler.register(VERIFICATION_PURGE_JOB, self.check_verification_purge))
+
+    def cog_unload(self):
+        self.bot.scheduler.unregister(VERIFICATION_PURGE_JOB)
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -51,16 +58,12 @@ class Mod(commands.Cog):
 
         await self.verification_purge_startup()
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("SELECT * FROM MutedUsers")
         self.muted_users_to_appeal_channels = bidict(
             [
                 (self.bot.get_user(user_id), self.bot.get_channel(appeal_channel_id))
-                for (user_id, appeal_channel_id, roles, date) in c.fetchall()
+                for (user_id, appeal_channel_id, roles, date) in await self.bot.db.fetchall("SELECT * FROM MutedUsers")
             ]
         )
-        conn.close()
         self.appeals_log_channel = utils.get(self.guild.text_channels, name=self.bot.config.appeals_log_channel)
         self.muted_role = utils.get(self.guild.roles, name=self.bot.config.muted_role)
 
@@ -71,47 +74,55 @@ class Mod(commands.Cog):
         # arbitrary min date because choosing dates that predate discord will cause an httpexception
         # when fetching message history after that date later on
         self.last_verification_purge_datetime = datetime(2018, 1, 1)
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("SELECT Value FROM Settings WHERE Key = ?", ("last_verification_purge_timestamp",))
-        fetched = c.fetchone()
+        fetched = await self.bot.db.fetchone(
+            "SELECT Value FROM Settings WHERE Key = ?", ("last_verification_purge_timestamp",)
+        )
         if fetched:
             last_purge_timestamp = float(fetched[0])
             if last_purge_timestamp:
                 self.last_verification_purge_datetime = datetime.fromtimestamp(last_purge_timestamp)
         else:
             # the verification purge info setting has not been added to db yet
-            c.execute(
+            await self.bot.db.execute(
                 "INSERT INTO Settings VALUES (?, ?)",
                 ("last_verification_purge_timestamp", self.last_verification_purge_datetime.timestamp()),
             )
-            conn.commit()
-        conn.close()
-
-        self.check_verification_purge.start()
+            await self.bot.scheduler.schedule(
+                VERIFICATION_PURGE_JOB,
+                "",
+                (self.last_verification_purge_datetime + VERIFICATION_PURGE_INTERVAL).timestamp(),
+            )
 
-    @tasks.loop(minutes=60)
-    async def check_verification_purge(self):
-        # todo: make general scheduled events db instead
-        if not all((self.guild, self.verification_channel, self.last_verification_purge_datetime)):
+    async def check_verification_purge(self, _key, _payload):
+        # Scheduler handler. The next purge is scheduled first so that the job
+        # is never lost, even if this purge fails
+        await self.bot.scheduler.schedule(
+            VERIFICATION_PURGE_JOB, "", (datetime.now() + VERIFICATION_PURGE_INTERVAL).timestamp()
+        )
+        if not self.guild:
+            self.guild = self.bot.get_guild(self.bot.config.server_id)
+        if not self.verification_channel and self.guild:
+            self.verification_channel = utils.get(self.guild.text_channels, name=self.bot.config.verification_channel)
+        if not self.verification_channel:
             return
 
-        if datetime.now() < self.last_verification_purge_datetime + timedelta(days=7):
-            return
+        fetched = await self.bot.db.fetchone(
+            "SELECT Value FROM Settings WHERE Key = ?", ("last_verification_purge_timestamp",)
+        )
+        if fetched and float(fetched[0]):
+            self.last_verification_purge_datetime = datetime.fromtimestamp(float(fetched[0]))
+        elif not self.last_verification_purge_datetime:
+            # same arbitrary min date as in verification_purge_startup
+            self.last_verification_purge_datetime = datetime(2018, 1, 1)
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
         # delete everything since the day of the last purge, including that day itself
         await self.verification_purge_utility(self.last_verification_purge_datetime - timedelta(days=1))
         # update info
-        c.execute("SELECT Value FROM Settings WHERE Key = ?", ("last_verification_purge_timestamp",))
-        fetched = c.fetchone()
-        if fetched:
-            c.execute(
-                "REPLACE INTO Settings VALUES (?, ?)", ("last_verification_purge_timestamp", datetime.now().timestamp())
-            )
-            conn.commit()
-        conn.close()
+        self.last_verification_purge_datetime = datetime.now()
+        await self.bot.db.execute(
+            "REPLACE INTO Settings VALUES (?, ?)",
+            ("last_verification_purge_timestamp", self.last_verification_purge_datetime.timestamp()),
+        )
 
     @commands.command()
     async def answer(self, ctx, *args):
@@ -130,11 +141,17 @@ class Mod(commands.Cog):
         """
         PM a user on the server using the bot
         """
-        await user.send(
+        sent = await self.bot.message_dispatcher.send(
+            user,
             content=f"{message}\n*To answer write* "
             f"`{self.bot.config.command_prefix[0]}answer "
-            f'"your message here"`'
+            f'"your message here"`',
         )
+        if sent is None:
+            # e.g. the user does not accept DMs; the command is kept so that
+            # the message is not lost
+            await ctx.send(f"Could not send the message to {user}, they may not accept DMs.")
+            return
         channel_to_forward = utils.get(
             self.bot.get_guild(self.bot.config.server_id).text_channels, name=self.bot.config.reception_channel
         )
@@ -147,12 +164,8 @@ class Mod(commands.Cog):
     async def initiate_crabbo(self, ctx):
         """Initiates secret crabbo ceremony"""
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("SELECT Value FROM Settings WHERE Key = ?", ("CrabboMsgID",))
-        if c.fetchone():
+        if await self.bot.db.fetchone("SELECT Value FROM Settings WHERE Key = ?", ("CrabboMsgID",)):
             await ctx.send("secret crabbo has already been started.")
-            conn.close()
             return
         crabbo_msg = await ctx.send(
             "🦀🦀🦀 crabbo time 🦀🦀🦀\n<@&"
@@ -160,9 +173,7 @@ class Mod(commands.Cog):
             "> react to this message with 🦀 to enter the secret crabbo festival\n"
             "🦀🦀🦀 crabbo time 🦀🦀🦀"
         )
-        c.execute("REPLACE INTO Settings VALUES (?, ?)", ("CrabboMsgID", crabbo_msg.id))
-        conn.commit()
-        conn.close()
+        await self.bot.db.execute("REPLACE INTO Settings VALUES (?, ?)", ("CrabboMsgID", crabbo_msg.id))
         await ctx.message.delete()
 
     @commands.command()
@@ -170,13 +181,9 @@ class Mod(commands.Cog):
     async def finalize_crabbo(self, ctx):
         """Sends crabbos their secret crabbo"""
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("SELECT Value FROM Settings WHERE Key = ?", ("CrabboMsgID",))
-        msg_id = c.fetchone()
-        c.execute("DELETE FROM Settings WHERE Key = ?", ("CrabboMsgID",))
-        conn.commit()
-        conn.close()
+        async with self.bot.db.transaction() as txn:
+            msg_id = await txn.fetchone("SELECT Value FROM Settings WHERE Key = ?", ("CrabboMsgID",))
+            await txn.execute("DELETE FROM Settings WHERE Key = ?", ("CrabboMsgID",))
         if not msg_id:
             await ctx.send("secret crabbo is not currently occurring.")
             return
@@ -189,11 +196,24 @@ class Mod(commands.Cog):
             await ctx.send("not enough people participated in the secret crabbo festival.")
             return
         random.shuffle(crabbos)
+        messages = []
+        unreachable = []
         for index, crabbo in enumerate(crabbos):
-            await self.bot.get_user(crabbo.id).send(
-                f"🦀🦀🦀\nyou have been selected to give a gift to: {crabbos[(index+1)%num_crabbos]}\n🦀🦀🦀"
+            if (user := self.bot.get_user(crabbo.id)) is None:
+                unreachable.append(str(crabbo))
+                continue
+            messages.append(
+                (user, f"🦀🦀🦀\nyou have been selected to give a gift to: {crabbos[(index+1)%num_crabbos]}\n🦀🦀🦀")
             )
+        sent = await self.bot.message_dispatcher.send_many(messages)
+        unreachable.extend(str(user) for (user, _), message in zip(messages, sent) if message is None)
 
+        if unreachable:
+            await ctx.send(
+                f"the secret crabbo could not be sent to: {', '.join(unreachable)}. "
+                "they may have left the server or not accept DMs."
+            )
+            return
         await ctx.message.delete()
 
     async def verification_purge_utility(self, after: datetime | discord.Message | None):
@@ -295,7 +315,7 @@ class Mod(commands.Cog):
         # save existing roles and add muted user to database (with the attached appeal channel)
         # note that this function is such that if the user was already in the db, only the appeal channel is updated
         # (i.e, the situation where a mod had manually deleted the appeal channel)
-        save_existing_roles(self.bot, user, muted=True, appeal_channel=channel)
+        await save_existing_roles(self.bot, user, muted=True, appeal_channel=channel)
 
         # Remove all roles
         failed_roles: list[str] = []
@@ -334,7 +354,7 @@ class Mod(commands.Cog):
         )
 
         # Restore old roles from the database
-        valid_roles = fetch_saved_roles(self.bot, self.guild, user, muted=True)
+        valid_roles = await fetch_saved_roles(self.bot, self.guild, user, muted=True)
         # for the following, if ctx is provided then the optional bot, guild, channel and restored_by values are ignored
         # if there is no ctx, it means that the user was unmuted because a mod removed the role manually
         # to know which mod did it, we would have to go through the audit log and try the find the log entry. Instead,
@@ -348,7 +368,7 @@ class Mod(commands.Cog):
         )
 
         # Remove entry from the database
-        remove_from_muted_table(self.bot, user)
+        await remove_from_muted_table(self.bot, user)
 
         # Delete appeal channel
         if user in self.muted_users_to_appeal_channels:
@@ -397,7 +417,7 @@ class Mod(commands.Cog):
             not muted_role_before
             and muted_role_after
             and not (
-                is_in_muted_table(self.bot, after)
+                await is_in_muted_table(self.bot, after)
                 and has_muted_role(after)
                 and after in self.muted_users_to_appeal_channels
                 and self.muted_users_to_appeal_channels[after] in self.guild.text_channels
@@ -410,7 +430,7 @@ class Mod(commands.Cog):
             muted_role_before
             and not muted_role_after
             and (
-                is_in_muted_table(self.bot, after)
+                await is_in_muted_table(self.bot, after)
                 or has_muted_role(after)
                 or after in self.muted_users_to_appeal_channels
             )
@@ -487,7 +507,7 @@ class Mod(commands.Cog):
     @commands.Cog.listener()
     async def on_member_join(self, user: discord.Member):
         # If the user was already muted, restore the muted role
-        if is_in_muted_table(self.bot, user):
+        if await is_in_muted_table(self.bot, user):
             await user.add_roles(self.muted_role, reason="Restored muted status")
 
 
@@ -443,8 +443,8 @@ class Music(commands.Cog):
                 )
                 await queue_msg.edit(embed=queue_embed)
             try:
-                react, author = await self.bot.wait_for(
-                    "reaction_add",
+                react, author = await self.bot.interactions.wait_for_reaction(
+                    queue_msg,
                     timeout=60.0,
                     check=partial(self.check_reaction, queue_msg),
                 )
@@ -20,16 +20,17 @@ import discord
 from discord.ext import commands
 import asyncio
 
-# For DB functionality
-import sqlite3
-
 # For Markov Chain
-import numpy as np
 import re
+import regex
 
 # Other utils
 import random
-from .utils.paginator import Pages
+from typing import Optional
+from .utils.interactions import interactive
+from .utils.markov import MarkovModel, MarkovModelCache
+from .utils.paginator import Pages, SQLPageSource
+from .utils.safe_regex import RegexBudgetExceeded, pattern_problem, required_literals, search_all
 
 GEN_SPACE_SYMBOLS = re.compile(r"[,“”\".?!]")
 GEN_BLANK_SYMBOLS = re.compile(r"['()`]")
@@ -38,65 +39,279 @@ IMAGE_REGEX = re.compile(r"https?://\S+\.(?:jpg|gif|png|jpeg)\S*")
 
 DEFAULT_AVATAR = "https://cdn.discordapp.com/embed/avatars/0.png"
 
+MENTION_REGEX = re.compile(r"^<@!?\d+>$")
+
+# Characters never part of a word of the full-text index (which may split words
+# further, e.g. on emoji, but then searches them as phrases)
+FTS_WORD_SEPARATORS = re.compile(r"[\s!-/:-@\[-`{-~]+")
+FTS_QUERY_TERM = re.compile(r'"([^"]*)"?|([^\s"]+)')
+
+# Delay, in seconds, before the Markov chain model is saved after a change
+MARKOV_SAVE_DELAY = 300
+
+LIST_QUOTES_PER_PAGE = 10
+
+# Number of random quote IDs tried before settling for the quote following one
+RANDOM_QUOTE_ATTEMPTS = 8
+
+FTS_SELECT = "SELECT q.ID, q.Name, q.Quote FROM QuotesFTS JOIN Quotes q ON q.QuoteID = QuotesFTS.rowid "
+
+
+class MentionedMember(commands.MemberConverter):
+    async def convert(self, ctx, argument):
+        # Only mentions, so that a seed word is never taken for a member name
+        if not MENTION_REGEX.match(argument):
+            raise commands.BadArgument(f"{argument} is not a mention")
+        return await super().convert(ctx, argument)
+
+
+def markov_words(quote: str) -> list[str]:
+    """
+    Returns the words of a quote as used by the Markov chain, or an empty
+    list for quotes with links.
+    """
+    if re.search(r"https?://", quote):
+        return []
+    # Preprocess the quote to improve chances of getting a nice dictionary
+    # going
+    cq = re.sub(GEN_SPACE_SYMBOLS, " ", re.sub(GEN_BLANK_SYMBOLS, "", quote.lower())).strip()
+    # Split cleaned quote into words by any whitespace.
+    return re.split(r"\s+", cq) if cq else []
+
+
+def _fold_in_quotes(model: MarkovModel, rows: list[tuple]) -> None:
+    for quote_id, quote in rows:
+        model.add(markov_words(quote or ""), quote_id)
+
+
+def _fts_phrase(text: str) -> str:
+    return " ".join(word for word in FTS_WORD_SEPARATORS.split(text) if word)
+
+
+def fts_query(query: str) -> Optional[str]:
+    """
+    Converts a search query written by a user into an FTS5 query: text
+    between double quotes is searched as a phrase, and other words as
+    prefixes (e.g. hell finds "Hello there"); every term must be found.
+    Returns None if the query has no words.
+    """
+    terms = []
+    for match in FTS_QUERY_TERM.finditer(query):
+        if match.group(1) is not None:
+            if phrase := _fts_phrase(match.group(1)):
+                terms.append(f'"{phrase}"')
+        elif phrase := _fts_phrase(match.group(2)):
+            terms.append(f'"{phrase}"*')
+    return " ".join(terms) or None
+
+
+def fts_literal_query(literals: list[str]) -> Optional[str]:
+    """
+    Returns an FTS5 query finding every quote which may contain all of the
+    given pieces of text, or None if they have no usable word. The first word
+    of a piece may be the end of a longer word, so it is left out, and its
+    last word may be the start of one, so it is searched as a prefix.
+    """
+    terms = []
+    for literal in literals:
+        words = FTS_WORD_SEPARATORS.split(literal)
+        terms += [f'"{word}"' for word in words[1:-1] if word]
+        if len(words) > 1 and words[-1]:
+            terms.append(f'"{words[-1]}"*')
+    return " ".join(terms) or None
+
 
 class Quotes(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.mc_table = {}
-        self.rebuild_mc()
+        self.mc_model = MarkovModel(self.bot.config.markov["order"])
+        self.mc_lock = asyncio.Lock()
+        self._mc_save_task = None
+        # Models of the quotes of single users, built when first needed
+        self.user_mc_models = MarkovModelCache(self.bot.config.markov["user_models_memory"])
+        self._user_mc_builds: dict[int, asyncio.Task] = {}
+        self.bot.loop.create_task(self.load_mc())
+
+    async def random_quote(self, user_id=None):
+        """
+        Returns the (ID, Name, Quote) of a random quote, optionally of the
+        user with the given ID, or None if there is none, without loading
+        the others: a random QuoteID is picked between the smallest and the
+        largest, and another one is tried if it was deleted (after a few
+        attempts, the next existing quote is used). The quotes of a user are
+        counted with the quotes_id index and one is picked by offset.
+        """
+        if user_id is not None:
+            (count,) = await self.bot.db.fetchone("SELECT COUNT(*) FROM Quotes WHERE ID = ?", (user_id,))
+            if not count:
+                return None
+            return await self.bot.db.fetchone(
+                "SELECT ID, Name, Quote FROM Quotes WHERE ID = ? ORDER BY QuoteID LIMIT 1 OFFSET ?",
+                (user_id, random.randrange(count)),
+            )
 
-    def rebuild_mc(self):
+        # As separate subqueries, each is a single lookup of the primary key
+        first_id, last_id = await self.bot.db.fetchone(
+            "SELECT (SELECT MIN(QuoteID) FROM Quotes), (SELECT MAX(QuoteID) FROM Quotes)"
+        )
+        if first_id is None:
+            return None
+        for _ in range(RANDOM_QUOTE_ATTEMPTS):
+            quote_id = random.randint(first_id, last_id)
+            if quote := await self.bot.db.fetchone("SELECT ID, Name, Quote FROM Quotes WHERE QuoteID = ?", (quote_id,)):
+                return quote
+        return await self.bot.db.fetchone(
+            "SELECT ID, Name, Quote FROM Quotes WHERE QuoteID >= ? ORDER BY QuoteID LIMIT 1", (quote_id,)
+        )
+
+    async def search_quotes(self, query, user_id=None):
         """
-        Rebuilds the Markov Chain lookup table for use with the ?generate
-        command.
-        Blame David for this code.
+        Returns the (ID, Name, Quote) of the quotes containing the words of
+        query (see fts_query), best matches first, optionally only those of
+        the user with the given ID.
         """
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        c.execute("SELECT Quote FROM Quotes")
-
-        lookup = {}
-
-        for q in c.fetchall():
-            # Skip URL quotes
-            if re.search(r"https?://", q[0]):
-                continue
-
-            # Preprocess the quote to improve chances of getting a nice
-            # dictionary going
-            cq = re.sub(GEN_SPACE_SYMBOLS, " ", re.sub(GEN_BLANK_SYMBOLS, "", q[0].lower())).strip()
-
-            # Split cleaned quote into words by any whitespace.
-            words = re.split(r"\s+", cq)
-
-            # Count up word occurrences in the lookup table in order to
-            # eventually build the probability distribution for the key.
-            for i in range(len(words)):
-                key = words[i]
-                if i == len(words) - 1:
-                    # Last word of a quote, so give the word a chance of
-                    # terminating the generated 'quote'.
-                    if key in lookup:
-                        lookup[key]["TOTAL"] += 1
-                        lookup[key]["TERM"] = lookup[key].get("TERM", 0) + 1.0
-                    else:
-                        lookup[key] = {"TERM": 1.0, "TOTAL": 1}
-                else:
-                    nxt = words[i + 1]
-                    if key in lookup:
-                        lookup[key]["TOTAL"] += 1
-                        lookup[key][nxt] = lookup[key].get(nxt, 0) + 1.0
-                    else:
-                        lookup[key] = {nxt: 1.0, "TOTAL": 1}
-
-        for word in lookup:
-            total = lookup[word]["TOTAL"]
-            del lookup[word]["TOTAL"]
-            for option in lookup[word]:
-                lookup[word][option] = lookup[word][option] / total
-
-        self.mc_table = lookup
-        conn.close()
+        user_filter, user_args = (" AND q.ID = ?", (user_id,)) if user_id is not None else ("", ())
+        if match := fts_query(query):
+            return await self.bot.db.fetchall(
+                f"{FTS_SELECT}WHERE QuotesFTS MATCH ?{user_filter} ORDER BY QuotesFTS.rank", (match, *user_args)
+            )
+        # Queries without any word (e.g. only emoji) cannot use the index
+        return await self.bot.db.fetchall(
+            f"SELECT q.ID, q.Name, q.Quote FROM Quotes q WHERE q.Quote LIKE ?{user_filter}", (f"%{query}%", *user_args)
+        )
+
+    async def search_quotes_regex(self, ctx, pattern):
+        """
+        Returns the (ID, Name, Quote) of the quotes matching a regex written
+        by a user, or None if it cannot be used, in which case the user is
+        told why. When the regex requires some words, only the quotes
+        containing them according to the full-text index are searched. The
+        search runs in an executor, within the query time budget.
+        """
+        loop = asyncio.get_running_loop()
+        problem = await loop.run_in_executor(None, pattern_problem, pattern, self.bot.config.regex["message_budget"])
+        if problem:
+            await ctx.send(f"This regex cannot be used because {problem}.")
+            return None
+        if match := fts_literal_query(required_literals(pattern)):
+            quotes = await self.bot.db.fetchall(f"{FTS_SELECT}WHERE QuotesFTS MATCH ? ORDER BY q.QuoteID", (match,))
+        else:
+            quotes = await self.bot.db.fetchall("SELECT ID, Name, Quote FROM Quotes")
+        try:
+            return await loop.run_in_executor(
+                None, search_all, regex.compile(pattern), quotes, self.bot.config.regex["query_budget"], 2
+            )
+        except RegexBudgetExceeded as e:
+            self.bot.dev_logger.warning(
+                f"Quote search {ctx.message.id} by user {ctx.author.id} ran out of time "
+                f"({e.elapsed * 1000:.0f} ms): {pattern}"
+            )
+            await ctx.send("This regex takes too long to search the quotes.")
+            return None
+
+    async def load_mc(self):
+        """
+        Loads the Markov chain model saved on disk for use with the ?generate
+        command and folds in the quotes added since it was saved. The model
+        is rebuilt from every quote if there is none or if quotes were
+        deleted since.
+        """
+        loop = asyncio.get_running_loop()
+        order, path = self.bot.config.markov["order"], self.bot.config.markov["model_path"]
+        async with self.mc_lock:
+            model = await loop.run_in_executor(None, MarkovModel.load, path, order)
+            if model is not None:
+                (count,) = await self.bot.db.fetchone(
+                    "SELECT COUNT(*) FROM Quotes WHERE QuoteID <= ?", (model.last_quote_id,)
+                )
+                if count != model.quote_count:
+                    model = None
+            if model is None:
+                self.bot.dev_logger.info("Building the Markov chain model from every quote")
+                model = MarkovModel(order)
+            rows = await self.bot.db.fetchall(
+                "SELECT QuoteID, Quote FROM Quotes WHERE QuoteID > ? ORDER BY QuoteID", (model.last_quote_id,)
+            )
+            await loop.run_in_executor(None, _fold_in_quotes, model, rows)
+            self.mc_model = model
+            if rows:
+                await loop.run_in_executor(None, model.save, path)
+
+    async def _save_mc_later(self):
+        await asyncio.sleep(MARKOV_SAVE_DELAY)
+        async with self.mc_lock:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.mc_model.save, self.bot.config.markov["model_path"]
+            )
+
+    async def add_quote(self, quote_row):
+        """
+        Inserts a quote, given as (ID, Name, Quote, Date), and folds it into
+        the Markov chain model. Both happen under the model's lock, so that a
+        quote added while the model is being loaded is counted exactly once.
+        """
+        async with self.mc_lock:
+            cursor = await self.bot.db.execute("INSERT INTO Quotes(ID, Name, Quote, Date) VALUES (?,?,?,?)", quote_row)
+            words = markov_words(quote_row[2])
+            self.mc_model.add(words, cursor.lastrowid)
+            if user_model := self.user_models_changed(quote_row[0]):
+                user_model.add(words, cursor.lastrowid)
+                self.user_mc_models.put(quote_row[0], user_model)
+        self.schedule_mc_save()
+
+    async def delete_quote(self, author_id, quote):
+        """Deletes a quote and takes it out of the Markov chain model."""
+        async with self.mc_lock:
+            cursor = await self.bot.db.execute("DELETE FROM Quotes WHERE ID = ? AND Quote = ?", (author_id, quote))
+            words = markov_words(quote)
+            user_model = self.user_models_changed(author_id)
+            for _ in range(cursor.rowcount):
+                self.mc_model.remove(words)
+                if user_model:
+                    user_model.remove(words)
+        self.schedule_mc_save()
+
+    def user_models_changed(self, user_id):
+        """
+        Called when quotes of a user are added or deleted: returns the cached
+        model of the user, if any, to be updated, and makes sure that a model
+        being built from the quotes the user had before is not cached.
+        """
+        self._user_mc_builds.pop(user_id, None)
+        return self.user_mc_models.get(user_id)
+
+    async def _build_user_mc(self, user_id):
+        try:
+            rows = await self.bot.db.fetchall("SELECT QuoteID, Quote FROM Quotes WHERE ID = ?", (user_id,))
+            model = MarkovModel(self.bot.config.markov["order"])
+            await asyncio.get_running_loop().run_in_executor(None, _fold_in_quotes, model, rows)
+        finally:
+            # Only cached if the quotes of the user did not change meanwhile
+            if up_to_date := self._user_mc_builds.get(user_id) is asyncio.current_task():
+                del self._user_mc_builds[user_id]
+        if up_to_date:
+            self.user_mc_models.put(user_id, model)
+        return model
+
+    async def get_user_mc(self, user_id):
+        """
+        Returns the Markov chain model of the quotes of a user. Models are
+        built in a background thread the first time they are needed and kept
+        in a least recently used cache bounded by the memory they use.
+        """
+        if (model := self.user_mc_models.get(user_id)) is not None:
+            return model
+        if (build := self._user_mc_builds.get(user_id)) is None:
+            build = self._user_mc_builds[user_id] = self.bot.loop.create_task(self._build_user_mc(user_id))
+        # Shielded so that a cancelled command does not cancel a build other
+        # commands may be waiting for
+        return await asyncio.shield(build)
+
+    def schedule_mc_save(self):
+        # Changes are batched, and are not lost if the bot stops before the
+        # model is saved since load_mc catches up with the database
+        if self._mc_save_task is None or self._mc_save_task.done():
+            self._mc_save_task = self.bot.loop.create_task(self._save_mc_later())
 
     @commands.command(aliases=["addq"])
     async def add_quotes(self, ctx, member: discord.Member = None, *, quote: str = None):
@@ -109,17 +324,11 @@ class Quotes(commands.Cog):
                 return
             member = member or ctx.message.reference.resolved.author
             quote = ctx.message.reference.resolved.content
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
         t = (member.id, member.name, quote, str(ctx.message.created_at))
-        c.execute("INSERT INTO Quotes VALUES (?,?,?,?)", t)
+        # Also adds the new quote data to the Markov Chain model.
+        await self.add_quote(t)
         msg = await ctx.send("Quote added.")
 
-        conn.commit()
-
-        # Rebuild the Markov Chain lookup table to include new quote data.
-        self.rebuild_mc()
-
         await msg.add_reaction("🚮")
 
         def check(reaction, user):
@@ -136,58 +345,48 @@ class Quotes(commands.Cog):
             )
 
         try:
-            await self.bot.wait_for("reaction_add", check=check, timeout=120)
+            await self.bot.interactions.wait_for_reaction(msg, check=check, timeout=120)
 
         except asyncio.TimeoutError:
             await msg.remove_reaction("🚮", self.bot.user)
 
         else:
-            t = (member.id, quote)
-            c.execute("DELETE FROM Quotes WHERE ID = ? AND Quote = ?", t)
-            conn.commit()
-            self.rebuild_mc()
+            await self.delete_quote(member.id, quote)
             await msg.delete()
             await ctx.send("`Quote deleted.`", delete_after=60)
 
-        conn.close()
-
     @commands.command(aliases=["q"])
     async def quotes(self, ctx, str1: str = None, *, str2: str = None):
         """
-        Retrieve a quote with a specified keyword / mention. Can optionally use
-        regex by surrounding the the query with /.../.
+        Retrieve a quote with a specified keyword / mention. Words match the
+        start of words of the quote, and text between double quotes must be
+        found as is. Can optionally use regex by surrounding the the query
+        with /.../.
         """
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
         mentions = ctx.message.mentions
 
         if str1 is None:  # No argument passed
-            quotes = c.execute("SELECT ID, Name, Quote FROM Quotes").fetchall()
+            quote = await self.random_quote()
+            quotes = [quote] if quote else []
 
         elif mentions and mentions[0].mention == str1:  # Has args
             u_id = mentions[0].id
             # Query for either user and quote or user only (None)
-            c.execute(
-                "SELECT ID, Name, Quote FROM Quotes WHERE ID = ? AND Quote " "LIKE ?",
-                (u_id, f"%{str2 if str2 is not None else ''}%"),
-            )
-            quotes = c.fetchall()
+            if str2 is not None:
+                quotes = await self.search_quotes(str2, u_id)
+            else:
+                quote = await self.random_quote(u_id)
+                quotes = [quote] if quote else []
 
         else:  # query for quote only
             query = str1 if str2 is None else f"{str1} {str2}"
             if query[0] == "/" and query[-1] == "/":
-                c.execute("SELECT ID, Name, Quote FROM Quotes")
-                quotes = c.fetchall()
-                try:
-                    quotes = [q for q in quotes if re.search(query[1:-1], q[2])]
-                except re.error:
-                    conn.close()
-                    await ctx.send("Invalid regex syntax.")
+                quotes = await self.search_quotes_regex(ctx, query[1:-1])
+                if quotes is None:
                     return
             else:
-                c.execute("SELECT ID, Name, Quote FROM Quotes WHERE Quote LIKE ?", (f"%{query}%",))
-                quotes = c.fetchall()
+                quotes = await self.search_quotes(query)
 
         if not quotes:
             msg = await ctx.send("Quote not found.\n")
@@ -203,7 +402,7 @@ class Quotes(commands.Cog):
                 )
 
             try:
-                await self.bot.wait_for("reaction_add", check=check, timeout=120)
+                await self.bot.interactions.wait_for_reaction(msg, check=check, timeout=120)
 
             except asyncio.TimeoutError:
                 await msg.remove_reaction("🆗", self.bot.user)
@@ -212,10 +411,8 @@ class Quotes(commands.Cog):
                 await ctx.message.delete()
                 await msg.delete()
 
-            conn.close()
             return
 
-        conn.close()
         quote_tuple = random.choice(quotes)
         author_id = int(quote_tuple[0])
         name = quote_tuple[1]
@@ -239,6 +436,7 @@ class Quotes(commands.Cog):
         await ctx.send(embed=embed)
 
     @commands.command(aliases=["lq"])
+    @interactive
     async def list_quotes(self, ctx, author: discord.Member = None):
         """
         List quotes
@@ -246,28 +444,35 @@ class Quotes(commands.Cog):
 
         await ctx.trigger_typing()
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-
         quote_author = author if author else ctx.message.author
         author_id = quote_author.id
-        c.execute("SELECT * FROM Quotes WHERE ID = ?", (author_id,))
-        quote_list = c.fetchall()
+        source = SQLPageSource(
+            self.bot.db,
+            "SELECT Quote, QuoteID FROM Quotes WHERE ID = ? AND {after} ORDER BY QuoteID",
+            (author_id,),
+            format_row=lambda row, position: f"[{position}] {row[0]}",
+            key_condition="QuoteID > ?",
+            key_columns=1,
+        )
+        quote_count = await source.count()
 
-        if not quote_list:
+        if not quote_count:
             await ctx.send("No quote found.", delete_after=60)
             return
 
-        quote_list_text = [f"[{i}] {quote[2]}" for i, quote in enumerate(quote_list, 1)]
-
-        p = Pages(ctx, item_list=quote_list_text, title="Quotes from {}".format(quote_author.display_name))
+        p = Pages(
+            ctx,
+            page_source=source,
+            title="Quotes from {}".format(quote_author.display_name),
+            display_option=(0, LIST_QUOTES_PER_PAGE),
+        )
 
         await p.paginate()
 
         def msg_check(msg):
             try:
                 return (
-                    0 <= int(msg.content) <= len(quote_list)
+                    0 <= int(msg.content) <= quote_count
                     and msg.author.id == author_id
                     and msg.channel == ctx.message.channel
                 )
@@ -282,7 +487,7 @@ class Quotes(commands.Cog):
             )
 
             try:
-                message = await self.bot.wait_for("message", check=msg_check, timeout=60)
+                message = await self.bot.interactions.wait_for_message(ctx.channel, check=msg_check, timeout=60)
 
             except asyncio.TimeoutError:
                 await ctx.send("Command timeout. You may want to run the command again.", delete_after=60)
@@ -293,26 +498,27 @@ class Quotes(commands.Cog):
                 if index == -1:
                     await ctx.send("Exit delq.", delete_after=60)
                 else:
-                    t = (quote_list[index][0], quote_list[index][2])
-                    del quote_list[index]
-                    c.execute("DELETE FROM Quotes WHERE ID = ? AND Quote = ?", t)
-                    conn.commit()
+                    (quote,) = await self.bot.db.fetchone(
+                        "SELECT Quote FROM Quotes WHERE ID = ? ORDER BY QuoteID LIMIT 1 OFFSET ?", (author_id, index)
+                    )
+                    await self.delete_quote(author_id, quote)
 
                     await ctx.send("Quote deleted", delete_after=60)
                     await message.delete()
 
-                    p.itemList = [f"[{i}] {quote[2]}" for i, quote in enumerate(quote_list, 1)]
+                    source.reset()
+                    quote_count = await source.count()
 
+                # The pages are fetched again
                 await p.paginate()
 
-        conn.commit()
-        conn.close()
-
     @commands.command(aliases=["allq", "aq"])
     async def all_quotes(self, ctx, *, query):
         """
-        List all quotes that contain the query string. Can optionally use regex
-        by surrounding the the query with /.../.
+        List all quotes that contain the query, best matches first. Words match
+        the start of words of the quote, and text between double quotes must be
+        found as is. Can optionally use regex by surrounding the the query with
+        /.../.
         Usage: ?all_quotes [-p pagenum] query
 
         Optional arguments:
@@ -339,21 +545,12 @@ class Quotes(commands.Cog):
         query = " ".join(query_splitted)
         await ctx.trigger_typing()
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-
         if query[0] == "/" and query[-1] == "/":
-            c.execute("SELECT * FROM Quotes")
-            quotes = c.fetchall()
-            try:
-                quote_list = [q for q in quotes if re.search(query[1:-1], q[2])]
-            except re.error:
-                conn.close()
-                await ctx.send("Invalid regex syntax.")
+            quote_list = await self.search_quotes_regex(ctx, query[1:-1])
+            if quote_list is None:
                 return
         else:
-            c.execute("SELECT * FROM Quotes WHERE Quote LIKE ?", (f"%{query}%",))
-            quote_list = c.fetchall()
+            quote_list = await self.search_quotes(query)
 
         if not quote_list:
             await ctx.send("No quote found.", delete_after=60)
@@ -372,69 +569,40 @@ class Quotes(commands.Cog):
         await p.paginate()
 
     @commands.command(aliases=["gen"])
-    async def generate(self, ctx, seed: str = None, min_length: int = 1):
+    async def generate(self, ctx, member: Optional[MentionedMember] = None, seed: str = None, min_length: int = 1):
         """
         Generates a random 'quote' using a Markov Chain. Optionally takes in a
-        word to seed the Markov Chain with and (also optionally) a desired
-        minimum length which is NOT guaranteed to be met.
+        mention of a user to only use their quotes, a word to seed the Markov
+        Chain with and (also optionally) a desired minimum length which is NOT
+        guaranteed to be met.
         """
 
         await ctx.trigger_typing()
 
+        model = await self.get_user_mc(member.id) if member else self.mc_model
+
         # Preprocess seed so that we can use it as a lookup
         if seed is not None:
             seed = re.sub(GEN_SPACE_SYMBOLS, " ", re.sub(GEN_SPACE_SYMBOLS, "", seed.lower())).strip()
         else:
-            try:
-                seed = np.random.choice(list(self.mc_table.keys()))
-            except ValueError:
-                # Value errors are encountered when the keys list is empty.
-                seed = None
+            seed = model.random_seed()
 
-        if seed is None:
+        if seed is None and member:
+            await ctx.send(f"There are no quotes from {member.display_name} to learn from.", delete_after=60)
+        elif seed is None:
             await ctx.send("Markov chain table is empty.", delete_after=60)
-        elif seed not in self.mc_table.keys():
+        elif seed not in model:
             await ctx.send("Could not generate anything with that seed.", delete_after=60)
         else:
             longest_sentence = []
             retries = 0
 
             while len(longest_sentence) < min_length and retries < 200:
-                current_word = seed
-                sentence = [current_word]
-
-                # Add words to the sentence until a termination condition is
-                # encountered.
-                while True:
-                    choices = [(w, self.mc_table[current_word][w]) for w in self.mc_table[current_word]]
-                    c_words, p_dist = zip(*choices)
-
-                    # Choose a random word and add it to the sentence using the
-                    # probability distribution stored in the word entry.
-                    old_word = current_word
-                    current_word = np.random.choice(c_words, p=p_dist)
-
-                    # Don't allow termination until the minimum length is met
-                    # or we don't have any other option.
-                    while (
-                        current_word == "TERM"
-                        and len(sentence) < min_length
-                        and len(self.mc_table[old_word].keys()) > 1
-                    ):
-                        current_word = np.random.choice(c_words, p=p_dist)
-
-                    # Don't allow repeat words too much
-                    while len(sentence) >= 3 and (current_word == sentence[-1] == sentence[-2] == sentence[-3]):
-                        current_word = np.random.choice(c_words, p=p_dist)
-
-                    # Cap sentence at 1000 words, just in case, and terminate
-                    # if termination symbol is seen.
-                    if current_word == "TERM" or len(sentence) >= 1000:
-                        break
-                    sentence.append(current_word)
+                # Cap sentence at 1000 words, just in case
+                sentence = model.generate(seed, min_length, max_length=1000)
 
                 if len(longest_sentence) < len(sentence) and len(" ".join(sentence)) <= 2000:
-                    longest_sentence = sentence[:]
+                    longest_sentence = sentence
 
                 retries += 1
 
@@ -20,11 +20,12 @@ import discord
 from discord.ext import commands
 import asyncio
 
-# For DB Functionality
-import sqlite3
 import datetime
+import time
 
 # Other utilities
+from .utils.interactions import interactive
+from .utils.scheduler import RetryJob
 from .utils.paginator import Pages
 
 # For remindme functionality
@@ -88,61 +89,73 @@ YMD_REGEX = re.compile(r"(2[0-1][0-9][0-9])[\s./-]((1[0-2]|0?[1-9]))[\s./-]" r"(
 # Regex for time HH:MM
 HM_REGEX = re.compile(r"\b([0-1]?[0-9]|2[0-4]):([0-5][0-9])")
 
+SECONDS_PER_DAY = 86400
+
+# Name of the scheduler's handler for reminders, whose jobs are keyed by ReminderID
+REMINDER_JOB = "reminder"
+
+INSERT_REMINDER = "INSERT INTO Reminders(ID, Name, Reminder, Frequency, Date, LastReminder) VALUES (?, ?, ?, ?, ?, ?)"
+
 
 class Reminder(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.frequencies = {"daily": 1, "weekly": 7, "monthly": 30}
+        self.bot.loop.create_task(self.bot.scheduler.register(REMINDER_JOB, self._send_reminder))
 
-    async def check_reminders(self):
-        """
-        Co-routine that periodically checks if the bot must issue reminders to
-        users.
-        :return: None
-        """
+    def cog_unload(self):
+        self.bot.scheduler.unregister(REMINDER_JOB)
 
-        await self.bot.wait_until_ready()
-        while not self.bot.is_closed():
-            conn = sqlite3.connect(self.bot.config.db_path)
-            c = conn.cursor()
-            guild = self.bot.get_guild(self.bot.config.server_id)
-            if not guild:
-                return
-            reminders = c.execute("SELECT * FROM Reminders").fetchall()
-            for i in range(len(reminders)):
-                member = discord.utils.get(guild.members, id=reminders[i][0])
-
-                # If non-repeating reminder is found
-                if reminders[i][3] == "once":
-                    # Check date to remind user
-                    reminder_activation_date = datetime.datetime.strptime(reminders[i][4], "%Y-%m-%d %H:%M:%S.%f")
-                    # Compute future_date and current_date and if past, means
-                    # time is due to remind user.
-                    if reminder_activation_date <= datetime.datetime.now():
-                        await member.send("Reminding you to {}!".format(reminders[i][2]))
-                        # Remove from from DB non-repeating reminder
-                        c.execute(
-                            ("DELETE FROM Reminders WHERE Reminder=? AND ID=?" + " AND DATE=?"),
-                            (reminders[i][2], reminders[i][0], reminder_activation_date),
-                        )
-                        conn.commit()
-                        await asyncio.sleep(1)
+    def _next_due(self, frequency: str, date: int, last_reminder: int) -> int:
+        if frequency == "once":
+            return date
+        return last_reminder + self.frequencies[frequency] * SECONDS_PER_DAY
 
-                else:
-                    last_date = datetime.datetime.strptime(reminders[i][5], "%Y-%m-%d %H:%M:%S.%f")
+    async def _add_reminder(self, t: tuple):
+        """
+        Inserts a reminder, given as a row of Reminders without its ID, and
+        schedules it.
+        """
+        async with self.bot.db.transaction() as txn:
+            cursor = await txn.execute(INSERT_REMINDER, t)
+            await self.bot.scheduler.schedule(REMINDER_JOB, cursor.lastrowid, self._next_due(t[3], t[4], t[5]))
 
-                    if datetime.datetime.now() - last_date > datetime.timedelta(days=self.frequencies[reminders[i][3]]):
-                        await member.send(f"Reminding you to {reminders[i][2]}! [{i + 1:d}]")
+    async def _send_reminder(self, key: str, _payload):
+        """
+        Scheduler handler sending the reminder whose ReminderID is key.
+        """
+        guild = self.bot.get_guild(self.bot.config.server_id)
+        if not guild:
+            raise RetryJob("the guild is not available")
+        reminder_id = int(key)
+        fetched = await self.bot.db.fetchone(
+            "SELECT ID, Reminder, Frequency FROM Reminders WHERE ReminderID = ?", (reminder_id,)
+        )
+        if not fetched:
+            return
+        user_id, reminder, frequency = fetched
+
+        if frequency == "once":
+            message = "Reminding you to {}!".format(reminder)
+        else:
+            # The number shown is the reminder's position in the user's list
+            position = await self.bot.db.fetchone(
+                "SELECT count(*) FROM Reminders WHERE ID = ? AND ReminderID <= ?", (user_id, reminder_id)
+            )
+            message = f"Reminding you to {reminder}! [{position[0]:d}]"
 
-                        c.execute(
-                            ("UPDATE 'Reminders' SET LastReminder=? WHERE " + "Reminder=?"),
-                            (datetime.datetime.now(), reminders[i][2]),
-                        )
-                        conn.commit()
-                        await asyncio.sleep(1)
+        member = guild.get_member(user_id)
+        if member:
+            await self.bot.message_dispatcher.send(member, message)
 
-            conn.close()
-            await asyncio.sleep(60)  # seconds
+        if frequency == "once":
+            # Remove from from DB non-repeating reminder
+            await self.bot.db.execute("DELETE FROM Reminders WHERE ReminderID = ?", (reminder_id,))
+        else:
+            now = int(time.time())
+            async with self.bot.db.transaction() as txn:
+                await txn.execute("UPDATE Reminders SET LastReminder = ? WHERE ReminderID = ?", (now, reminder_id))
+                await self.bot.scheduler.schedule(REMINDER_JOB, reminder_id, self._next_due(frequency, now, now))
 
     @commands.command(aliases=["rm", "rem"])
     async def remindme(self, ctx, *, quote: str = ""):
@@ -241,21 +254,19 @@ class Reminder(commands.Cog):
                     reminder = reminder[time_input_end + 1 :].strip()
 
                 # Add message to database
-                conn = sqlite3.connect(self.bot.config.db_path)
-                c = conn.cursor()
                 t = (
                     ctx.message.author.id,
                     ctx.message.author.name,
                     reminder,
                     "once",
-                    absolute_duedate,
-                    datetime.datetime.now(),
+                    int(absolute_duedate.timestamp()),
+                    int(time.time()),
                 )
 
-                c.execute("INSERT INTO Reminders VALUES (?, ?, ?, ?, ?, ?)", t)
+                await self._add_reminder(t)
 
-                # Send user information and close database
-                reminders = c.execute("SELECT * FROM Reminders WHERE ID =?", (ctx.message.author.id,)).fetchall()
+                # Send user information
+                reminders = await self.bot.db.fetchall("SELECT * FROM Reminders WHERE ID =?", (ctx.message.author.id,))
                 await ctx.author.send(
                     "Hi {}! \nI will remind you to {} on {} at {} unless you "
                     "send me a message to stop reminding you about it! "
@@ -266,9 +277,6 @@ class Reminder(commands.Cog):
 
                 await ctx.send("Reminder added.")
 
-                conn.commit()
-                conn.close()
-
                 return
 
             # Wrong input feedback depending on what is missing.
@@ -314,13 +322,18 @@ class Reminder(commands.Cog):
 
         # DB: Date will hold TDELTA (When reminder is due), LastReminder will
         # hold datetime.datetime.now()
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-        t = (ctx.message.author.id, ctx.message.author.name, reminder, "once", reminder_time, time_now)
+        t = (
+            ctx.message.author.id,
+            ctx.message.author.name,
+            reminder,
+            "once",
+            int(reminder_time.timestamp()),
+            int(time_now.timestamp()),
+        )
 
-        reminders = c.execute("SELECT * FROM Reminders WHERE ID =?", (ctx.message.author.id,)).fetchall()
+        reminders = await self.bot.db.fetchall("SELECT * FROM Reminders WHERE ID =?", (ctx.message.author.id,))
 
-        c.execute("INSERT INTO Reminders VALUES (?, ?, ?, ?, ?, ?)", t)
+        await self._add_reminder(t)
 
         # Gets reminder date in YYYY-MM-DD format
         due_date = str(datetime.date(reminder_time.year, reminder_time.month, reminder_time.day))
@@ -335,22 +348,24 @@ class Reminder(commands.Cog):
         )
         await ctx.send("Reminder added.")
 
-        conn.commit()
-        conn.close()
-
     @staticmethod
     def formatted_reminder_list(rem_list):
         return [
             "[{num}] (Frequency: {freq}{opt_date}) - {rem_text}".format(
                 num=i,
                 freq=rem[3].capitalize(),
-                opt_date=(" at {date}".format(date=rem[4].split(".")[0]) if rem[3] == "once" else ""),
+                opt_date=(
+                    " at {date}".format(date=datetime.datetime.fromtimestamp(rem[4]).strftime("%Y-%m-%d %H:%M:%S"))
+                    if rem[3] == "once"
+                    else ""
+                ),
                 rem_text=rem[2],
             )
             for i, rem in enumerate(rem_list, 1)
         ]
 
     @commands.command(aliases=["lr"])
+    @interactive
     async def list_reminders(self, ctx):
         """
         List reminders
@@ -365,18 +380,11 @@ class Reminder(commands.Cog):
             )
             return
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-
         rem_author = ctx.message.author
         author_id = rem_author.id
-        c.execute("SELECT * FROM Reminders WHERE ID = ?", (author_id,))
-
-        rem_list = c.fetchall()
+        rem_list = await self.bot.db.fetchall("SELECT * FROM Reminders WHERE ID = ? ORDER BY ReminderID", (author_id,))
         if not rem_list:
             await ctx.send("No reminder found.", delete_after=60)
-            conn.commit()
-            conn.close()
             return
 
         p = Pages(
@@ -406,7 +414,7 @@ class Reminder(commands.Cog):
             )
 
             try:
-                message = await self.bot.wait_for("message", check=msg_check, timeout=60)
+                message = await self.bot.interactions.wait_for_message(ctx.channel, check=msg_check, timeout=60)
 
             except asyncio.TimeoutError:
                 await ctx.send("Command timeout. You may want to run the command again.", delete_after=60)
@@ -420,12 +428,13 @@ class Reminder(commands.Cog):
                     await ctx.send("Exit delq.", delete_after=60)
 
                 else:
-                    t = (rem_list[index][0], rem_list[index][2])
+                    reminder_id = rem_list[index][6]
                     # Remove deleted reminder from list:
                     del rem_list[index]
 
-                    c.execute("DELETE FROM Reminders WHERE ID = ? AND " "Reminder = ?", t)
-                    conn.commit()
+                    async with self.bot.db.transaction() as txn:
+                        await txn.execute("DELETE FROM Reminders WHERE ReminderID = ?", (reminder_id,))
+                        await self.bot.scheduler.cancel(REMINDER_JOB, reminder_id)
 
                     await ctx.send("Reminder deleted", delete_after=60)
 
@@ -433,9 +442,6 @@ class Reminder(commands.Cog):
 
                 await p.paginate()
 
-        conn.commit()
-        conn.close()
-
     async def __remindme_repeating(self, ctx, freq: str = "", *, quote: str = ""):
         """
         Called by remindme to add a repeating reminder to the reminder
@@ -462,34 +468,29 @@ class Reminder(commands.Cog):
         if bad_input:
             return
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-
         t = (
             ctx.message.author.id,
             ctx.message.author.name,
             quote,
             freq,
-            datetime.datetime.now(),
-            datetime.datetime.now(),
+            int(time.time()),
+            int(time.time()),
         )
 
-        reminders = c.execute(
+        reminders = await self.bot.db.fetchall(
             "SELECT * FROM Reminders WHERE Reminder = ? AND ID = ?", (quote, ctx.message.author.id)
-        ).fetchall()
+        )
 
         if len(reminders) > 0:
             await ctx.send(
                 "The reminder `{}` already exists in your database. Please "
                 "specify a unique reminder message!".format(quote)
             )
-            conn.commit()
-            conn.close()
             return
 
-        reminders = c.execute("SELECT * FROM Reminders WHERE ID = ?", (ctx.message.author.id,)).fetchall()
+        reminders = await self.bot.db.fetchall("SELECT * FROM Reminders WHERE ID = ?", (ctx.message.author.id,))
 
-        c.execute("INSERT INTO Reminders VALUES (?, ?, ?, ?, ?, ?)", t)
+        await self._add_reminder(t)
 
         # Strips the string "to " from reminder messages
         if quote[:3].lower() == "to ":
@@ -502,11 +503,6 @@ class Reminder(commands.Cog):
 
         await ctx.send("Reminder added.")
 
-        conn.commit()
-        conn.close()
-
 
 def setup(bot):
-    database = Reminder(bot)
-    bot.add_cog(database)
-    bot.loop.create_task(database.check_reminders())
+    bot.add_cog(Reminder(bot))
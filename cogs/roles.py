@@ -16,7 +16,6 @@
 # along with Canary. If not, see <https://www.gnu.org/licenses/>.
 
 import discord
-import sqlite3
 
 from discord import utils
 from discord.ext import commands
@@ -264,17 +263,17 @@ class Roles(commands.Cog):
         A moderator can click the OK react on the message to give these roles back
         """
 
-        if is_in_muted_table(self.bot, user):
+        if await is_in_muted_table(self.bot, user):
             await ctx.send("Cannot restore roles to a muted user")
             return
 
-        valid_roles = fetch_saved_roles(self.bot, ctx.guild, user)
+        valid_roles = await fetch_saved_roles(self.bot, ctx.guild, user)
         await role_restoring_page(self.bot, ctx, user, valid_roles)
 
     @commands.Cog.listener()
     async def on_member_remove(self, user: discord.Member):
         # If the user is muted, this saves all roles BUT the muted role into the PreviousRoles table
-        save_existing_roles(self.bot, user, muted=is_in_muted_table(self.bot, user))
+        await save_existing_roles(self.bot, user, muted=await is_in_muted_table(self.bot, user))
 
 
 def setup(bot):
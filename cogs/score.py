@@ -24,20 +24,25 @@ import discord
 from discord.ext import commands
 
 # For DB functionality
-import sqlite3
 import json
 from .utils.members import add_member_if_needed
+from .utils.lru_cache import LRUCache
+from .utils.checks import is_developer
 
 # For argument parsing
 from discord.ext.commands import MemberConverter, PartialEmojiConverter
 from .utils.arg_converter import ArgConverter
 
 # For pagination
-from .utils.paginator import Pages
+from .utils.paginator import Pages, SQLPageSource
 
 f = open("data/premade/emoji.json", encoding="utf8")
 EMOJI = json.load(f)
 
+# Number of message ID -> author ID pairs remembered to avoid fetching the
+# message every time one of its reactions changes
+AUTHOR_CACHE_SIZE = 50000
+
 
 class TotalEmojiConverter(commands.Converter):
     async def convert(self, ctx, argument):
@@ -150,6 +155,7 @@ class Score(commands.Cog):
         self.guild = None
         self.UPMARTLET = None
         self.DOWNMARTLET = None
+        self.message_authors = LRUCache(AUTHOR_CACHE_SIZE)
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -239,6 +245,17 @@ class Score(commands.Cog):
 
         return args_dict
 
+    @staticmethod
+    def _table_and_count_from_args_dict(args_dict):
+        # ReactionCounts holds the number of reactions for each
+        # (reacter, reactee, emoji) and can answer every query that doesn't
+        # need per-message detail, i.e. anything but before/after. The
+        # returned value is what each row contributes to a count: summing it
+        # gives the number of matching reactions for either table
+        if args_dict["before"] or args_dict["after"]:
+            return "Reactions", "1"
+        return "ReactionCounts", "Count"
+
     def _where_str_and_values_from_args_dict(self, args_dict, prefix=None):
         where_list = []
         values_list = []
@@ -298,37 +315,46 @@ class Score(commands.Cog):
         where_str = " AND ".join(where_list)
         return where_str, tuple(values_list)
 
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if message.guild and message.guild.id == self.bot.config.server_id:
+            self.message_authors.put(message.id, message.author.id)
+
+    async def _get_message_author_id(self, channel_id, message_id):
+        # Look in our own cache, then in discord.py's message cache, and
+        # only fetch the message from the API if neither has it
+        author_id = self.message_authors.get(message_id)
+        if author_id is not None:
+            return author_id
+
+        message = discord.utils.get(self.bot.cached_messages, id=message_id)
+        if message is None:
+            channel = self.bot.get_channel(channel_id)
+            try:
+                message = await channel.fetch_message(message_id)
+            except discord.errors.NotFound:
+                return None
+
+        self.message_authors.put(message_id, message.author.id)
+        return message.author.id
+
     async def _add_or_remove_reaction_from_db(self, payload, remove=False):
-        channel = self.bot.get_channel(payload.channel_id)
         message_id = payload.message_id
 
-        try:
-            message = await channel.fetch_message(message_id)
-        except discord.errors.NotFound:
+        reactee_id = await self._get_message_author_id(payload.channel_id, message_id)
+        if reactee_id is None:
             return
 
-        conn = sqlite3.connect(self.bot.config.db_path)
-        conn.execute("PRAGMA foreign_keys = ON")
-        c = conn.cursor()
-
         reacter_id = self.bot.get_user(payload.user_id).id
-        await add_member_if_needed(self, c, reacter_id)
-        reactee_id = message.author.id
-        await add_member_if_needed(self, c, reactee_id)
+        await add_member_if_needed(self, self.bot.db, reacter_id)
+        await add_member_if_needed(self, self.bot.db, reactee_id)
 
         emoji = payload.emoji
 
         if remove:
-            c.execute(
-                "DELETE FROM Reactions WHERE ReacterID = ? AND ReacteeID = ? " "AND ReactionName = ? AND MessageID = ?",
-                (reacter_id, reactee_id, str(emoji), message_id),
-            )
+            self.bot.write_queue.remove_reaction(reacter_id, reactee_id, str(emoji), message_id)
         else:
-            c.execute(
-                "INSERT OR IGNORE INTO Reactions VALUES (?,?,?,?)", (reacter_id, reactee_id, str(emoji), message_id)
-            )
-        conn.commit()
-        conn.close()
+            self.bot.write_queue.add_reaction(reacter_id, reactee_id, str(emoji), message_id)
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
@@ -340,6 +366,12 @@ class Score(commands.Cog):
         if payload.guild_id == self.guild.id:
             await self._add_or_remove_reaction_from_db(payload, remove=True)
 
+    @commands.command(aliases=["authorcache"])
+    @is_developer()
+    async def author_cache(self, ctx):
+        """Show the usage of the message author cache used for reaction tracking"""
+        await ctx.send(f"Message author cache: {self.message_authors.stats()}")
+
     @commands.command()
     async def score(self, ctx, *args):
         """Display emoji score
@@ -386,27 +418,22 @@ class Score(commands.Cog):
 
         # get the WHERE conditions and the values
         where_str, t = self._where_str_and_values_from_args_dict(args_dict)
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
+        table, n = self._table_and_count_from_args_dict(args_dict)
         if args_dict["emojitype"] != "score":
-            c.execute(f"SELECT count(ReacteeID) FROM Reactions " f"WHERE {where_str}", t)
-            react_count = c.fetchone()[0]
+            fetched = await self.bot.db.fetchone(f"SELECT IFNULL(SUM({n}), 0) FROM {table} WHERE {where_str}", t)
         else:
-            c.execute(
+            fetched = await self.bot.db.fetchone(
                 (
-                    f"SELECT COUNT(IIF (ReactionName = ?1, 1, NULL)) - "
-                    f"COUNT(IIF (ReactionName = ?2, 1, NULL)) "
-                    f"FROM Reactions "
+                    f"SELECT IFNULL(SUM(IIF (ReactionName = ?1, {n}, 0)) - "
+                    f"SUM(IIF (ReactionName = ?2, {n}, 0)), 0) "
+                    f"FROM {table} "
                     f"WHERE {where_str} "
                     f"AND (ReactionName = ?1 OR ReactionName=?2) "
                 ),
                 (str(self.UPMARTLET), str(self.DOWNMARTLET), *t),
             )
-            react_count = c.fetchone()[0]
 
-        await ctx.send(react_count)
-
-        conn.close()
+        await ctx.send(fetched[0])
 
     @commands.command()
     async def ranking(self, ctx, *args):
@@ -444,9 +471,6 @@ class Score(commands.Cog):
             -"nothere" (All custom emoji not in the server),
             -"score" (The emojis used as upvotes and downvotes)
         """
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-
         try:
             args_dict = await self._get_converted_args_dict(ctx, args, from_nand_to=True, member=False)
         except commands.BadArgument as err:
@@ -457,60 +481,59 @@ class Score(commands.Cog):
             select_id = "ReacteeID"
         else:
             select_id = "ReacterID"
+        table, n = self._table_and_count_from_args_dict(args_dict)
         if args_dict["emojitype"] != "score":
             # get the WHERE conditions and the values
             where_str, t = self._where_str_and_values_from_args_dict(args_dict)
-            c.execute(
+            source = SQLPageSource(
+                self.bot.db,
                 (
                     f"SELECT printf('%d. %s', "
-                    f"ROW_NUMBER() OVER (ORDER BY count(*) DESC), M.Name), "
-                    f"printf('%d %s', count(*), "
-                    f"IIF (count(*)!=1, 'times', 'time')) "
-                    f"FROM Reactions AS R, Members as M "
+                    f"ROW_NUMBER() OVER (ORDER BY SUM({n}) DESC), M.Name), "
+                    f"printf('%d %s', SUM({n}), "
+                    f"IIF (SUM({n})!=1, 'times', 'time')) "
+                    f"FROM {table} AS R, Members as M "
                     f"WHERE {where_str} "
                     f"AND R.{select_id} = M.ID "
                     f"GROUP BY R.{select_id} "
-                    f"ORDER BY count(*) DESC"
+                    f"ORDER BY SUM({n}) DESC"
                 ),
                 t,
+                materialize=True,
             )
 
-            counts = list(zip(*c.fetchall()))
-            if not counts:
+            if not await source.count():
                 await ctx.send(embed=discord.Embed(title="This reaction was never used on this server."))
                 return
-            names, values = counts
 
         else:
             # get the WHERE conditions and the values
             where_str, t = self._where_str_and_values_from_args_dict(args_dict, prefix="R")
-            c.execute(
+            source = SQLPageSource(
+                self.bot.db,
                 (
                     f"SELECT printf('%d. %s', "
                     f"ROW_NUMBER() OVER (ORDER BY TotalCount DESC), Name), "
                     f"TotalCount FROM "
                     f"(SELECT M.Name, "
-                    f"COUNT(IIF (ReactionName = ?1, 1, NULL)) - "
-                    f"COUNT(IIF (ReactionName = ?2, 1, NULL)) "
+                    f"SUM(IIF (ReactionName = ?1, {n}, 0)) - "
+                    f"SUM(IIF (ReactionName = ?2, {n}, 0)) "
                     f"AS TotalCount "
-                    f"FROM Reactions AS R, Members as M "
+                    f"FROM {table} AS R, Members as M "
                     f"WHERE {where_str} "
                     f"AND (ReactionName = ?1 OR ReactionName=?2) "
                     f"AND R.{select_id} = M.ID "
-                    f"GROUP BY R.{select_id})"
+                    f"GROUP BY R.{select_id}) "
+                    f"ORDER BY TotalCount DESC"
                 ),
                 (str(self.UPMARTLET), str(self.DOWNMARTLET), *t),
+                materialize=True,
             )
-            counts = list(zip(*c.fetchall()))
-            if not counts:
+            if not await source.count():
                 await ctx.send(embed=discord.Embed(title="No results found"))
                 return
-            names = counts[0]
-            values = counts[1]
 
-        conn.close()
-        paginator_dict = {"names": names, "values": values}
-        p = Pages(ctx, item_list=paginator_dict, title="Score ranking", display_option=(2, 9), editable_content=False)
+        p = Pages(ctx, page_source=source, title="Score ranking", display_option=(2, 9), editable_content=False)
 
         await p.paginate()
 
@@ -545,9 +568,6 @@ class Score(commands.Cog):
             -"here" (All custom emojis in the server),
             -"nothere" (All custom emoji not in the server)
         """
-        conn = sqlite3.connect(self.bot.config.db_path)
-        c = conn.cursor()
-
         try:
             args_dict = await self._get_converted_args_dict(ctx, args, from_xnor_to=True, member=False, emoji=False)
         except commands.BadArgument as err:
@@ -558,29 +578,28 @@ class Score(commands.Cog):
             await ctx.send("Invalid input: Emojitype flag cannot use " "type score for this function")
         # get the WHERE conditions and the values
         where_str, t = self._where_str_and_values_from_args_dict(args_dict)
-        c.execute(
+        table, n = self._table_and_count_from_args_dict(args_dict)
+        source = SQLPageSource(
+            self.bot.db,
             (
                 f"SELECT printf('%d. %s', "
-                f"ROW_NUMBER() OVER (ORDER BY count(*) DESC), "
-                f"ReactionName), printf('%d %s', count(*), "
-                f"IIF (count(*)!=1, 'times', 'time')) "
-                f"FROM Reactions "
+                f"ROW_NUMBER() OVER (ORDER BY SUM({n}) DESC), "
+                f"ReactionName), printf('%d %s', SUM({n}), "
+                f"IIF (SUM({n})!=1, 'times', 'time')) "
+                f"FROM {table} "
                 f"WHERE {where_str} "
                 f"GROUP BY ReactionName "
+                f"ORDER BY SUM({n}) DESC"
             ),
             t,
+            materialize=True,
         )
 
-        counts = list(zip(*c.fetchall()))
-        if not counts:
+        if not await source.count():
             await ctx.send(embed=discord.Embed(title="No results found"))
             return
-        names = counts[0]
-        values = counts[1]
 
-        conn.close()
-        paginator_dict = {"names": names, "values": values}
-        p = Pages(ctx, item_list=paginator_dict, title="Emoji ranking", display_option=(2, 9), editable_content=False)
+        p = Pages(ctx, page_source=source, title="Emoji ranking", display_option=(2, 9), editable_content=False)
 
         await p.paginate()
 
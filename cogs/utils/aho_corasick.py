@@ -0,0 +1,77 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+from collections import deque
+
+
+class AhoCorasick:
+    def __init__(self, keywords: list[str]):
+        """An Aho-Corasick automaton, which finds every occurrence of any of
+        a list of keywords in a text in a single pass over the text, however
+        many keywords there are.
+
+        Arguments:
+        - keywords: the (non-empty) strings to look for
+        """
+        # Node 0 is the root. For every node: its children by character, the
+        # node to fall back to when no child matches, and the indices of the
+        # keywords ending there (including through fallbacks)
+        self._children: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._outputs: list[frozenset[int]] = [frozenset()]
+
+        outputs: list[set[int]] = [set()]
+        for index, keyword in enumerate(keywords):
+            node = 0
+            for char in keyword:
+                child = self._children[node].get(char)
+                if child is None:
+                    child = len(self._children)
+                    self._children[node][char] = child
+                    self._children.append({})
+                    self._fail.append(0)
+                    outputs.append(set())
+                node = child
+            outputs[node].add(index)
+
+        # Breadth-first, so that the fallback of a node is always computed
+        # before the node itself
+        queue = deque(self._children[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._children[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._children[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._children[fail].get(char, 0)
+                outputs[child] |= outputs[self._fail[child]]
+                queue.append(child)
+
+        self._outputs = [frozenset(output) for output in outputs]
+
+    def find_all(self, text: str) -> set[int]:
+        """Returns the indices of the keywords found in text."""
+        children, fail, outputs = self._children, self._fail, self._outputs
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in children[node]:
+                node = fail[node]
+            node = children[node].get(char, 0)
+            if outputs[node]:
+                found |= outputs[node]
+        return found
@@ -0,0 +1,181 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import contextvars
+import sqlite3
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, Callable, Iterable, Optional
+
+# The transaction (if any) the current task is running in. Queries made
+# through the Database while a transaction is open are routed to it, which
+# lets helpers such as add_member_if_needed be called both inside and
+# outside of a transaction without deadlocking on the write lock.
+_current_transaction: contextvars.ContextVar[Optional["Transaction"]] = contextvars.ContextVar(
+    "current_transaction", default=None
+)
+
+
+class Transaction:
+    """A write transaction opened with Database.transaction().
+
+    Every statement runs on the writer connection and is committed (or
+    rolled back if an exception is raised) when the context manager exits.
+    """
+
+    def __init__(self, db: "Database"):
+        self._db = db
+        # Called once the transaction is committed, see Database.after_commit
+        self._on_commit: list[Callable[[], None]] = []
+
+    async def execute(self, sql: str, parameters: Iterable[Any] = ()) -> sqlite3.Cursor:
+        return await self._db._write(self._db._write_conn.execute, sql, parameters)
+
+    async def executemany(self, sql: str, seq_of_parameters: Iterable[Iterable[Any]]) -> sqlite3.Cursor:
+        return await self._db._write(self._db._write_conn.executemany, sql, list(seq_of_parameters))
+
+    async def fetchone(self, sql: str, parameters: Iterable[Any] = ()) -> Optional[tuple]:
+        return await self._db._write(_fetchone, self._db._write_conn, sql, parameters)
+
+    async def fetchall(self, sql: str, parameters: Iterable[Any] = ()) -> list[tuple]:
+        return await self._db._write(_fetchall, self._db._write_conn, sql, parameters)
+
+
+def _fetchone(conn: sqlite3.Connection, sql: str, parameters: Iterable[Any]) -> Optional[tuple]:
+    return conn.execute(sql, parameters).fetchone()
+
+
+def _fetchall(conn: sqlite3.Connection, sql: str, parameters: Iterable[Any]) -> list[tuple]:
+    return conn.execute(sql, parameters).fetchall()
+
+
+class Database:
+    def __init__(self, path: str):
+        """Bot-wide access to the SQLite database.
+
+        Two long-lived connections are kept, each owned by its own worker
+        thread so that no query ever blocks the event loop: a writer, which
+        serializes every write and transaction behind an asyncio lock, and a
+        reader, which serves standalone SELECTs. The database is put in WAL
+        mode so that reads never wait on writes and commits only need to
+        fsync the log.
+
+        Arguments:
+        - path: path to the SQLite database file
+        """
+        self.path = path
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="canary-db-writer")
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="canary-db-reader")
+        self._write_conn = self._writer.submit(self._connect).result()
+        self._read_conn = self._reader.submit(self._connect).result()
+        self._write_lock = asyncio.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None puts the connection in autocommit mode;
+        # transactions are opened explicitly by Database.transaction()
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    async def _write(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer, partial(fn, *args))
+
+    async def _read(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._reader, partial(fn, *args))
+
+    async def execute(self, sql: str, parameters: Iterable[Any] = ()) -> sqlite3.Cursor:
+        """Run a single statement, committing it immediately unless the
+        current task is inside a transaction."""
+        if (txn := _current_transaction.get()) is not None:
+            return await txn.execute(sql, parameters)
+        async with self._write_lock:
+            return await self._write(self._write_conn.execute, sql, parameters)
+
+    async def executemany(self, sql: str, seq_of_parameters: Iterable[Iterable[Any]]) -> sqlite3.Cursor:
+        if (txn := _current_transaction.get()) is not None:
+            return await txn.executemany(sql, seq_of_parameters)
+        async with self.transaction() as txn:
+            return await txn.executemany(sql, seq_of_parameters)
+
+    async def executescript(self, script: str) -> None:
+        async with self._write_lock:
+            await self._write(self._write_conn.executescript, script)
+
+    async def fetchone(self, sql: str, parameters: Iterable[Any] = ()) -> Optional[tuple]:
+        if (txn := _current_transaction.get()) is not None:
+            return await txn.fetchone(sql, parameters)
+        return await self._read(_fetchone, self._read_conn, sql, parameters)
+
+    async def fetchall(self, sql: str, parameters: Iterable[Any] = ()) -> list[tuple]:
+        if (txn := _current_transaction.get()) is not None:
+            return await txn.fetchall(sql, parameters)
+        return await self._read(_fetchall, self._read_conn, sql, parameters)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Open a write transaction:
+
+        async with bot.db.transaction() as txn:
+            await txn.execute(...)
+
+        Nested calls join the outer transaction.
+        """
+        if (txn := _current_transaction.get()) is not None:
+            yield txn
+            return
+
+        async with self._write_lock:
+            await self._write(self._write_conn.execute, "BEGIN")
+            txn = Transaction(self)
+            token = _current_transaction.set(txn)
+            try:
+                yield txn
+            except BaseException:
+                await self._write(self._write_conn.execute, "ROLLBACK")
+                raise
+            else:
+                await self._write(self._write_conn.execute, "COMMIT")
+            finally:
+                _current_transaction.reset(token)
+            for fn in txn._on_commit:
+                fn()
+
+    def after_commit(self, fn: Callable[[], None]) -> None:
+        """Calls fn once the current transaction is committed (not at all if
+        it is rolled back), or right away outside of a transaction. This lets
+        in-memory state (e.g. the scheduler's) follow the database without
+        acting on rows other tasks cannot read yet."""
+        if (txn := _current_transaction.get()) is not None:
+            txn._on_commit.append(fn)
+        else:
+            fn()
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        async with self._write_lock:
+            await self._write(self._write_conn.close)
+            await self._read(self._read_conn.close)
+        self._writer.shutdown(wait=True)
+        self._reader.shutdown(wait=True)
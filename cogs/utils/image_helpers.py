@@ -4,32 +4,117 @@ from discord.ext import commands
 # misc imports
 import numpy as np
 import cv2
-import concurrent.futures
+import asyncio
+import contextlib
+import hashlib
 import math
-from functools import partial
+import os
+import tempfile
+from typing import Optional
 from io import BytesIO
+from .result_cache import ResultCache
+from .worker_pool import WorkerCrashed, WorkerPool, WorkerPoolBusy
+
+# Scratch directory for the images handed to and from the workers
+IMAGE_TMP_DIR = "./tmp/"
+
+
+def decode_image(path, ext, width, height, max_pixels):
+    """Decodes the image at path, downscaled to at most max_pixels pixels, so
+    that the work done on huge images (e.g. phone photos) is bounded. width
+    and height are the dimensions of the image, if known."""
+    # The image is decoded straight from the mapped file
+    data = np.memmap(path, np.uint8, mode="r")
+    factor = 1
+    if ext != "png" and width and height:
+        # JPEG decoders can scale down by 2, 4 or 8 while decoding, which
+        # is much cheaper than decoding the full image; the largest factor
+        # which keeps the image above the budget is used
+        while factor < 8 and width * height / (factor * 2) ** 2 >= max_pixels:
+            factor *= 2
+    image = cv2.imdecode(data, REDUCED_DECODE_FLAGS[factor] if ext != "png" else cv2.IMREAD_UNCHANGED)
 
-
-def apply_transform(transform, buffer, size, max_size, ext, is_png, *args):
-    img_bytes = np.asarray(bytearray(buffer.read()), np.uint8)
-    result = cv2.imdecode(img_bytes, cv2.IMREAD_UNCHANGED)
-    ratio = (max_size / size) * 100 if size > max_size else None
-
-    if ratio:
-        _, buffer = cv2.imencode(
-            f".{ext}", result, (cv2.CV_IMWRITE_PNG_COMPRESSION if is_png else cv2.IMWRITE_JPEG_QUALITY, ratio)
+    height, width = image.shape[:2]
+    if height * width > max_pixels:
+        scale = math.sqrt(max_pixels / (height * width))
+        image = cv2.resize(
+            image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA
         )
-        result = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+    return image
 
-    result = transform(result, *args)
 
-    _, buffer = cv2.imencode(f".{ext}", result)
+def apply_transforms(steps, in_path, out_path, ext, width, height, max_pixels):
+    """Applies the steps, (transform, *args) tuples, one after the other to
+    the image at in_path, decoding (and downscaling) and encoding it only
+    once, and writes the result to out_path."""
+    # Only the paths cross the process boundary
+    result = decode_image(in_path, ext, width, height, max_pixels)
 
-    return buffer
+    for transform, *args in steps:
+        result = transform(result, *args)
 
+    _, buffer = cv2.imencode(f".{ext}", result)
+    buffer.tofile(out_path)
+
+
+def warm_up():
+    # Run by every worker of the pool when it starts, so that the codecs are
+    # loaded before its first job
+    for ext in (".png", ".jpg"):
+        cv2.imdecode(cv2.imencode(ext, np.zeros((1, 1, 3), np.uint8))[1], cv2.IMREAD_UNCHANGED)
+
+
+def job_cost(steps, pixels: int) -> float:
+    """Estimates the cost of applying the steps to an image of this many
+    pixels, in megapixels times Gaussian blur passes."""
+    cost = 0
+    for transform, *args in steps:
+        # Iterated transforms clamp their iterations (first argument) to
+        # their maximum (second one)
+        iterations = max(0, min(args[0], args[1])) if transform in ITERATED_TRANSFORMS else 1
+        cost += TRANSFORM_COSTS[transform] * iterations
+    return pixels / 1e6 * cost
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as fp:
+        while chunk := fp.read(2**20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as fp:
+        return fp.read()
+
+
+def result_key(digest: str, ext: str, max_pixels: int, steps) -> Optional[str]:
+    """Returns the key of the result of applying the steps to an image with
+    this content digest and extension, downscaled to max_pixels, or None if the result is random (and
+    should not be cached). Arguments are clamped as the transforms do, so
+    that e.g. blur:50 and blur:20 share their result."""
+    if any(transform in RANDOM_TRANSFORMS for transform, *_ in steps):
+        return None
+    params = []
+    for transform, *args in steps:
+        if args:
+            # Iterations are at least 0, radiuses at least 1
+            value, maximum = args
+            args = [max(0 if transform in ITERATED_TRANSFORMS else 1, min(value, maximum))]
+        params.append((transform.__name__, *args))
+    return hashlib.blake2b(repr((digest, ext, max_pixels, params)).encode(), digest_size=20).hexdigest()
+
+
+async def filter_image(pool: WorkerPool, cache: ResultCache, steps, ctx, history_limit, max_pixels, max_cost):
+    try:
+        with pool.reserve(ctx.author.id):
+            await _filter_image(pool, cache, steps, ctx, history_limit, max_pixels, max_cost)
+    except WorkerPoolBusy as e:
+        await ctx.send(str(e))
 
-async def filter_image(loop, transform, ctx, history_limit, max_size, *args):
 
+async def _filter_image(pool: WorkerPool, cache: ResultCache, steps, ctx, history_limit, max_pixels, max_cost):
     att = await get_attachment(ctx, history_limit)
     if att is None:
         await ctx.send(
@@ -37,35 +122,61 @@ async def filter_image(loop, transform, ctx, history_limit, max_size, *args):
         )
         return
 
-    await ctx.trigger_typing()
-    buffer = BytesIO()
-    await att.save(fp=buffer)
-
     original_name, ext = att.filename.rsplit(".", 1)
     ext = ext.lower()
-    if ext in ("jpeg", "jpg"):
-        is_png = False
-    elif ext == "png":
-        is_png = True
-    else:
+    if ext not in ("jpeg", "jpg", "png"):
         await ctx.send("image format not supported.")
         return
 
-    fn = f"{original_name}-{transform.__name__}.{ext}"
+    # Discord gives the dimensions of images; the size in bytes is a rough
+    # upper bound of the number of pixels otherwise. Larger images are
+    # downscaled before being filtered
+    pixels = min((att.width or 0) * (att.height or 0) or att.size, max_pixels)
+    if job_cost(steps, pixels) > max_cost:
+        await ctx.send("this image is too large for these filters, try fewer iterations or steps.")
+        return
+
+    fn = f"{original_name}-{'-'.join(transform.__name__ for transform, *_ in steps)}.{ext}"
 
+    await ctx.trigger_typing()
+    # The attachment is downloaded to a file which the worker maps, and the
+    # worker writes its result to a file which is uploaded, instead of
+    # pickling both images across the process boundary
+    loop = asyncio.get_running_loop()
+    fd, in_path = tempfile.mkstemp(suffix=f".{ext}", dir=IMAGE_TMP_DIR)
+    os.close(fd)
+    out_path = f"{in_path}.{ext}"
     try:
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            buffer = await loop.run_in_executor(
-                pool, partial(apply_transform, transform, buffer, att.size, max_size, ext, is_png, *args)
-            )
+        await att.save(in_path)
+
+        # Popular images are often filtered again with the same parameters
+        digest = await loop.run_in_executor(None, file_digest, in_path)
+        key = result_key(digest, ext, max_pixels, steps)
+        if key is not None and (result := await cache.get(key)) is not None:
+            await ctx.message.delete()
+            await ctx.send(file=discord.File(BytesIO(result), filename=fn))
+            return
+
+        try:
+            await pool.run(apply_transforms, steps, in_path, out_path, ext, att.width, att.height, max_pixels)
 
-    except Exception as exc:  # TODO: Narrow the exception
-        await ctx.send("an error has occurred.")
-        raise exc
+        except WorkerCrashed as exc:
+            await ctx.send(str(exc))
 
-    else:
-        await ctx.message.delete()
-        await ctx.send(file=discord.File(fp=BytesIO(buffer), filename=fn))
+        except Exception as exc:  # TODO: Narrow the exception
+            await ctx.send("an error has occurred.")
+            raise exc
+
+        else:
+            if key is not None:
+                await cache.put(key, await loop.run_in_executor(None, _read_file, out_path))
+            await ctx.message.delete()
+            await ctx.send(file=discord.File(out_path, filename=fn))
+
+    finally:
+        for path in (in_path, out_path):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
 
 
 async def get_attachment(ctx: commands.Context, lim: int):
@@ -180,3 +291,32 @@ def noise(image, iterations: int, max_iter: int):
         image = cv2.addWeighted(image, 1, image, 0, -np.std(image) * 0.49)
 
     return image
+
+
+# Cost of the transforms per megapixel, relative to a Gaussian blur pass
+# (about 3 ms per megapixel), measured on a 3 megapixel image. Iterated
+# transforms cost this much per iteration
+TRANSFORM_COSTS = {
+    polar: 6,
+    cart: 11,
+    blur: 1,
+    hblur: 1,
+    vblur: 1,
+    rblur: 15,
+    cblur: 30,
+    deepfry: 20,
+    noise: 25,
+}
+ITERATED_TRANSFORMS = frozenset((blur, deepfry, noise))
+# Transforms whose result differs every time, which are not cached
+RANDOM_TRANSFORMS = frozenset((noise,))
+
+# Flags decoding JPEG images scaled down by each factor. Unlike
+# IMREAD_UNCHANGED, they always give 3 channel images (which the transforms
+# expect) and apply the EXIF orientation of phone photos
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
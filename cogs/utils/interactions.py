@@ -0,0 +1,178 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+
+import discord
+
+from typing import Callable, Optional
+
+# Default time after which a wait for a reaction or a message gives up, in
+# seconds, so that abandoned interactive messages never wait forever
+DEFAULT_TIMEOUT = 300
+
+# Session the current task (e.g. a command) runs in, so that interactive
+# components nested in it (e.g. a paginator opened by a command which is
+# itself interactive) do not count as sessions of their own
+_current_session: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("interaction_session", default=None)
+
+
+class TooManyInteractions(Exception):
+    def __init__(self, limit: int, per_user: bool):
+        self.limit = limit
+        self.per_user = per_user
+        super().__init__(
+            f"You already have {limit} interactive messages open, close one or wait for it to time out."
+            if per_user
+            else f"{limit} interactive messages are already open, please try again later."
+        )
+
+
+def interactive(func):
+    """Decorator for commands which interact with their author (e.g. wait
+    for messages between paginators), running them in a session of the
+    author so that the whole command counts as one session. Must be applied
+    below @commands.command."""
+
+    @functools.wraps(func)
+    async def wrapper(self, ctx, *args, **kwargs):
+        with ctx.bot.interactions.session(ctx.author.id):
+            return await func(self, ctx, *args, **kwargs)
+
+    return wrapper
+
+
+class InteractionDispatcher:
+    def __init__(self, client: discord.Client, max_sessions_per_user: int, max_sessions: int):
+        """Routes reactions and messages to the interactive components waiting
+        for them (paginators, assistants, games...), in place of
+        client.wait_for(), which runs the check of every pending wait on every
+        reaction and message the bot sees. Waits for reactions are indexed by
+        the ID of their message and waits for messages by the ID of their
+        channel, so an event only runs the checks of the waits on its own
+        message or channel. Events caused by the bot itself are ignored.
+
+        Interactive components run in sessions, which are capped per user and
+        in total, since each of them holds a message and pending waits for
+        minutes.
+
+        Arguments:
+        - client: the bot, whose own reactions and messages are ignored
+        - max_sessions_per_user: maximum number of sessions a user can have
+          open at once
+        - max_sessions: maximum number of sessions open at once
+        """
+        self.client = client
+        self.max_sessions_per_user = max_sessions_per_user
+        self.max_sessions = max_sessions
+        self.session_count = 0
+        self._user_sessions: dict[int, int] = {}
+        self._reaction_waits: dict[int, list[tuple[Optional[Callable], asyncio.Future]]] = {}
+        self._message_waits: dict[int, list[tuple[Optional[Callable], asyncio.Future]]] = {}
+
+    @contextlib.contextmanager
+    def session(self, user_id: Optional[int]):
+        """Runs an interactive component in a session of user_id, or of the
+        bot itself if None (e.g. role restoring pages sent on moderation
+        events), which is not capped. Raises TooManyInteractions if the user
+        or the bot as a whole has too many sessions open. Sessions opened
+        within a session are part of it."""
+        if _current_session.get() is not None:
+            yield
+            return
+        if user_id is not None:
+            if self._user_sessions.get(user_id, 0) >= self.max_sessions_per_user:
+                raise TooManyInteractions(self.max_sessions_per_user, per_user=True)
+            if self.session_count >= self.max_sessions:
+                raise TooManyInteractions(self.max_sessions, per_user=False)
+            self._user_sessions[user_id] = self._user_sessions.get(user_id, 0) + 1
+            self.session_count += 1
+        token = _current_session.set(user_id if user_id is not None else 0)
+        try:
+            yield
+        finally:
+            _current_session.reset(token)
+            if user_id is not None:
+                self.session_count -= 1
+                self._user_sessions[user_id] -= 1
+                if not self._user_sessions[user_id]:
+                    del self._user_sessions[user_id]
+
+    @staticmethod
+    async def _wait(waits: dict, key: int, check: Optional[Callable], timeout: Optional[float]):
+        future = asyncio.get_running_loop().create_future()
+        wait = (check, future)
+        waits.setdefault(key, []).append(wait)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            # Also removed on timeout or cancellation, so that nothing is left
+            # behind by abandoned components
+            pending = waits[key]
+            pending.remove(wait)
+            if not pending:
+                del waits[key]
+
+    async def wait_for_reaction(
+        self, message: discord.Message, check: Optional[Callable] = None, timeout: Optional[float] = DEFAULT_TIMEOUT
+    ) -> tuple[discord.Reaction, discord.abc.User]:
+        """Waits for a reaction to be added to message for which check (with
+        the same arguments as a reaction_add check) returns True, and returns
+        the reaction and the user who added it. Raises asyncio.TimeoutError
+        after timeout seconds."""
+        return await self._wait(self._reaction_waits, message.id, check, timeout)
+
+    async def wait_for_message(
+        self,
+        channel: discord.abc.Messageable,
+        check: Optional[Callable] = None,
+        timeout: Optional[float] = DEFAULT_TIMEOUT,
+    ) -> discord.Message:
+        """Waits for a message to be sent in channel (or in the channel of a
+        context) for which check returns True, and returns it. Raises
+        asyncio.TimeoutError after timeout seconds."""
+        return await self._wait(self._message_waits, getattr(channel, "channel", channel).id, check, timeout)
+
+    @staticmethod
+    def _dispatch(pending: Optional[list], args: tuple) -> None:
+        # Copied, since a wait may be cancelled by one of the checks
+        for check, future in tuple(pending or ()):
+            if future.done():
+                continue
+            try:
+                if check is None or check(*args):
+                    future.set_result(args[0] if len(args) == 1 else args)
+            except Exception as e:
+                future.set_exception(e)
+
+    async def on_reaction_add(self, reaction: discord.Reaction, user: discord.abc.User) -> None:
+        if user.id != self.client.user.id:
+            self._dispatch(self._reaction_waits.get(reaction.message.id), (reaction, user))
+
+    async def on_message(self, message: discord.Message) -> None:
+        if message.author.id != self.client.user.id:
+            self._dispatch(self._message_waits.get(message.channel.id), (message,))
+
+    def stats(self) -> str:
+        return (
+            f"{self.session_count} sessions open ({len(self._user_sessions)} users), "
+            f"{sum(map(len, self._reaction_waits.values()))} waits for reactions, "
+            f"{sum(map(len, self._message_waits.values()))} waits for messages"
+        )
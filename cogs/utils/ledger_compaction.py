@@ -0,0 +1,161 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+# Compaction of the BankTransactions ledger: every transaction older than a
+# horizon is rolled into a single checkpoint row per user and action, whose
+# amount is the sum of the rows it replaces and whose date is the latest of
+# their dates (so that "last claim" lookups keep working). Balances are
+# therefore unchanged. The raw rows are first archived to a gzipped JSON lines
+# file so that no history is lost.
+#
+# Online compaction goes through the bot's database (see the compact_ledger
+# command of the Currency cog); offline compaction, with the bot stopped, can
+# be run with:
+#
+#     python -m cogs.utils.ledger_compaction [--days DAYS]
+
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+
+from collections import defaultdict
+
+from .database import Database
+
+SELECT_OLD_TRANSACTIONS = (
+    "SELECT TransactionID, UserID, Amount, Action, Metadata, Date FROM BankTransactions "
+    "WHERE Date < ? ORDER BY TransactionID"
+)
+DELETE_TRANSACTION = "DELETE FROM BankTransactions WHERE TransactionID = ?"
+INSERT_CHECKPOINT = "INSERT INTO BankTransactions(UserID, Amount, Action, Metadata, Date) VALUES(?, ?, ?, ?, ?)"
+
+ARCHIVE_COLUMNS = ("TransactionID", "UserID", "Amount", "Action", "Metadata", "Date")
+
+
+def _transaction_count(metadata: str) -> int:
+    # Checkpoints from a previous compaction already stand for several rows
+    try:
+        return json.loads(metadata).get("checkpoint", 1)
+    except (TypeError, ValueError, AttributeError):
+        return 1
+
+
+def build_checkpoints(rows: list[tuple]) -> tuple[list[tuple], list[tuple]]:
+    """Groups rows of BankTransactions by user and action. Returns the rows
+    to replace (those of groups of more than one row) and the checkpoint rows,
+    ready to be inserted, that replace them."""
+    groups = defaultdict(list)
+    for row in rows:
+        groups[(row[1], row[3])].append(row)
+
+    replaced = []
+    checkpoints = []
+    for (user_id, action), group in groups.items():
+        if len(group) == 1:
+            continue
+        replaced.extend(group)
+        metadata = {
+            "checkpoint": sum(_transaction_count(row[4]) for row in group),
+            "first_date": min(row[5] for row in group),
+        }
+        checkpoints.append(
+            (user_id, sum(row[2] for row in group), action, json.dumps(metadata), max(row[5] for row in group))
+        )
+
+    return replaced, checkpoints
+
+
+def archive_rows(rows: list[tuple], archive_path: str) -> str:
+    """Writes rows of BankTransactions to a new gzipped JSON lines file in
+    archive_path and returns its path. The file is flushed to disk before
+    returning, since the rows are deleted from the database afterwards."""
+    os.makedirs(archive_path, exist_ok=True)
+    file_path = os.path.join(
+        archive_path, f"BankTransactions-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.jsonl.gz"
+    )
+    with open(file_path, "xb") as fp:
+        with gzip.GzipFile(fileobj=fp, mode="wb") as gz:
+            for row in rows:
+                gz.write(json.dumps(dict(zip(ARCHIVE_COLUMNS, row))).encode("utf-8") + b"\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+    return file_path
+
+
+def compact_ledger(conn: sqlite3.Connection, horizon: datetime.datetime, archive_path: str) -> tuple[int, int]:
+    """Offline compaction, run directly on a connection. Returns the number
+    of rows replaced and of checkpoint rows inserted."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(SELECT_OLD_TRANSACTIONS, (int(horizon.timestamp()),)).fetchall()
+        replaced, checkpoints = build_checkpoints(rows)
+        if replaced:
+            archive_rows(replaced, archive_path)
+            conn.executemany(DELETE_TRANSACTION, ((row[0],) for row in replaced))
+            conn.executemany(INSERT_CHECKPOINT, checkpoints)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return len(replaced), len(checkpoints)
+
+
+async def compact_ledger_online(db: Database, horizon: datetime.datetime, archive_path: str) -> tuple[int, int]:
+    """Online compaction through the bot's database, in a single transaction
+    so that no bank transaction can interleave with it. Returns the number of
+    rows replaced and of checkpoint rows inserted."""
+    async with db.transaction() as txn:
+        rows = await txn.fetchall(SELECT_OLD_TRANSACTIONS, (int(horizon.timestamp()),))
+        replaced, checkpoints = build_checkpoints(rows)
+        if replaced:
+            await asyncio.get_running_loop().run_in_executor(None, archive_rows, replaced, archive_path)
+            await txn.executemany(DELETE_TRANSACTION, ((row[0],) for row in replaced))
+            await txn.executemany(INSERT_CHECKPOINT, checkpoints)
+    return len(replaced), len(checkpoints)
+
+
+def main():
+    import argparse
+    from config import parser
+
+    config = parser.Parser()
+
+    arg_parser = argparse.ArgumentParser(description="Compact the BankTransactions ledger (bot must be stopped)")
+    arg_parser.add_argument(
+        "--days",
+        type=int,
+        default=config.currency["compaction_horizon"],
+        help="compact transactions older than this many days",
+    )
+    args = arg_parser.parse_args()
+
+    horizon = datetime.datetime.now() - datetime.timedelta(days=args.days)
+    conn = sqlite3.connect(config.db_path, isolation_level=None)
+    try:
+        replaced, checkpoints = compact_ledger(conn, horizon, config.currency["ledger_archive_path"])
+        if replaced:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    print(f"Replaced {replaced} transactions older than {horizon:%Y-%m-%d} with {checkpoints} checkpoints")
+
+
+if __name__ == "__main__":
+    main()
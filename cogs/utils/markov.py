@@ -0,0 +1,280 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import pickle
+import random
+
+from array import array
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+# Word ID standing for the end of a quote
+END = 0
+
+# Version of the pickled model format; models saved with another version are
+# rebuilt
+MODEL_VERSION = 2
+
+# Approximate memory used by a state, by each of its successors (including its
+# alias table) and by an interned word, in bytes, measured with tracemalloc
+STATE_BYTES = 450
+ENTRY_BYTES = 30
+WORD_BYTES = 120
+
+
+class _Transitions:
+    __slots__ = ("successors", "counts", "total", "_prob", "_alias")
+
+    def __init__(self):
+        # Word IDs which followed the state, and how many times each did
+        self.successors = array("I")
+        self.counts = array("I")
+        self.total = 0
+        # Alias table (Vose's method) to sample a successor in constant time,
+        # built on first use after a change
+        self._prob: Optional[array] = None
+        self._alias: Optional[array] = None
+
+    def __getstate__(self):
+        return self.successors, self.counts, self.total
+
+    def __setstate__(self, state):
+        self.successors, self.counts, self.total = state
+        self._prob = self._alias = None
+
+    def add(self, word_id: int, delta: int) -> int:
+        """Adds delta to the count of a successor, and returns the change in
+        the number of successors (-1, 0 or 1)."""
+        entries = 0
+        try:
+            i = self.successors.index(word_id)
+        except ValueError:
+            if delta < 0:
+                return 0
+            self.successors.append(word_id)
+            self.counts.append(delta)
+            entries = 1
+        else:
+            count = self.counts[i] + delta
+            if count > 0:
+                self.counts[i] = count
+            else:
+                delta = -self.counts[i]
+                del self.successors[i]
+                del self.counts[i]
+                entries = -1
+        self.total += delta
+        self._prob = self._alias = None
+        return entries
+
+    def _build_alias_table(self) -> None:
+        n = len(self.counts)
+        prob = array("d", (count * n / self.total for count in self.counts))
+        alias = array("I", range(n))
+        small = [i for i in range(n) if prob[i] < 1]
+        large = [i for i in range(n) if prob[i] >= 1]
+        while small and large:
+            less, more = small.pop(), large[-1]
+            alias[less] = more
+            prob[more] -= 1 - prob[less]
+            if prob[more] < 1:
+                small.append(large.pop())
+        # Left over because of rounding errors
+        for i in small + large:
+            prob[i] = 1
+        self._prob, self._alias = prob, alias
+
+    def sample(self) -> int:
+        if self._prob is None:
+            self._build_alias_table()
+        i = random.randrange(len(self.successors))
+        return self.successors[i] if random.random() < self._prob[i] else self.successors[self._alias[i]]
+
+
+class MarkovModel:
+    def __init__(self, order: int = 1):
+        """
+        A Markov chain over the words of quotes, which can be updated one
+        quote at a time. Words are interned as integer IDs and, for every
+        state (sequence of up to order words), the words that followed it are
+        counted in arrays, along with a lazily built alias table to sample
+        the next word in constant time.
+
+        States of every length from 1 to order are kept, so that generation
+        can start from a single seed word and use longer states as the
+        sentence grows.
+
+        Arguments:
+        - order: number of previous words the next word depends on
+        """
+        self.order = order
+        self.words: list[str] = [""]
+        self.word_ids: dict[str, int] = {"": END}
+        # States of a single word are keyed by its ID, longer ones by tuples
+        self.states: dict[int | tuple[int, ...], _Transitions] = {}
+        # Word IDs which are states, to pick random seeds, and their positions
+        self._seeds: list[int] = []
+        self._seed_positions: dict[int, int] = {}
+        # Number of (state, successor) pairs, to estimate the memory used
+        self.entry_count = 0
+        # Bookkeeping of the quotes folded in, to catch up with the database
+        self.quote_count = 0
+        self.last_quote_id = 0
+
+    def __contains__(self, word: str) -> bool:
+        return self.word_ids.get(word, END) in self._seed_positions
+
+    @property
+    def memory_estimate(self) -> int:
+        """Approximate memory used by the model, in bytes."""
+        return len(self.states) * STATE_BYTES + self.entry_count * ENTRY_BYTES + len(self.words) * WORD_BYTES
+
+    def _intern(self, word: str) -> int:
+        if (word_id := self.word_ids.get(word)) is None:
+            word_id = self.word_ids[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def _update(self, words: list[str], delta: int) -> None:
+        ids = [self._intern(word) for word in words]
+        ids.append(END)
+        for i in range(len(ids) - 1):
+            for length in range(1, min(self.order, i + 1) + 1):
+                key = ids[i] if length == 1 else tuple(ids[i - length + 1 : i + 1])
+                transitions = self.states.get(key)
+                if transitions is None:
+                    if delta < 0:
+                        continue
+                    transitions = self.states[key] = _Transitions()
+                    if length == 1:
+                        self._seed_positions[key] = len(self._seeds)
+                        self._seeds.append(key)
+                self.entry_count += transitions.add(ids[i + 1], delta)
+                if not transitions.total:
+                    del self.states[key]
+                    if length == 1:
+                        # Swap with the last seed to remove it in constant time
+                        position = self._seed_positions.pop(key)
+                        last = self._seeds.pop()
+                        if last != key:
+                            self._seeds[position] = last
+                            self._seed_positions[last] = position
+
+    def add(self, words: list[str], quote_id: int = 0) -> None:
+        """Folds in the words of a quote, in O(len(words) * order) time."""
+        if words:
+            self._update(words, 1)
+        self.quote_count += 1
+        self.last_quote_id = max(self.last_quote_id, quote_id)
+
+    def remove(self, words: list[str]) -> None:
+        """Removes the words of a quote previously added."""
+        if words:
+            self._update(words, -1)
+        self.quote_count -= 1
+
+    def random_seed(self) -> Optional[str]:
+        return self.words[random.choice(self._seeds)] if self._seeds else None
+
+    def generate(self, seed: str, min_length: int = 1, max_length: int = 1000) -> list[str]:
+        """
+        Returns a sentence starting with seed (a word of the model), which
+        stops when the end of a quote is drawn, although not before
+        min_length words unless there is no other option, or at max_length
+        words.
+        """
+        sentence = [self.word_ids[seed]]
+        while len(sentence) < max_length:
+            length = min(self.order, len(sentence))
+            transitions = self.states[sentence[-1] if length == 1 else tuple(sentence[-length:])]
+            word_id = transitions.sample()
+
+            # Don't allow termination until the minimum length is met or we
+            # don't have any other option.
+            while word_id == END and len(sentence) < min_length and len(transitions.successors) > 1:
+                word_id = transitions.sample()
+
+            # Don't allow repeat words too much
+            while len(sentence) >= 3 and word_id == sentence[-1] == sentence[-2] == sentence[-3]:
+                word_id = transitions.sample()
+
+            if word_id == END:
+                break
+            sentence.append(word_id)
+
+        return [self.words[word_id] for word_id in sentence]
+
+    def save(self, path: str) -> None:
+        # Written to a temporary file first so that an interrupted save does
+        # not leave a corrupt model behind
+        with open(f"{path}.tmp", "wb") as fp:
+            pickle.dump({"version": MODEL_VERSION, "model": self}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def load(path: str, order: int) -> Optional["MarkovModel"]:
+        """Returns the model saved at path, or None if there is none or if it
+        cannot be used (e.g. it has another order)."""
+        try:
+            with open(path, "rb") as fp:
+                saved = pickle.load(fp)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if saved.get("version") != MODEL_VERSION or saved["model"].order != order:
+            return None
+        return saved["model"]
+
+
+class MarkovModelCache:
+    def __init__(self, max_bytes: int):
+        """
+        A least recently used cache of Markov models (e.g. one per user),
+        bounded by the memory they use according to their memory_estimate.
+        The most recently used model is always kept, even if it alone is
+        larger than the bound.
+
+        Arguments:
+        - max_bytes: approximate memory the models may use in total
+        """
+        self.max_bytes = max_bytes
+        self._models: OrderedDict[Hashable, MarkovModel] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    @property
+    def memory_estimate(self) -> int:
+        return sum(model.memory_estimate for model in self._models.values())
+
+    def get(self, key: Hashable) -> Optional[MarkovModel]:
+        if (model := self._models.get(key)) is not None:
+            self._models.move_to_end(key)
+        return model
+
+    def put(self, key: Hashable, model: MarkovModel) -> None:
+        """Adds a model, or marks it as used again after it grew, and evicts
+        the least recently used ones while over the bound."""
+        self._models[key] = model
+        self._models.move_to_end(key)
+        total = self.memory_estimate
+        while total > self.max_bytes and len(self._models) > 1:
+            _, evicted = self._models.popitem(last=False)
+            total -= evicted.memory_estimate
+
+    def pop(self, key: Hashable) -> Optional[MarkovModel]:
+        return self._models.pop(key, None)
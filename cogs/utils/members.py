@@ -17,6 +17,8 @@
 
 import discord
 
+from typing import Optional
+
 
 async def _get_name_from_id(self, user_id) -> str:
     user = self.bot.get_user(user_id)
@@ -32,8 +34,11 @@ async def _get_name_from_id(self, user_id) -> str:
         return str(user_id)
 
 
-async def add_member_if_needed(self, c, user_id) -> None:
-    c.execute("SELECT Name FROM Members WHERE ID = ?", (user_id,))
-    if not c.fetchone():
-        name = await _get_name_from_id(self, user_id)
-        c.execute("INSERT OR IGNORE INTO Members VALUES (?,?)", (user_id, name))
+async def add_member_if_needed(self, db, user_id, name: Optional[str] = None) -> None:
+    # The name is looked up (possibly through the API) when it is not given,
+    # which must not happen inside a transaction, as it would hold the
+    # database's write lock while waiting for Discord
+    if not await db.fetchone("SELECT Name FROM Members WHERE ID = ?", (user_id,)):
+        if name is None:
+            name = await _get_name_from_id(self, user_id)
+        await db.execute("INSERT OR IGNORE INTO Members VALUES (?,?)", (user_id, name))
@@ -0,0 +1,143 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import statistics
+import time
+
+import discord
+
+from collections import deque
+from typing import Optional
+
+# Number of recent deliveries kept to compute latency statistics
+LATENCY_HISTORY = 1000
+
+# Wait before retrying a rate limited send when Discord does not say how long
+# to wait, doubled on every attempt
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class MessageDispatcher:
+    def __init__(self, logger: logging.Logger, max_concurrency: int, max_retries: int):
+        """Sends outbound messages (mostly DMs) concurrently instead of one
+        after the other, while staying within Discord's rate limits:
+
+        - at most max_concurrency messages are in flight at once;
+        - messages to the same destination are sent one at a time, since they
+          share a rate limit bucket (and should arrive in order);
+        - a send that is still rate limited once discord.py gives up on it is
+          retried after the delay given by Discord, up to max_retries times,
+          and a global rate limit pauses every send until it is lifted.
+
+        The latency of every delivery, from the call to send() to the message
+        being accepted by Discord, is recorded for stats().
+
+        Arguments:
+        - logger: logger to report failed deliveries to
+        - max_concurrency: maximum number of messages being sent at once
+        - max_retries: number of times a rate limited send is retried
+        """
+        self.logger = logger
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies: deque[float] = deque(maxlen=LATENCY_HISTORY)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._destination_locks: dict[int, asyncio.Lock] = {}
+        self._destination_waiters: dict[int, int] = {}
+        self._resume_at = 0.0
+
+    @staticmethod
+    def _retry_after(error: discord.HTTPException) -> tuple[Optional[float], bool]:
+        # Returns the delay asked for by Discord, if any, and whether the rate
+        # limit is global
+        headers = getattr(error.response, "headers", None) or {}
+        retry_after = headers.get("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            retry_after = None
+        return retry_after, headers.get("X-RateLimit-Global") == "true"
+
+    async def _wait_for_global_limit(self) -> None:
+        while (delay := self._resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    async def _send_with_retries(self, destination: discord.abc.Messageable, args, kwargs) -> discord.Message:
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_global_limit()
+            try:
+                async with self._semaphore:
+                    return await destination.send(*args, **kwargs)
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == self.max_retries:
+                    raise
+                retry_after, is_global = self._retry_after(e)
+                if retry_after is None:
+                    retry_after = DEFAULT_RETRY_AFTER * 2**attempt
+                if is_global:
+                    self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+                self.retries += 1
+                await asyncio.sleep(retry_after)
+
+    async def send(self, destination: discord.abc.Messageable, *args, **kwargs) -> Optional[discord.Message]:
+        """Sends a message to destination (a user, member or channel), with
+        the same arguments as destination.send(). Returns the message sent, or
+        None if it could not be delivered (e.g. the user does not accept DMs);
+        failures are logged rather than raised so that one bad recipient does
+        not interrupt a fan-out."""
+        start = time.monotonic()
+        # Contexts are keyed by their channel, users and channels by their ID
+        key = getattr(getattr(destination, "channel", destination), "id", id(destination))
+        lock = self._destination_locks.setdefault(key, asyncio.Lock())
+        self._destination_waiters[key] = self._destination_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                message = await self._send_with_retries(destination, args, kwargs)
+        except discord.HTTPException as e:
+            self.failed += 1
+            self.logger.warning(f"Could not send message to {destination}: {e}")
+            return None
+        finally:
+            self._destination_waiters[key] -= 1
+            if not self._destination_waiters[key]:
+                del self._destination_waiters[key]
+                del self._destination_locks[key]
+
+        self.sent += 1
+        self.latencies.append(time.monotonic() - start)
+        return message
+
+    async def send_many(self, messages: list[tuple[discord.abc.Messageable, str]]) -> list[Optional[discord.Message]]:
+        """Sends every (destination, content) pair concurrently and returns
+        the messages sent, in order, with None for failed deliveries."""
+        return await asyncio.gather(*(self.send(destination, content) for destination, content in messages))
+
+    def stats(self) -> str:
+        if not self.latencies:
+            return f"{self.sent} sent, {self.failed} failed, {self.retries} retries"
+        latencies = sorted(self.latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return (
+            f"{self.sent} sent, {self.failed} failed, {self.retries} retries; latency over the last "
+            f"{len(latencies)} deliveries: median {statistics.median(latencies):.3f}s, p95 {p95:.3f}s, "
+            f"max {latencies[-1]:.3f}s"
+        )
@@ -0,0 +1,72 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import os
+import re
+import sqlite3
+import time
+
+# Migrations are SQL scripts named <version>_<description>.sql, e.g.
+# 0001_lookup_indexes.sql. They are applied in order of version, each in its
+# own transaction, and the version of the last one applied is stored in the
+# database's user_version pragma.
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+
+def list_migrations(migrations_path: str) -> list[tuple[int, str]]:
+    """Returns the (version, file name) of every migration in
+    migrations_path, sorted by version."""
+    migrations = []
+    for file_name in os.listdir(migrations_path):
+        if match := MIGRATION_FILE_PATTERN.match(file_name):
+            migrations.append((int(match.group(1)), file_name))
+    migrations.sort()
+
+    versions = [version for version, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {migrations_path}")
+
+    return migrations
+
+
+def run_migrations(conn: sqlite3.Connection, migrations_path: str, logger: logging.Logger) -> None:
+    """Applies every migration newer than the database's current schema
+    version. A failing migration is rolled back and stops the process, so the
+    database is never left half-migrated."""
+    current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for version, file_name in list_migrations(migrations_path):
+        if version <= current_version:
+            continue
+
+        with open(os.path.join(migrations_path, file_name)) as fp:
+            script = fp.read()
+
+        logger.info(f"Applying database migration {file_name}")
+        start = time.perf_counter()
+        try:
+            # executescript commits any pending transaction before running,
+            # so the transaction has to be opened by the script itself
+            conn.executescript(f"BEGIN;\n{script}\n;PRAGMA user_version = {version};\nCOMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logger.error(f"Database migration {file_name} failed, database left at version {current_version}")
+            raise
+        current_version = version
+        logger.info(f"Applied database migration {file_name} in {time.perf_counter() - start:.3f}s")
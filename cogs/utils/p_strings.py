@@ -15,9 +15,14 @@
 # You should have received a copy of the GNU General Public License
 # along with Canary. If not, see <https://www.gnu.org/licenses/>.
 
+import functools
 import random
+import time
 import regex as re
 
+from .aho_corasick import AhoCorasick
+from .safe_regex import pattern_problem
+
 # Written by @le-potate
 
 # A "string with placeholders" is a simple string like
@@ -51,7 +56,22 @@ import regex as re
 # output p-string with its corresponding output "string with placeholders".
 
 PLACEHOLDERS_ARGS = ("user", "channel", *list(map(str, (range(1, 10)))))
-PLACEHOLDERS_PATTERNS = (re.compile(f"%{arg}%") for arg in PLACEHOLDERS_ARGS)
+PLACEHOLDERS_PATTERN = re.compile(f"%({'|'.join(PLACEHOLDERS_ARGS)})%")
+
+# Splits the content of a choice list into its choices: they are separated by
+# commas, except when they are inside quotes
+CHOICE_LIST_SPLIT_PATTERN = re.compile(r'(?:^"?|, ?"?)\K(?:(?<=").+?(?=")|[^ ,][^,]*)')
+
+# Stands for an already parsed choice list while parsing a template
+CHOICE_LIST_MARKER = "\0"
+
+# Characters which make an input string more than plain text with placeholders
+REGEX_METACHARACTERS = frozenset("\\.^$*+?{}[]()|")
+GROUP_PLACEHOLDER_PATTERN = re.compile(r"%[1-9]%")
+
+# Number of input strings added to a PStringEncodings since its matchers were
+# built above which they are built again
+PENDING_REBUILD_THRESHOLD = 32
 
 
 def _convert_choice_list(choice_list_string, to_pattern_str=False):
@@ -76,8 +96,8 @@ def _convert_choice_list(choice_list_string, to_pattern_str=False):
         return choice_list_string
     # otherwise, split the content between %[ and ]% to get the list of choices
     # content is separated by commas, except when they are inside quotes
-    choice_list_matches_iter = re.finditer(
-        r'(?:^"?|, ?"?)\K(?:(?<=").+?(?=")|[^ ,][^,]*)', choice_list_string[last_start_pos + 2 : first_end_pos_after]
+    choice_list_matches_iter = CHOICE_LIST_SPLIT_PATTERN.finditer(
+        choice_list_string[last_start_pos + 2 : first_end_pos_after]
     )
     choice_list = [choice_match.group() for choice_match in choice_list_matches_iter]
     # if to_pattern_str, any of these choices can match, thus this is
@@ -117,6 +137,102 @@ def _get_pattern_from_string(string, anywhere=False):
     return re.compile(string)
 
 
+def _get_required_literal(string):
+    """
+    Takes an input string with placeholders and returns the longest piece
+    of text which any content matching its pattern must contain, or None if
+    there is none or if it cannot be told (when the string uses regex syntax
+    other than placeholders, e.g. "hi|hello" or "%[(a+)+, b]% hello").
+
+    Example:
+    string: "%[hi, hello]% i like %1% a lot"
+    returns " i like " (the other pieces are "" and " a lot")
+    """
+    # remove the choice lists, innermost first, as in _convert_choice_list;
+    # their choices become regex alternatives, so they must be plain text too
+    while (start := string.rfind("%[")) != -1 and (end := string.find("]%", start + 1)) != -1:
+        if REGEX_METACHARACTERS.intersection(string[start + 2 : end]):
+            return None
+        string = f"{string[:start]}%0%{string[end + 2:]}"
+    literals = GROUP_PLACEHOLDER_PATTERN.sub("%0%", string).split("%0%")
+    if any(REGEX_METACHARACTERS.intersection(literal) for literal in literals):
+        return None
+    return max(literals, key=len) or None
+
+
+def _split_template(string, choice_lists):
+    # Splits a string whose choice lists were replaced by markers into
+    # segments: literal strings, placeholder names (as 1-tuples) and choice
+    # lists (tuples of alternatives, each a tuple of segments)
+    segments = []
+    for i, piece in enumerate(string.split(CHOICE_LIST_MARKER)):
+        if i % 2:
+            segments.append(choice_lists[int(piece)])
+            continue
+        position = 0
+        for match in PLACEHOLDERS_PATTERN.finditer(piece):
+            if match.start() > position:
+                segments.append(piece[position : match.start()])
+            segments.append((match.group(1),))
+            position = match.end()
+        if position < len(piece):
+            segments.append(piece[position:])
+    return tuple(segments)
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_template(string):
+    """
+    Takes an output string with placeholders and returns its template: a
+    tuple of segments which are either literal strings, placeholder names
+    (1-tuples, e.g. ("user",)) or choice lists (tuples of alternatives, each
+    a tuple of segments), so that filling the string does not need any regex.
+
+    Example:
+    string: "%[hi, hello]% %user%!"
+    returns (((("hi",), ("hello",)), " ", ("user",), "!")
+    """
+    choice_lists = []
+    # parse the choice lists innermost first, as in _convert_choice_list, and
+    # replace each by a marker holding its index
+    while (start := string.rfind("%[")) != -1 and (end := string.find("]%", start + 1)) != -1:
+        choices = CHOICE_LIST_SPLIT_PATTERN.finditer(string[start + 2 : end])
+        choice_lists.append(tuple(_split_template(choice.group(), choice_lists) for choice in choices))
+        marker = f"{CHOICE_LIST_MARKER}{len(choice_lists) - 1}{CHOICE_LIST_MARKER}"
+        string = f"{string[:start]}{marker}{string[end + 2:]}"
+    return _split_template(string, choice_lists)
+
+
+def _render_template(template, values):
+    """
+    Fills a template returned by _compile_template, given a dict from
+    placeholder names to values; placeholders without a value are left as is.
+    """
+    parts = []
+    for segment in template:
+        if segment.__class__ is str:
+            parts.append(segment)
+        elif len(segment) == 1 and segment[0].__class__ is str:
+            parts.append(values.get(segment[0]) or f"%{segment[0]}%")
+        elif segment:
+            parts.append(_render_template(random.choice(segment), values))
+    return "".join(parts)
+
+
+def get_input_string_problem(input_string, budget):
+    """
+    Returns why an input string with placeholders cannot be used (e.g. as
+    a custom reaction prompt), or None if it can. See
+    safe_regex.pattern_problem; budget is the time, in seconds, that matching
+    it against a message may take.
+    """
+    try:
+        pattern = _get_pattern_from_string(input_string, anywhere=True)
+    except re.error as e:
+        return f"it is not a valid regex ({e})"
+    return pattern_problem(pattern.pattern, budget)
+
+
 class PString:
     def __init__(self, string, user=None, channel=None, groups=[], additional_info=None):
         """
@@ -149,27 +265,28 @@ class PString:
         "hi", "hello world" or "hello you"
         """
         self.string = string
+        self._template = _compile_template(string)
         self.user = user
         self.channel = channel
         self.groups = groups
         self.additional_info = additional_info
 
-    @property
-    def _patterns_and_values(self):
-        return dict(zip(PLACEHOLDERS_PATTERNS, (self.user, self.channel, *self.groups)))
-
     def __str__(self):
-        filled_string = self.string
-        # replace the placeholder arguments by their values
-        for pattern, value in self._patterns_and_values.items():
-            if value:
-                filled_string = pattern.sub(value, filled_string)
-        # convert the choice lists and return
-        return _convert_choice_list(filled_string)
+        values = dict(zip(PLACEHOLDERS_ARGS, (self.user, self.channel, *self.groups)))
+        return _render_template(self._template, values)
 
 
 class PStringEncodings:
-    def __init__(self, input_strings, output_strings, anywhere_values, additional_info_list=None):
+    def __init__(
+        self,
+        input_strings,
+        output_strings,
+        anywhere_values,
+        additional_info_list=None,
+        keys=None,
+        on_slow_pattern=None,
+        slow_pattern_threshold=None,
+    ):
         """
         Used to encode a list of input strings with placeholders
         and a list of output strings with placeholders to
@@ -179,6 +296,10 @@ class PStringEncodings:
         output p-string if it matches some input patterns.
         Note that the parser is case sensitive
 
+        Each pairing is identified by a key, and pairings can then be added,
+        replaced or removed one by one with the set and remove methods,
+        without encoding all the other ones again.
+
         Arguments:
         -input_strings: a list of input strings with placeholders. Note that
         this cannot include %user% and %channel% (these aren't values users
@@ -200,6 +321,17 @@ class PStringEncodings:
 
         -additional_info_list: a list with additional information for
         each p-string. Must be the same length as input_strings
+
+        -keys: a list of unique keys identifying each input/output pair
+        (e.g. database IDs). Must be the same length as input_strings.
+        By default, the keys are the indices in input_strings
+
+        -on_slow_pattern: function called with the key of an input pattern,
+        the time it took in seconds and whether it ran out of time, when
+        matching it against some content took longer than
+        slow_pattern_threshold seconds or than the time budget given to the
+        parser. The key is None if the time budget ran out without a single
+        pattern being at fault
         """
         # if a boolean is given for anywhere_values, then for every
         # input/output pair the anywhere value is this boolean,
@@ -209,31 +341,128 @@ class PStringEncodings:
             anywhere_values = [anywhere_values] * len(input_strings)
         if not additional_info_list:
             additional_info_list = [None] * len(input_strings)
+        if keys is None:
+            keys = range(len(input_strings))
         # the lists must all be the same length
-        if not (len(input_strings) == len(output_strings) == len(anywhere_values) == len(additional_info_list)):
+        if not (
+            len(input_strings) == len(output_strings) == len(anywhere_values) == len(additional_info_list) == len(keys)
+        ):
             raise ValueError(
                 "input_strings, output_strings, "
-                "anywhere_values (if not bool) and"
-                "additional_info_list (if provided)"
+                "anywhere_values (if not bool), "
+                "additional_info_list (if provided) and "
+                "keys (if provided) "
                 "should be the same length"
             )
-        # get the list of input regex patterns
-        self.patterns = [
-            _get_pattern_from_string(input_string, anywhere=anywhere)
-            for input_string, anywhere in zip(input_strings, anywhere_values)
-        ]
-        # the patterns_string is a big regex string that will be used to see
-        # if there is any match in any p-strings before actually looping
-        # (to save time)
-        patterns_strings_list = [pattern.pattern for pattern in self.patterns]
-        self.patterns_string = f"({'|'.join(patterns_strings_list)})"
-        # get the list of pairings of input regex pattern and output p-strings
-        self.patterns_and_p_strings = [
-            (pattern, PString(output_string, additional_info=additional_info))
-            for output_string, pattern, additional_info in zip(output_strings, self.patterns, additional_info_list)
-        ]
-
-    def parser(self, content, user=None, channel=None):
+
+        self.on_slow_pattern = on_slow_pattern
+        self.slow_pattern_threshold = slow_pattern_threshold
+
+        # pairings of input regex pattern and output p-string, by key
+        self.patterns_and_p_strings = {}
+
+        # most input strings are plain text with placeholders, which can only
+        # match content containing their longest piece of text: these are
+        # looked for all at once in the content, and only the patterns whose
+        # text was found are tried
+        self.keys_by_literal = {}
+        self._literal_by_key = {}
+        # keys of the patterns which may be slow to match, which are given a
+        # timeout when a time budget is set
+        self._timed_keys = set()
+        self._literals = []
+        self._literal_matcher = AhoCorasick([])
+        # literals added since the automaton was built, which are looked for
+        # one by one until there are enough of them to build it again
+        self._pending_literals = set()
+
+        # the other patterns are combined into a big precompiled pattern that
+        # will be used to see if any of them matches before actually looping
+        # (to save time). Likewise, patterns added since it was compiled are
+        # tried one by one until there are enough of them to compile it again
+        self.other_keys = set()
+        self._combined_keys = set()
+        self._pending_other_keys = set()
+        self.other_patterns = None
+
+        for key, input_string, output_string, anywhere, additional_info in zip(
+            keys, input_strings, output_strings, anywhere_values, additional_info_list
+        ):
+            self._add(key, input_string, output_string, anywhere, additional_info)
+        self._rebuild_literal_matcher()
+        self._rebuild_other_patterns()
+
+    def __len__(self):
+        return len(self.patterns_and_p_strings)
+
+    def _rebuild_literal_matcher(self):
+        self._literals = list(self.keys_by_literal)
+        self._literal_matcher = AhoCorasick(self._literals)
+        self._pending_literals.clear()
+
+    def _rebuild_other_patterns(self):
+        self._combined_keys = set(self.other_keys)
+        self._pending_other_keys.clear()
+        self.other_patterns = (
+            re.compile("|".join(f"(?:{self.patterns_and_p_strings[key][0].pattern})" for key in self._combined_keys))
+            if self._combined_keys
+            else None
+        )
+
+    def _add(self, key, input_string, output_string, anywhere, additional_info):
+        pattern = _get_pattern_from_string(input_string, anywhere=anywhere)
+        self.patterns_and_p_strings[key] = (pattern, PString(output_string, additional_info=additional_info))
+        literal = _get_required_literal(input_string)
+        if literal:
+            if literal not in self.keys_by_literal:
+                self.keys_by_literal[literal] = set()
+                self._pending_literals.add(literal)
+            self.keys_by_literal[literal].add(key)
+            self._literal_by_key[key] = literal
+            # text with at most one group placeholder matches in at most
+            # quadratic time, which is not worth the cost of a timeout
+            if len(set(GROUP_PLACEHOLDER_PATTERN.findall(input_string))) > 1:
+                self._timed_keys.add(key)
+        else:
+            self.other_keys.add(key)
+            self._pending_other_keys.add(key)
+            self._timed_keys.add(key)
+
+    def set(self, key, input_string, output_string, anywhere, additional_info=None):
+        """
+        Add an input/output pair with the given key, replacing the one with
+        the same key if there is one. Only this pair's input pattern is
+        compiled.
+        """
+        self.remove(key)
+        self._add(key, input_string, output_string, anywhere, additional_info)
+        if len(self._pending_literals) > PENDING_REBUILD_THRESHOLD:
+            self._rebuild_literal_matcher()
+        if len(self._pending_other_keys) > PENDING_REBUILD_THRESHOLD:
+            self._rebuild_other_patterns()
+
+    def remove(self, key):
+        """
+        Remove the input/output pair with the given key, if there is one.
+        """
+        if self.patterns_and_p_strings.pop(key, None) is None:
+            return
+        self._timed_keys.discard(key)
+        if key in self.other_keys:
+            # the combined pattern may still match it, which only costs
+            # trying the other patterns for nothing until it is compiled again
+            self.other_keys.discard(key)
+            self._pending_other_keys.discard(key)
+            return
+        literal = self._literal_by_key.pop(key)
+        keys = self.keys_by_literal[literal]
+        keys.discard(key)
+        if not keys:
+            # the automaton may still find it, which is harmless
+            del self.keys_by_literal[literal]
+            self._pending_literals.discard(literal)
+
+    def parser(self, content, user=None, channel=None, budget=None):
         """
         Return either None if the content matches no input pattern,
         or a random corresponding filled output p-string if it matches some
@@ -248,27 +477,94 @@ class PStringEncodings:
 
         - channel: should generally be used with
         something like ctx.channel but can be used with any string
+
+        - budget: maximum time, in seconds, spent matching the content
+        (see matching_keys)
         """
-        # first search the big patterns_string to see if anything matches
-        # (also check is the patterns_string is not just the parens)
-        if re.search(self.patterns_string, content) and len(self.patterns_string) > 2:
-            # choose a random iterator of match objects from those of all
-            # the matching input regex pattern (i.e. we are choosing
-            # which corresponding pattern to use)
-            match_iter = random.choice(
-                [
-                    (pattern.finditer(content), p_string)
-                    for (pattern, p_string) in self.patterns_and_p_strings
-                    if pattern.search(content) is not None
-                ]
-            )
-            # for that random iterator of match objects choose a random
-            # iteration (i.e. we are choosing which corresponding match
-            # of this pattern in the content to use)
-            match = (random.choice([match for match in match_iter[0]]), match_iter[1])
-            # fill the corresponding p-strings with the capture groups,
-            # the user info and the channel info
-            match[1].groups = [group for group in match[0].groups() if group is not None]
-            match[1].user = user
-            match[1].channel = channel
-            return match[1]
+        start = time.perf_counter()
+        matching_keys = self.matching_keys(content, budget=budget)
+        if not matching_keys:
+            return None
+        # choose a random pattern from all the matching input regex patterns
+        # (i.e. we are choosing which corresponding output p-string to use)
+        key = random.choice(matching_keys)
+        pattern, p_string = self.patterns_and_p_strings[key]
+        # choose a random match of this pattern in the content, within what
+        # is left of the budget
+        remaining = None
+        if budget is not None and key in self._timed_keys:
+            remaining = budget - (time.perf_counter() - start)
+            if remaining <= 0:
+                self._report_slow_pattern(key, budget, True)
+                return None
+        finditer_start = time.perf_counter()
+        try:
+            matches = list(pattern.finditer(content, timeout=remaining))
+        except TimeoutError:
+            self._report_slow_pattern(key, time.perf_counter() - finditer_start, True)
+            return None
+        match = random.choice(matches)
+        # fill the corresponding p-strings with the capture groups,
+        # the user info and the channel info
+        p_string.groups = [group for group in match.groups() if group is not None]
+        p_string.user = user
+        p_string.channel = channel
+        return p_string
+
+    def _report_slow_pattern(self, key, elapsed, timed_out):
+        if self.on_slow_pattern:
+            self.on_slow_pattern(key, elapsed, timed_out)
+
+    def matching_keys(self, content, budget=None):
+        """
+        Return the keys of every input pattern matching the content.
+        If a budget (in seconds) is given, matching stops as soon as it is
+        spent, and only the keys found until then are returned.
+        """
+        deadline = time.perf_counter() + budget if budget is not None else None
+        candidates = set()
+        literals = [self._literals[i] for i in self._literal_matcher.find_all(content)]
+        literals.extend(literal for literal in self._pending_literals if literal in content)
+        for literal in literals:
+            candidates.update(self.keys_by_literal.get(literal, ()))
+        candidates.update(self._pending_other_keys)
+        if self._combined_keys:
+            if self.other_patterns is None:
+                candidates.update(self._combined_keys & self.other_keys)
+            else:
+                start = time.perf_counter()
+                try:
+                    if self.other_patterns.search(content, timeout=deadline and deadline - start):
+                        candidates.update(self._combined_keys & self.other_keys)
+                except TimeoutError:
+                    # which pattern is at fault cannot be told from the
+                    # combined pattern, so it is not used until it is
+                    # compiled again and the patterns are tried one by one
+                    self.other_patterns = None
+                    self._report_slow_pattern(None, time.perf_counter() - start, True)
+                    return []
+
+        if deadline is None and self.slow_pattern_threshold is None:
+            return [key for key in candidates if self.patterns_and_p_strings[key][0].search(content)]
+
+        matching_keys = []
+        start = time.perf_counter()
+        for key in candidates:
+            remaining = deadline - start if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                self._report_slow_pattern(None, budget, True)
+                break
+            try:
+                matched = self.patterns_and_p_strings[key][0].search(
+                    content, timeout=remaining if key in self._timed_keys else None
+                )
+            except TimeoutError:
+                self._report_slow_pattern(key, time.perf_counter() - start, True)
+                break
+            end = time.perf_counter()
+            if self.slow_pattern_threshold is not None and end - start > self.slow_pattern_threshold:
+                self._report_slow_pattern(key, end - start, False)
+            if matched:
+                matching_keys.append(key)
+            start = end
+        return matching_keys
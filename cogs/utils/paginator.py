@@ -17,10 +17,140 @@
 # You should have received a copy of the GNU General Public License
 # along with Canary. If not, see <https://www.gnu.org/licenses/>.
 
+import abc
+import asyncio
 import discord
 
 import math
 
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional
+
+from .database import Database
+
+# Number of rendered pages of a page source kept, including the neighbours of
+# the page shown, which are fetched in advance
+PAGE_CACHE_SIZE = 5
+
+# Maximum length of the content of a code block page
+CODE_BLOCK_PAGE_LENGTH = 1894
+
+
+class PageSource(abc.ABC):
+    """
+    Provides the items of a Pages one page at a time, so that only the items
+    of the pages being shown are fetched and rendered. Items are the same as
+    those of item_list: strings, or (name, value) tuples for display option 2.
+    """
+
+    # Whether the neighbours of the page shown are fetched in advance, which
+    # sources whose pages are expensive to fetch should not do
+    prefetch = True
+
+    async def count(self) -> Optional[int]:
+        """Returns the number of items, or None if it is not known in
+        advance, in which case the end is found by fetching pages."""
+        return None
+
+    def reset(self) -> None:
+        """Forgets what was cached about the items, after they were edited."""
+
+    @abc.abstractmethod
+    async def fetch(self, offset: int, limit: int) -> list:
+        """Returns at most limit items, starting from the item at offset."""
+
+
+class SQLPageSource(PageSource):
+    def __init__(
+        self,
+        db: Database,
+        query: str,
+        parameters: Iterable[Any] = (),
+        format_row: Optional[Callable] = None,
+        key_condition: Optional[str] = None,
+        key_columns: int = 0,
+        materialize: bool = False,
+    ):
+        """
+        A page source over the rows of a query (which should have an ORDER
+        BY), fetched a page at a time. The number of rows is only counted
+        once, until reset() is called.
+
+        By default, pages are fetched with LIMIT and OFFSET, which goes
+        through every row before the page. Queries ordered by an index should
+        instead give a key: each page is then fetched from where the previous
+        one ended, e.g. with "(Balance, UserID) < (?, ?)". Pages whose
+        previous page was not fetched (e.g. the last one) still use OFFSET.
+        Queries which aggregate rows cannot be ordered by an index, and should
+        rather be materialized: they are run once, and their rows kept.
+
+        Arguments:
+        - db: the bot's Database
+        - query: the SELECT query, without LIMIT. With a key, its WHERE clause
+          contains {after}, after every other placeholder
+        - parameters: the values of the query's placeholders
+        - format_row: turns a row and its position (starting from 1) into an
+          item; by default, rows of one column are their only value and others
+          are tuples
+        - key_condition: condition on the key columns that a row comes after
+          the key given as its placeholders
+        - key_columns: number of columns at the end of the rows which make up
+          their key; they are not part of the items
+        - materialize: whether to run the query once and keep its rows
+        """
+        self.db = db
+        self.query = query
+        self.parameters = tuple(parameters)
+        self.format_row = format_row
+        self.key_condition = key_condition
+        self.key_columns = key_columns
+        self.materialize = materialize
+        self.prefetch = materialize or key_condition is not None
+        self._count: Optional[int] = None
+        # The key of the last row before an offset, for the offsets where
+        # fetched pages ended
+        self._keys: dict[int, tuple] = {}
+        self._rows: Optional[asyncio.Future] = None
+
+    def reset(self) -> None:
+        self._count = None
+        self._keys.clear()
+        self._rows = None
+
+    def _query(self, after: Optional[tuple] = None) -> str:
+        if self.key_condition is None:
+            return self.query
+        return self.query.format(after=self.key_condition if after is not None else "1")
+
+    async def _materialized_rows(self) -> list:
+        # Concurrent pages share the same run of the query
+        if self._rows is None or (self._rows.done() and self._rows.exception()):
+            self._rows = asyncio.ensure_future(self.db.fetchall(self._query(), self.parameters))
+        return await self._rows
+
+    async def count(self) -> int:
+        if self._count is None:
+            if self.materialize:
+                self._count = len(await self._materialized_rows())
+            else:
+                (self._count,) = await self.db.fetchone(f"SELECT COUNT(*) FROM ({self._query()})", self.parameters)
+        return self._count
+
+    async def fetch(self, offset: int, limit: int) -> list:
+        if self.materialize:
+            rows = (await self._materialized_rows())[offset : offset + limit]
+        elif (after := self._keys.get(offset)) is not None:
+            rows = await self.db.fetchall(f"{self._query(after)} LIMIT ?", (*self.parameters, *after, limit))
+        else:
+            rows = await self.db.fetchall(f"{self._query()} LIMIT ? OFFSET ?", (*self.parameters, limit, offset))
+        if self.key_columns:
+            if rows:
+                self._keys[offset + len(rows)] = tuple(rows[-1][-self.key_columns :])
+            rows = [row[: -self.key_columns] for row in rows]
+        if self.format_row:
+            return [self.format_row(row, position) for position, row in enumerate(rows, offset + 1)]
+        return [row[0] if len(row) == 1 else tuple(row) for row in rows]
+
 
 class Pages:
     def __init__(
@@ -35,6 +165,7 @@ class Pages:
         editable_content_emoji="🚮",
         return_user_on_edit=False,
         timeout=300,
+        page_source=None,
     ):
         """Creates a paginator.
 
@@ -89,20 +220,38 @@ class Pages:
             should be returned when editing.
             False otherwise.
         timeout: int
-            The time in seconds before the message gets deleted.
-            The timeout is reset when a user turns pages.
+            The time in seconds before the message gets deleted and the
+            paginator stops waiting for reactions. The timeout is reset when a user turns pages.
             It is not recommended to use a value much bigger than the default
             one.
+        page_source: PageSource
+            Where to fetch the items from, a page at a time, instead of
+            item_list. Only the pages shown (and their neighbours) are
+            fetched and rendered, so this should be used for long lists, e.g.
+            rankings. Only display options 0, 2 and 3 are supported; code
+            block pages then start with the title. If content is edited, the
+            items are fetched again.
         """
         self.bot = ctx.bot
         self.guild = ctx.guild
         self.channel = ctx.channel
         self.user = ctx.author
+        self._owner = ctx.author
         self.message = msg
         self.itemList = item_list
         self.title = title
         self.displayOption = display_option
-        self._organize()
+        self.page_source = page_source
+        self._page_cache = OrderedDict()
+        if page_source is None:
+            self._organize()
+        elif display_option[0] not in (0, 2, 3):
+            raise ValueError(f"Display option {display_option[0]} cannot be used with a page source")
+        else:
+            # Known once paginate() counts the items
+            self.pagesToSend = None
+            self.lastPage = None
+            self._counted = False
         self.actions = [
             ("⏪", self._first_page),
             ("◀", self._prev_page),
@@ -131,16 +280,39 @@ class Pages:
         self.organize_helper = organize_helper_map[self.displayOption[0]]
         self.pagesToSend, self.lastPage = self.organize_helper(pages_to_send)
 
+    @staticmethod
+    def _page_number(page, page_counter):
+        # The number of pages of a page source may not be known yet
+        if page_counter is None:
+            return "Page {:02d}".format(page)
+        return "Page {:02d} of {:02d}".format(page, page_counter)
+
+    def _code_block_page(self, items, page, page_counter):
+        content = "\n".join(items).replace("```", "")
+        return "```markdown\n" + content + "\n\n~ " + self._page_number(page, page_counter) + " ~" + "```"
+
+    def _embed_fields_page(self, names_values, page, page_counter):
+        em = discord.Embed(title=self.title, colour=0xDA291C)
+        em.set_footer(text=self._page_number(page, page_counter))
+        for name, val in names_values:
+            em.add_field(name=name, value=val)
+        return em
+
+    def _embed_list_page(self, items, page, page_counter):
+        em = discord.Embed(title=self.title, colour=0xDA291C)
+        em.set_footer(text=self._page_number(page, page_counter))
+        em.description = "".join(items)
+        if len(em.description) > 1200:
+            em.description = em.description[:1200] + "..."
+        return em
+
     def _organize_code_blocks(self, pages_to_send):
         item_per_page = self.displayOption[1]
         page_counter = math.ceil(len(self.itemList) / item_per_page)
         for i in range(page_counter):
             index_start = item_per_page * i
             index_end = item_per_page * (i + 1)
-            content = "\n".join(self.itemList[index_start:index_end]).replace("```", "")
-            pages_to_send.append(
-                "```markdown\n" + content + "\n\n~ Page {:02d} of {:02d} ~".format(i + 1, page_counter) + "```"
-            )
+            pages_to_send.append(self._code_block_page(self.itemList[index_start:index_end], i + 1, page_counter))
         return pages_to_send, page_counter
 
     def _organize_code_blocks_autosize(self, pages_to_send):
@@ -169,32 +341,22 @@ class Pages:
     def _organize_embeds_dict(self, pages_to_send):
         item_per_page = self.displayOption[1]
         page_counter = math.ceil(len(self.itemList["names"]) / item_per_page)
-        em = discord.Embed(title=self.title, colour=0xDA291C)
         for i in range(page_counter):
-            em.set_footer(text="Page {:02d} of {:02d}".format(i + 1, page_counter))
             index_start = item_per_page * i
             index_end = item_per_page * (i + 1)
-            for name, val in zip(
+            names_values = zip(
                 self.itemList["names"][index_start:index_end], self.itemList["values"][index_start:index_end]
-            ):
-                em.add_field(name=name, value=val)
-            pages_to_send.append(em)
-            em = discord.Embed(title=self.title, colour=0xDA291C)
+            )
+            pages_to_send.append(self._embed_fields_page(names_values, i + 1, page_counter))
         return pages_to_send, page_counter
 
     def _organize_embeds_list(self, pages_to_send):
         item_per_page = self.displayOption[1]
         page_counter = math.ceil(len(self.itemList) / item_per_page)
-        em = discord.Embed(title=self.title, colour=0xDA291C)
         for i in range(page_counter):
-            em.set_footer(text="Page {:02d} of {:02d}".format(i + 1, page_counter))
             index_start = item_per_page * i
             index_end = item_per_page * (i + 1)
-            em.description = "".join(self.itemList[index_start:index_end])
-            if len(em.description) > 1200:
-                em.description = em.description[:1200] + "..."
-            pages_to_send.append(em)
-            em = discord.Embed(title=self.title, colour=0xDA291C)
+            pages_to_send.append(self._embed_list_page(self.itemList[index_start:index_end], i + 1, page_counter))
         return pages_to_send, page_counter
 
     def _organize_embeds_autosize_dict(self, pages_to_send):
@@ -211,8 +373,70 @@ class Pages:
         pages_to_send.extend(self.itemList)
         return pages_to_send, page_counter
 
+    async def _count_pages(self):
+        # The items were edited, or are counted for the first time
+        if self._counted:
+            self.page_source.reset()
+        count = await self.page_source.count()
+        self.lastPage = math.ceil(count / self.displayOption[1]) if count is not None else None
+        self._page_cache.clear()
+        self._counted = True
+
+    async def _render_source_page(self, page):
+        # Returns the rendered page, or None if it is past the last one
+        item_per_page = self.displayOption[1]
+        items = await self.page_source.fetch((page - 1) * item_per_page, item_per_page)
+        # A short or empty page is past the end, which may not have been
+        # known (or may have moved if items were deleted since they were
+        # counted)
+        if not items:
+            if self.lastPage is None or self.lastPage >= page:
+                self.lastPage = page - 1
+            return None
+        if len(items) < item_per_page:
+            self.lastPage = page
+        if self.displayOption[0] == 0:
+            # Items are cut so that the page fits in a message, and the page
+            # starts with the title as autosized ones do
+            max_length = (CODE_BLOCK_PAGE_LENGTH - len(self.title)) // len(items)
+            items = [item if len(item) <= max_length else item[: max_length - 3] + "..." for item in items]
+            return self._code_block_page([self.title + ":\n", *items], page, self.lastPage)
+        if self.displayOption[0] == 2:
+            return self._embed_fields_page(items, page, self.lastPage)
+        return self._embed_list_page(items, page, self.lastPage)
+
+    def _page_task(self, page):
+        # Pages are cached as tasks, so that a page being fetched in advance
+        # is not fetched a second time when it is shown
+        task = self._page_cache.get(page)
+        if task is None or (task.done() and (task.cancelled() or task.exception())):
+            task = self._page_cache[page] = asyncio.ensure_future(self._render_source_page(page))
+        self._page_cache.move_to_end(page)
+        while len(self._page_cache) > PAGE_CACHE_SIZE:
+            self._page_cache.popitem(last=False)
+        return task
+
+    async def _get_page(self, page):
+        if self.page_source is None:
+            return self.pagesToSend[page]
+        if page < 1:
+            return "empty page"
+        content = await self._page_task(page)
+        # The number of pages of a page source that could not count its items
+        # is only found when going past the last one
+        while content is None and page > 1:
+            page -= 1
+            content = await self._page_task(page)
+        self.currentPage = page
+        if not self.page_source.prefetch:
+            return content
+        for neighbour in (page + 1, page - 1):
+            if 0 < neighbour and (self.lastPage is None or neighbour <= self.lastPage):
+                self._page_task(neighbour)
+        return content
+
     async def _show_page(self, page):
-        self.currentPage = max(0, min(page, self.lastPage))
+        self.currentPage = max(0, page if self.lastPage is None else min(page, self.lastPage))
         if self.message:
             if self.currentPage == 0:
                 try:
@@ -222,20 +446,18 @@ class Pages:
                 except:
                     pass
             else:
+                content = await self._get_page(self.currentPage)
                 if self.displayOption[0] < 2:  # code blocks
-                    await self.message.edit(content=self.pagesToSend[self.currentPage], delete_after=self.timeout)
+                    await self.message.edit(content=content, delete_after=self.timeout)
                 else:  # embeds
-                    await self.message.edit(embed=self.pagesToSend[self.currentPage], delete_after=self.timeout)
+                    await self.message.edit(embed=content, delete_after=self.timeout)
                 return
         else:
+            content = await self._get_page(self.currentPage)
             if self.displayOption[0] < 2:
-                self.message = await self.channel.send(
-                    content=self.pagesToSend[self.currentPage], delete_after=self.timeout
-                )
+                self.message = await self.channel.send(content=content, delete_after=self.timeout)
             else:
-                self.message = await self.channel.send(
-                    embed=self.pagesToSend[self.currentPage], delete_after=self.timeout
-                )
+                self.message = await self.channel.send(embed=content, delete_after=self.timeout)
             for (emoji, _) in self.actions:
                 await self.message.add_reaction(emoji)
             return
@@ -250,6 +472,9 @@ class Pages:
         await self._show_page(min(self.lastPage, self.currentPage + 1))
 
     async def _last_page(self):
+        # Without a count, pages are fetched one after the other until the end
+        while self.lastPage is None:
+            await self._get_page(self.currentPage + 1)
         await self._show_page(self.lastPage)
 
     async def _halt(self):
@@ -260,10 +485,7 @@ class Pages:
         await self._show_page(self.currentPage)
 
     def _react_check(self, reaction, user):
-        if user == self.bot.user:
-            return False
-        if reaction.message.id != self.message.id:
-            return False
+        # Only reactions of other users on the message are dispatched here
         for (emoji, action) in self.actions:
             if reaction.emoji != emoji:
                 continue
@@ -273,13 +495,27 @@ class Pages:
         return False
 
     async def paginate(self):
+        # Pages sent on behalf of the bot itself (e.g. on moderation events)
+        # are not counted against anyone's sessions
+        owner = None if self._owner == self.bot.user else self._owner.id
+        with self.bot.interactions.session(owner):
+            return await self._paginate()
+
+    async def _paginate(self):
         if self.edit_mode:
             self.edit_mode = False
-            self._organize()
+            if self.page_source is None:
+                self._organize()
+            else:
+                await self._count_pages()
+        elif self.page_source is not None and not self._counted:
+            await self._count_pages()
         await self._show_page(self.currentPage)
         while not self.edit_mode and self.message:
             try:
-                reaction, user = await self.bot.wait_for("reaction_add", check=self._react_check)
+                reaction, user = await self.bot.interactions.wait_for_reaction(
+                    self.message, check=self._react_check, timeout=self.timeout
+                )
             except:
                 try:
                     await self.message.delete()
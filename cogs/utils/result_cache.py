@@ -0,0 +1,140 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import contextlib
+import os
+
+from collections import OrderedDict
+from typing import Optional
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int, disk_path: Optional[str] = None, max_disk_bytes: int = 0):
+        """A least recently used cache of results (e.g. filtered images) by
+        key (e.g. a digest of the input and of the parameters), bounded by the
+        total size of the results. Results evicted from memory are spilled to
+        files in disk_path, themselves bounded by max_disk_bytes, and moved
+        back to memory when they are used again. The files are kept across
+        restarts, and read and written in threads so as not to block the
+        event loop.
+
+        Arguments:
+        - max_bytes: maximum total size of the results kept in memory
+        - disk_path: directory to spill results to, or None not to spill
+        - max_disk_bytes: maximum total size of the results spilled
+        """
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path if max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        # Sizes of the spilled results, least recently used first
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        if self.disk_path:
+            os.makedirs(self.disk_path, exist_ok=True)
+            entries = sorted(os.scandir(self.disk_path), key=lambda entry: entry.stat().st_mtime)
+            for entry in entries:
+                self._disk[entry.name] = entry.stat().st_size
+                self._disk_bytes += self._disk[entry.name]
+            self._remove_files(self._evict_disk())
+
+    def __len__(self) -> int:
+        return len(self._memory) + len(self._disk)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.disk_path, key)
+
+    def _evict_disk(self) -> list[str]:
+        # Returns the files of the evicted results, to be removed with
+        # _remove_files()
+        paths = []
+        while self._disk_bytes > self.max_disk_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            paths.append(self._file(key))
+        return paths
+
+    @staticmethod
+    def _remove_files(paths: list[str]) -> None:
+        for path in paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def _read(self, key: str) -> bytes:
+        with open(self._file(key), "rb") as fp:
+            return fp.read()
+
+    def _write(self, key: str, data: bytes) -> None:
+        with open(self._file(key), "wb") as fp:
+            fp.write(data)
+
+    async def _spill(self, key: str, data: bytes) -> None:
+        if not self.disk_path or len(data) > self.max_disk_bytes:
+            return
+        loop = asyncio.get_running_loop()
+        if key not in self._disk:
+            await loop.run_in_executor(None, self._write, key, data)
+            # The result is only indexed once its file is written, so that
+            # get() does not read a partial file
+            if key not in self._disk:
+                self._disk[key] = len(data)
+                self._disk_bytes += len(data)
+        self._disk.move_to_end(key)
+        if evicted := self._evict_disk():
+            await loop.run_in_executor(None, self._remove_files, evicted)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if (data := self._memory.get(key)) is not None:
+            self._memory.move_to_end(key)
+        elif key in self._disk:
+            try:
+                data = await asyncio.get_running_loop().run_in_executor(None, self._read, key)
+            except FileNotFoundError:
+                # Evicted meanwhile, or removed by hand
+                if key in self._disk:
+                    self._disk_bytes -= self._disk.pop(key)
+            else:
+                # The file stays on disk, so spilling the result again is free
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                await self.put(key, data)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    async def put(self, key: str, data: bytes) -> None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        if len(data) > self.max_bytes:
+            await self._spill(key, data)
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        evicted = []
+        while self._memory_bytes > self.max_bytes:
+            evicted_key, evicted_data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted_data)
+            evicted.append((evicted_key, evicted_data))
+        for evicted_key, evicted_data in evicted:
+            await self._spill(evicted_key, evicted_data)
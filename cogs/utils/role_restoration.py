@@ -16,7 +16,6 @@
 # along with Canary. If not, see <https://www.gnu.org/licenses/>.
 
 import discord
-import sqlite3
 
 from discord import utils
 from discord.ext import commands
@@ -27,54 +26,43 @@ from bot import muted_role as muted_role_name
 import datetime
 
 
-def save_existing_roles(bot, user: discord.Member, muted: bool = False, appeal_channel: discord.TextChannel = None):
+async def save_existing_roles(
+    bot, user: discord.Member, muted: bool = False, appeal_channel: discord.TextChannel = None
+):
     roles_id = [role.id for role in user.roles if role.name not in ("@everyone", muted_role_name)]
 
     if not roles_id and not muted:
         return
 
-    conn = sqlite3.connect(bot.config.db_path)
-    try:
-        c = conn.cursor()
+    async with bot.db.transaction() as txn:
         # store roles as a string of IDs separated by spaces
         if muted:
             now = datetime.datetime.now()
-            if is_in_muted_table(bot, user):
+            if await is_in_muted_table(bot, user):
                 t = (appeal_channel.id, user.id)
-                c.execute(f"UPDATE MutedUsers SET AppealChannelID = ? WHERE UserID = ?", t)
+                await txn.execute(f"UPDATE MutedUsers SET AppealChannelID = ? WHERE UserID = ?", t)
             else:
                 t = (user.id, appeal_channel.id, " ".join(str(e) for e in roles_id), now)
-                c.execute(f"REPLACE INTO MutedUsers VALUES (?, ?, ?, ?)", t)
+                await txn.execute(f"REPLACE INTO MutedUsers VALUES (?, ?, ?, ?)", t)
         else:
             t = (user.id, " ".join(str(e) for e in roles_id))
-            c.execute(f"REPLACE INTO PreviousRoles VALUES (?, ?)", t)
-        conn.commit()
-    finally:
-        conn.close()
-
-
-def fetch_saved_roles(bot, guild, user: discord.Member, muted: bool = False) -> list[discord.Role] | None:
-    conn = sqlite3.connect(bot.config.db_path)
-    try:
-        c = conn.cursor()
-        if muted:
-            fetched_roles = c.execute(f"SELECT Roles FROM MutedUsers WHERE UserID = ?", (user.id,)).fetchone()
-        else:
-            fetched_roles = c.execute(f"SELECT Roles FROM PreviousRoles WHERE ID = ?", (user.id,)).fetchone()
-        # the above returns a tuple with a string of IDs separated by spaces
-
-        # Return list of all valid roles restored from the DB
-        #  - filter(None, ...) strips false-y elements
-        return (
-            list(
-                filter(None, (guild.get_role(int(role_id)) for role_id in fetched_roles[0].split(" ") if role_id != ""))
-            )
-            if fetched_roles
-            else None
-        )
-
-    finally:
-        conn.close()
+            await txn.execute(f"REPLACE INTO PreviousRoles VALUES (?, ?)", t)
+
+
+async def fetch_saved_roles(bot, guild, user: discord.Member, muted: bool = False) -> list[discord.Role] | None:
+    if muted:
+        fetched_roles = await bot.db.fetchone(f"SELECT Roles FROM MutedUsers WHERE UserID = ?", (user.id,))
+    else:
+        fetched_roles = await bot.db.fetchone(f"SELECT Roles FROM PreviousRoles WHERE ID = ?", (user.id,))
+    # the above returns a tuple with a string of IDs separated by spaces
+
+    # Return list of all valid roles restored from the DB
+    #  - filter(None, ...) strips false-y elements
+    return (
+        list(filter(None, (guild.get_role(int(role_id)) for role_id in fetched_roles[0].split(" ") if role_id != "")))
+        if fetched_roles
+        else None
+    )
 
 
 def has_muted_role(user: discord.Member):
@@ -82,24 +70,13 @@ def has_muted_role(user: discord.Member):
     return muted_role and next((r for r in user.roles if r == muted_role), None) is not None
 
 
-def is_in_muted_table(bot, user: discord.Member):
-    conn = sqlite3.connect(bot.config.db_path)
-    try:
-        c = conn.cursor()
-        muted = c.execute("SELECT * FROM MutedUsers WHERE UserID = ?", (user.id,)).fetchone()
-        return muted is not None
-    finally:
-        conn.close()
-
-
-def remove_from_muted_table(bot, user: discord.Member):
-    conn = sqlite3.connect(bot.config.db_path)
-    try:
-        c = conn.cursor()
-        c.execute("DELETE FROM MutedUsers WHERE UserID = ?", (user.id,))
-        conn.commit()
-    finally:
-        conn.close()
+async def is_in_muted_table(bot, user: discord.Member):
+    muted = await bot.db.fetchone("SELECT * FROM MutedUsers WHERE UserID = ?", (user.id,))
+    return muted is not None
+
+
+async def remove_from_muted_table(bot, user: discord.Member):
+    await bot.db.execute("DELETE FROM MutedUsers WHERE UserID = ?", (user.id,))
 
 
 async def role_restoring_page(
@@ -0,0 +1,159 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+# Helpers to run user-written regexes (custom reaction prompts, quote search
+# queries) without letting a catastrophically backtracking pattern freeze the
+# bot: patterns are checked when they are submitted, and searches are given a
+# time budget, which the regex module enforces.
+
+import time
+import regex as re
+
+from typing import Iterable, Optional
+
+MAX_PATTERN_LENGTH = 1000
+
+# Longest message Discord allows, used as the length of the probe strings
+PROBE_LENGTH = 2000
+
+# A repetition count, e.g. {2} or {1,3}; other braces are literal
+BRACE_QUANTIFIER = re.compile(r"\{\d*,?\d*\}")
+
+# An escape followed by an argument, e.g. \p{L}, \N{DASH}, \x41, \u00e9 or a
+# backreference, which must be skipped as a whole
+ESCAPE_WITH_ARGUMENT = re.compile(
+    r"\\(?:[pPNxuUo]\{[^}]*\}|[pP][A-Za-z]|x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|0[0-7]{0,2}|[1-9]\d?)"
+)
+
+# A group containing a quantifier, itself quantified, e.g. (a+)+ or (\w*x)*
+NESTED_QUANTIFIER = re.compile(r"\((?:[^()\\]|\\.)*(?:[*+]|\{\d*,\d*\})(?:[^()\\]|\\.)*\)(?:[*+]|\{\d*,\d*\})")
+
+
+class RegexBudgetExceeded(Exception):
+    def __init__(self, pattern: str, elapsed: float):
+        self.pattern = pattern
+        self.elapsed = elapsed
+        super().__init__(f"Pattern {pattern!r} exceeded its time budget ({elapsed * 1000:.0f} ms)")
+
+
+def _probes(pattern: str) -> list[str]:
+    # Strings which make slow patterns backtrack a lot: long runs of the
+    # characters used by the pattern, followed by a character that is
+    # unlikely to let the match succeed
+    chars = sorted({c for c in pattern if c.isalnum() or c == " "}) or ["a"]
+    probes = [c * PROBE_LENGTH + "\0" for c in chars[:8]]
+    probes.append(("".join(chars) * (PROBE_LENGTH // len(chars) + 1))[:PROBE_LENGTH] + "\0")
+    if match := NESTED_QUANTIFIER.search(pattern):
+        # Repeat what the nested group matches
+        unit = "".join(c for c in match.group() if c.isalnum() or c == " ") or "a"
+        probes.append((unit * (PROBE_LENGTH // len(unit) + 1))[:PROBE_LENGTH] + "\0")
+    return probes
+
+
+def pattern_problem(pattern: str, budget: float) -> Optional[str]:
+    """Returns why the pattern should be rejected, or None if it is fine. A
+    pattern is rejected if it is invalid, too long, or if searching one of a
+    few adversarial strings as long as a Discord message takes longer than
+    budget seconds."""
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        return f"it is longer than {MAX_PATTERN_LENGTH} characters"
+    try:
+        compiled = re.compile(pattern)
+    except re.error as e:
+        return f"it is not a valid regex ({e})"
+    for probe in _probes(pattern):
+        try:
+            compiled.search(probe, timeout=budget)
+        except TimeoutError:
+            return "it can take too long to match some messages (e.g. because of nested repetitions like `(a+)+`)"
+    return None
+
+
+def search_all(pattern: re.Pattern, strings: Iterable[tuple], budget: float, index: int = 0) -> list[tuple]:
+    """Returns the items of strings (tuples, e.g. database rows) whose
+    element at index matches pattern, spending at most budget seconds in
+    total. Raises RegexBudgetExceeded once the budget is spent."""
+    start = time.perf_counter()
+    deadline = start + budget
+    matches = []
+    try:
+        for item in strings:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutError
+            if pattern.search(item[index], timeout=remaining):
+                matches.append(item)
+    except TimeoutError:
+        raise RegexBudgetExceeded(pattern.pattern, time.perf_counter() - start) from None
+    return matches
+
+
+def required_literals(pattern: str) -> list[str]:
+    r"""Returns pieces of plain text that any string matched by pattern must
+    contain (case aside), e.g. ["hello ", " world"] for r"hello \w+ world",
+    so that candidates can be looked up in an index before running the
+    pattern. Returns an empty list when none can be told, e.g. when the
+    pattern has a top-level alternation."""
+    if re.search(r"\(\?[a-zA-Z]*x", pattern):
+        # Verbose patterns ignore whitespace and comments
+        return []
+    literals = []
+    current = []
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            escaped = pattern[i + 1 : i + 2]
+            if depth == 0 and escaped and not escaped.isalnum() and not escaped.isspace():
+                current.append(escaped)
+            elif current:
+                literals.append("".join(current))
+                current = []
+            argument = ESCAPE_WITH_ARGUMENT.match(pattern, i)
+            i = argument.end() if argument else i + 2
+            continue
+        if char == "[":
+            # Skip the character set; a ] right after [ or [^ is a literal
+            i += 2 if pattern[i + 1 : i + 2] == "^" else 1
+            i += 1 if pattern[i : i + 1] == "]" else 0
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+            char = None
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return []
+        elif char in "?*{" and (char != "{" or (quantifier := BRACE_QUANTIFIER.match(pattern, i))):
+            # The previous character is optional
+            if current:
+                current.pop()
+            if char == "{":
+                i = quantifier.end() - 1
+        elif depth == 0 and char not in ".^$+":
+            current.append(char)
+            i += 1
+            continue
+        if current:
+            literals.append("".join(current))
+            current = []
+        i += 1
+    if current:
+        literals.append("".join(current))
+    return [literal for literal in literals if literal]
@@ -0,0 +1,192 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import heapq
+import json
+import logging
+import time
+
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional
+
+from .database import Database
+
+# A handler is called with the key and the payload of the job that is due
+JobHandler = Callable[[str, Any], Awaitable[None]]
+
+# Delay before retrying a job whose handler failed, in seconds, doubled on
+# every failure up to MAX_RETRY_DELAY
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 6 * 60 * 60
+
+
+class RetryJob(Exception):
+    """Raised by a handler which cannot run its job yet (e.g. the guild is not
+    available), so that the job is retried later instead of being dropped."""
+
+
+class Scheduler:
+    def __init__(self, db: Database, logger: logging.Logger):
+        """Runs jobs at a given time. Jobs are stored in the ScheduledJobs
+        table, so that they survive restarts, and are identified by the name
+        of their handler and a key unique for that handler, e.g.
+        ("reminder", "42"). Scheduling a job with an existing handler and key
+        moves it instead of adding a second one.
+
+        Cogs register a coroutine for each of their handlers with register().
+        Jobs are kept in memory in a heap ordered by due time, and run() only
+        wakes up when the first job is due or when a job is (re)scheduled.
+        Due jobs run in their own tasks, so that a slow handler does not delay
+        the others. A job is removed once its handler returns, unless the
+        handler rescheduled it (e.g. a recurring job); a job whose handler
+        fails or raises RetryJob is retried later, with an increasing delay.
+
+        Arguments:
+        - db: the bot's Database
+        - logger: logger to report failing jobs to
+        """
+        self.db = db
+        self.logger = logger
+        self._handlers: dict[str, JobHandler] = {}
+        # (handler, key) -> (due, payload); the heap can hold outdated entries
+        # for moved or cancelled jobs, which are skipped once popped
+        self._jobs: dict[tuple[str, str], tuple[int, Any]] = {}
+        self._heap: list[tuple[int, str, str]] = []
+        self._changed = asyncio.Event()
+        self._started = False
+        # Jobs running, and the number of times failing jobs failed in a row
+        self._tasks: set[asyncio.Task] = set()
+        self._failures: dict[tuple[str, str], int] = {}
+
+    def _push(self, handler: str, key: str, due: int, payload: Any) -> None:
+        self._jobs[(handler, key)] = (due, payload)
+        heapq.heappush(self._heap, (due, handler, key))
+        self._changed.set()
+
+    async def _load(self, handler: Optional[str] = None) -> None:
+        query = "SELECT Handler, Key, DueAt, Payload FROM ScheduledJobs"
+        rows = await (
+            self.db.fetchall(query + " WHERE Handler = ?", (handler,)) if handler else self.db.fetchall(query)
+        )
+        for handler_name, key, due, payload in rows:
+            self._push(handler_name, key, due, json.loads(payload) if payload is not None else None)
+
+    async def register(self, handler: str, callback: JobHandler) -> None:
+        """Registers the coroutine called when a job of the given handler is
+        due. Jobs of a handler without a registered coroutine (e.g. of an
+        unloaded cog) are kept in the database until it is registered."""
+        self._handlers[handler] = callback
+        if self._started:
+            await self._load(handler)
+
+    def unregister(self, handler: str) -> None:
+        self._handlers.pop(handler, None)
+
+    async def schedule(self, handler: str, key: Any, due: int | float, payload: Any = None) -> None:
+        """Schedules (or moves) the job (handler, key) at the epoch due.
+        payload must be JSON serializable and is passed to the handler.
+        Inside a transaction, the job is only run once it is committed, so
+        that its handler can read the rows written alongside it."""
+        key, due = str(key), int(due)
+        await self.db.execute(
+            "INSERT INTO ScheduledJobs(Handler, Key, DueAt, Payload) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(Handler, Key) DO UPDATE SET DueAt = excluded.DueAt, Payload = excluded.Payload",
+            (handler, key, due, json.dumps(payload) if payload is not None else None),
+        )
+        if self._started:
+            self.db.after_commit(partial(self._push, handler, key, due, payload))
+
+    async def cancel(self, handler: str, key: Any) -> None:
+        key = str(key)
+        await self.db.execute("DELETE FROM ScheduledJobs WHERE Handler = ? AND Key = ?", (handler, key))
+        self.db.after_commit(partial(self._jobs.pop, (handler, key), None))
+
+    async def is_scheduled(self, handler: str, key: Any) -> bool:
+        return bool(
+            await self.db.fetchone(
+                "SELECT 1 FROM ScheduledJobs WHERE Handler = ? AND Key = ?",
+                (handler, str(key)),
+            )
+        )
+
+    async def upcoming(self, limit: int = 20) -> list[tuple[str, str, int]]:
+        """Returns the (handler, key, due epoch) of the next jobs due."""
+        return await self.db.fetchall(
+            "SELECT Handler, Key, DueAt FROM ScheduledJobs ORDER BY DueAt LIMIT ?",
+            (limit,),
+        )
+
+    async def _run_job(self, handler: str, key: str, due: int, payload: Any) -> None:
+        try:
+            await self._handlers[handler](key, payload)
+        except Exception as e:
+            failures = self._failures.get((handler, key), 0) + 1
+            self._failures[(handler, key)] = failures
+            retry_due = int(time.time()) + min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY)
+            if isinstance(e, RetryJob):
+                self.logger.warning(f"Scheduled job {handler} ({key}) postponed: {e}")
+            else:
+                self.logger.error(f"Scheduled job {handler} ({key}) failed: {e!r}")
+            # Unless it was cancelled or moved in the meantime
+            cursor = await self.db.execute(
+                "UPDATE ScheduledJobs SET DueAt = ? WHERE Handler = ? AND Key = ? AND DueAt = ?",
+                (retry_due, handler, key, due),
+            )
+            if cursor.rowcount:
+                self._push(handler, key, retry_due, payload)
+            return
+
+        self._failures.pop((handler, key), None)
+        # A job the handler rescheduled has another due time and is kept
+        await self.db.execute(
+            "DELETE FROM ScheduledJobs WHERE Handler = ? AND Key = ? AND DueAt = ?", (handler, key, due)
+        )
+
+    def _job_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and (e := task.exception()):
+            self.logger.error(f"Scheduled job bookkeeping failed: {e!r}")
+
+    async def run(self) -> None:
+        """Runs due jobs until cancelled. Jobs that came due while the bot
+        was offline are run right away."""
+        self._started = True
+        await self._load()
+        while True:
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                due, handler, key = heapq.heappop(self._heap)
+                job = self._jobs.get((handler, key))
+                if job is None or job[0] != due:
+                    # Cancelled or moved since this entry was pushed
+                    continue
+                if handler not in self._handlers:
+                    # Left in the database until its handler is registered
+                    del self._jobs[(handler, key)]
+                    continue
+                del self._jobs[(handler, key)]
+                task = asyncio.create_task(self._run_job(handler, key, due, job[1]))
+                self._tasks.add(task)
+                task.add_done_callback(self._job_done)
+
+            self._changed.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,155 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import concurrent.futures
+import contextlib
+
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Optional
+
+
+class WorkerPoolBusy(Exception):
+    def __init__(self, limit: int, per_user: bool):
+        self.limit = limit
+        self.per_user = per_user
+        super().__init__(
+            f"You already have {limit} job{'s' if limit != 1 else ''} running, wait for it to finish."
+            if per_user
+            else "Busy, try again later."
+        )
+
+
+class WorkerCrashed(Exception):
+    def __init__(self):
+        super().__init__("The worker running this job crashed (the input may be too large), try again.")
+
+
+def _ready() -> None:
+    # Submitted to every worker on startup, so that they are started (and
+    # have run their initializer) before the first job comes in
+    pass
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        max_workers: int,
+        max_jobs: int,
+        max_jobs_per_user: int,
+        recycle_after: int,
+        initializer: Optional[Callable] = None,
+    ):
+        """A long-lived pool of worker processes for CPU-bound jobs (e.g.
+        image filters), started ahead of time so that jobs do not pay for
+        starting processes and importing libraries:
+
+        - at most max_jobs jobs are running or waiting for a worker at once,
+          and at most max_jobs_per_user for a single user; further jobs are
+          refused with WorkerPoolBusy rather than queued without bound;
+        - the workers are replaced by fresh ones once they have run about
+          recycle_after jobs each, which caps the memory they can leak or
+          fragment. Jobs already submitted finish on the old workers;
+        - when a worker dies (e.g. killed for using too much memory), which
+          breaks every worker, the workers are replaced too, and the jobs
+          which were running raise WorkerCrashed.
+
+        Arguments:
+        - max_workers: number of worker processes
+        - max_jobs: maximum number of jobs running or waiting at once
+        - max_jobs_per_user: maximum number of jobs of a user at once
+        - recycle_after: number of jobs each worker runs before the workers
+          are replaced
+        - initializer: function run by every worker when it starts (e.g. to
+          load codecs)
+        """
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.max_jobs_per_user = max_jobs_per_user
+        self.recycle_after = recycle_after
+        self.initializer = initializer
+        self.jobs = 0
+        self._user_jobs: dict[int, int] = {}
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._executor_jobs = 0
+
+    def start(self) -> None:
+        """Starts the workers, without waiting for them to be ready."""
+        self._executor = concurrent.futures.ProcessPoolExecutor(self.max_workers, initializer=self.initializer)
+        self._executor_jobs = 0
+        for _ in range(self.max_workers):
+            self._executor.submit(_ready)
+
+    def shutdown(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @contextlib.contextmanager
+    def reserve(self, user_id: int):
+        """Reserves a slot for a job of user_id, or raises WorkerPoolBusy if
+        the pool or the user has too many jobs already. Reserving before
+        fetching the job's input lets busy pools refuse jobs early."""
+        if self._user_jobs.get(user_id, 0) >= self.max_jobs_per_user:
+            raise WorkerPoolBusy(self.max_jobs_per_user, per_user=True)
+        if self.jobs >= self.max_jobs:
+            raise WorkerPoolBusy(self.max_jobs, per_user=False)
+        self.jobs += 1
+        self._user_jobs[user_id] = self._user_jobs.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            self.jobs -= 1
+            self._user_jobs[user_id] -= 1
+            if not self._user_jobs[user_id]:
+                del self._user_jobs[user_id]
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Runs fn(*args) on a worker, within a slot reserved with
+        reserve(), and returns its result. fn and its arguments must be
+        picklable. Raises WorkerCrashed if the worker dies while running
+        it."""
+        if self._executor is None:
+            self.start()
+        if self._executor_jobs >= self.recycle_after * self.max_workers:
+            # shutdown() without waiting lets the old workers finish their
+            # jobs, then exit
+            self._executor.shutdown(wait=False)
+            self.start()
+        self._executor_jobs += 1
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            future = loop.run_in_executor(executor, partial(fn, *args))
+        except BrokenProcessPool:
+            # The job was not submitted, so it can run on fresh workers
+            self._restart(executor)
+            executor = self._executor
+            future = loop.run_in_executor(executor, partial(fn, *args))
+        try:
+            return await future
+        except BrokenProcessPool as e:
+            self._restart(executor)
+            raise WorkerCrashed() from e
+
+    def _restart(self, broken: concurrent.futures.ProcessPoolExecutor) -> None:
+        # Every job running when the workers broke fails, but only the first
+        # one to notice replaces them
+        if self._executor is broken:
+            self.shutdown()
+            self.start()
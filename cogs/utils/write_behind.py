@@ -0,0 +1,154 @@
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+
+from typing import Optional
+
+from .database import Database
+
+ADD = "add"
+REMOVE = "remove"
+
+# (ReacterID, ReacteeID, ReactionName, MessageID)
+ReactionKey = tuple[int, int, str, int]
+
+
+class WriteBehindQueue:
+    def __init__(self, db: Database, logger: logging.Logger, interval: int, max_rows: int):
+        """Buffers high-frequency writes (reactions and member upserts) and
+        flushes them to the database in a single transaction, either
+        `interval` milliseconds after the first buffered write or as soon as
+        `max_rows` writes are pending, whichever comes first.
+
+        An add and a remove of the same reaction inside one window cancel
+        out, and a member upsert only keeps the latest name.
+
+        Arguments:
+        - db: the bot's Database
+        - logger: logger to report failed flushes to
+        - interval: maximum time a write can stay buffered, in milliseconds
+        - max_rows: number of pending writes which triggers an early flush
+        """
+        self.db = db
+        self.logger = logger
+        self.interval = interval / 1000
+        self.max_rows = max_rows
+        self._reactions: dict[ReactionKey, str] = {}
+        self._members: dict[int, str] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # The flush started by the timer or by a full queue, pending or
+        # running; there is at most one at a time
+        self._flush_task: Optional[asyncio.Task] = None
+        # Whether the writes of a failed flush are waiting for their retry,
+        # during which a full queue does not flush early
+        self._retrying = False
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._reactions) + len(self._members)
+
+    def add_reaction(self, reacter_id: int, reactee_id: int, reaction_name: str, message_id: int) -> None:
+        self._queue_reaction((reacter_id, reactee_id, reaction_name, message_id), ADD)
+
+    def remove_reaction(self, reacter_id: int, reactee_id: int, reaction_name: str, message_id: int) -> None:
+        self._queue_reaction((reacter_id, reactee_id, reaction_name, message_id), REMOVE)
+
+    def upsert_member(self, member_id: int, name: str) -> None:
+        self._members[member_id] = name
+        self._schedule()
+
+    def _queue_reaction(self, key: ReactionKey, op: str) -> None:
+        pending = self._reactions.get(key)
+        if pending is not None and pending != op:
+            # The reaction was added then removed (or removed then added)
+            # before it ever reached the database: nothing to write.
+            del self._reactions[key]
+            return
+        self._reactions[key] = op
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if len(self) >= self.max_rows and not self._retrying:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._start_flush)
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+            self._flush_task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, _task: asyncio.Task) -> None:
+        self._flush_task = None
+        # Writes buffered while the flush was running
+        if len(self):
+            self._schedule()
+
+    async def flush(self) -> None:
+        """Write every pending change to the database in one transaction."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        async with self._flush_lock:
+            if not len(self):
+                return
+
+            reactions, self._reactions = self._reactions, {}
+            members, self._members = self._members, {}
+            self._retrying = False
+
+            try:
+                async with self.db.transaction() as txn:
+                    # Members go first since Reactions references them
+                    if members:
+                        await txn.executemany("INSERT OR REPLACE INTO Members VALUES (?,?)", members.items())
+                    added = [key for key, op in reactions.items() if op == ADD]
+                    removed = [key for key, op in reactions.items() if op == REMOVE]
+                    if added:
+                        await txn.executemany("INSERT OR IGNORE INTO Reactions VALUES (?,?,?,?)", added)
+                    if removed:
+                        await txn.executemany(
+                            "DELETE FROM Reactions WHERE ReacterID = ? AND ReacteeID = ? "
+                            "AND ReactionName = ? AND MessageID = ?",
+                            removed,
+                        )
+            except Exception as e:
+                self.logger.error(f"Failed to flush {len(reactions) + len(members)} buffered writes, will retry: {e!r}")
+                self._requeue(reactions, members)
+
+    def _requeue(self, reactions: dict[ReactionKey, str], members: dict[int, str]) -> None:
+        # Put back the writes of a failed flush, before the ones buffered
+        # since, which must win over them
+        for key, op in reactions.items():
+            pending = self._reactions.get(key)
+            if pending is None:
+                self._reactions[key] = op
+            elif pending != op:
+                del self._reactions[key]
+        for member_id, name in members.items():
+            self._members.setdefault(member_id, name)
+        # Retry after the usual interval even if the queue is full, rather
+        # than retrying in a loop while the database is failing
+        self._retrying = bool(len(self))
+        if self._retrying and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._start_flush)
@@ -95,6 +95,20 @@ class Parser:
             self.mod_log_webhook_id = None
             self.mod_log_webhook_token = None
 
+        # Time budgets of user-written regexes, converted to seconds
+        self.regex = {
+            "message_budget": int(config["Regex"]["MessageBudget"]) / 1000,
+            "query_budget": int(config["Regex"]["QueryBudget"]) / 1000,
+            "slow_pattern_threshold": int(config["Regex"]["SlowPatternThreshold"]) / 1000,
+        }
+
+        # Markov chain model of ?generate
+        self.markov = {
+            "order": int(config["Markov"]["Order"]),
+            "model_path": config["Markov"]["ModelPath"],
+            "user_models_memory": int(config["Markov"]["UserModelsMemory"]) * 2**20,
+        }
+
         # Welcome + Farewell messages
         self.welcome = config["Greetings"]["Welcome"].split("\n")
         self.goodbye = config["Greetings"]["Goodbye"].split("\n")
@@ -102,6 +116,19 @@ class Parser:
         # DB configuration
         self.db_path = config["DB"]["Path"]
         self.db_schema_path = config["DB"]["Schema"]
+        self.db_migrations_path = config["DB"]["Migrations"]
+        self.db_flush_interval = int(config["DB"]["FlushInterval"])
+        self.db_flush_rows = int(config["DB"]["FlushRows"])
+
+        # Outbound messages
+        self.message_concurrency = int(config["Messages"]["MaxConcurrentSends"])
+        self.message_retries = int(config["Messages"]["MaxRetries"])
+
+        # Interactive messages (paginators, assistants, games...)
+        self.interactions = {
+            "max_sessions_per_user": int(config["Interactions"]["MaxSessionsPerUser"]),
+            "max_sessions": int(config["Interactions"]["MaxSessions"]),
+        }
 
         # Helpers configuration
         self.course_tpl = config["Helpers"]["CourseTemplate"]
@@ -144,13 +171,24 @@ class Parser:
             "asset_tax": {decimal.Decimal(b): float(a) for b, a in asset_tb},
             "transaction_tax": float(config["OtherTax"]["TransactionTax"]),
             "bet_roll_cases": sorted([(int(c), decimal.Decimal(a)) for c, a in br_cases], key=lambda c: c[0]),
+            "compaction_horizon": int(config["Currency"]["CompactionHorizon"]),
+            "ledger_archive_path": config["Currency"]["LedgerArchivePath"],
         }
 
         self.images = {
-            "max_image_size": int(config["Images"]["MaxImageSize"]),
+            "max_pixels": int(config["Images"]["MaxPixels"]),
             "image_history_limit": int(config["Images"]["ImageHistoryLimit"]),
             "max_radius": int(config["Images"]["MaxRadius"]),
             "max_iterations": int(config["Images"]["MaxIterations"]),
+            "workers": int(config["Images"]["Workers"]),
+            "max_jobs": int(config["Images"]["MaxJobs"]),
+            "max_jobs_per_user": int(config["Images"]["MaxJobsPerUser"]),
+            "recycle_workers_after": int(config["Images"]["RecycleWorkersAfter"]),
+            "max_filter_steps": int(config["Images"]["MaxFilterSteps"]),
+            "max_filter_cost": int(config["Images"]["MaxFilterCost"]),
+            "result_cache_memory": int(config["Images"]["ResultCacheMemory"]) * 2**20,
+            "result_cache_disk": int(config["Images"]["ResultCacheDisk"]) * 2**20,
+            "result_cache_path": config["Images"]["ResultCachePath"],
         }
 
         self.games = {
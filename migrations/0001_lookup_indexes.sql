@@ -0,0 +1,31 @@
+/*
+ * Copyright (C) idoneam (2016-2022)
+ *
+ * This file is part of Canary
+ *
+ * Canary is free software; you can redistribute it and/or modify it
+ * under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Canary is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with Canary. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+-- Indexes on the columns used to look rows up by user
+
+CREATE INDEX IF NOT EXISTS `quotes_id` ON `Quotes` (`ID`);
+
+-- Amount is included so that balance sums can be answered from the index alone
+CREATE INDEX IF NOT EXISTS `bank_transactions_user_action_date`
+    ON `BankTransactions` (`UserID`, `Action`, `Date`, `Amount`);
+
+CREATE INDEX IF NOT EXISTS `reactions_reactee_name` ON `Reactions` (`ReacteeID`, `ReactionName`);
+CREATE INDEX IF NOT EXISTS `reactions_reacter` ON `Reactions` (`ReacterID`);
+
+CREATE INDEX IF NOT EXISTS `reminders_id` ON `Reminders` (`ID`);
@@ -0,0 +1,30 @@
+/*
+ * Copyright (C) idoneam (2016-2022)
+ *
+ * This file is part of Canary
+ *
+ * Canary is free software; you can redistribute it and/or modify it
+ * under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Canary is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with Canary. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+-- Snapshot of the sum of each user's BankTransactions, updated alongside every new transaction
+
+CREATE TABLE IF NOT EXISTS `Balances` (
+    `UserID`    INTEGER PRIMARY KEY,
+    `Balance`   INTEGER NOT NULL,
+
+    FOREIGN KEY(`UserID`) REFERENCES `Members`(`ID`)
+);
+CREATE INDEX IF NOT EXISTS `balances_balance` ON `Balances` (`Balance`);
+
+INSERT INTO `Balances` SELECT `UserID`, SUM(`Amount`) FROM `BankTransactions` GROUP BY `UserID`;
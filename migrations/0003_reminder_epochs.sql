@@ -0,0 +1,43 @@
+/*
+ * Copyright (C) idoneam (2016-2022)
+ *
+ * This file is part of Canary
+ *
+ * Canary is free software; you can redistribute it and/or modify it
+ * under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Canary is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with Canary. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+-- Store reminder dates as integer epochs (they used to be stored as local time strings written by Python's datetime
+-- adapter) so that reminders can be queried by due time, and give each reminder its own ID
+
+CREATE TABLE `Reminders_new` (
+    `ID`           INTEGER,
+    `Name`         TEXT,
+    `Reminder`     TEXT,
+    `Frequency`    TEXT,
+    `Date`         INTEGER, -- epoch at which a one-time reminder is due
+    `LastReminder` INTEGER, -- epoch at which the reminder was created or last sent
+    `ReminderID`   INTEGER PRIMARY KEY
+);
+
+INSERT INTO `Reminders_new`(`ID`, `Name`, `Reminder`, `Frequency`, `Date`, `LastReminder`)
+    SELECT `ID`, `Name`, `Reminder`, `Frequency`,
+           CAST(strftime('%s', `Date`, 'utc') AS INTEGER),
+           CAST(strftime('%s', `LastReminder`, 'utc') AS INTEGER)
+    FROM `Reminders`;
+
+DROP TABLE `Reminders`;
+ALTER TABLE `Reminders_new` RENAME TO `Reminders`;
+
+CREATE INDEX IF NOT EXISTS `reminders_id` ON `Reminders` (`ID`);
+CREATE INDEX IF NOT EXISTS `reminders_date` ON `Reminders` (`Date`);
@@ -0,0 +1,59 @@
+/*
+ * Copyright (C) idoneam (2016-2022)
+ *
+ * This file is part of Canary
+ *
+ * Canary is free software; you can redistribute it and/or modify it
+ * under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Canary is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with Canary. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+-- Jobs run by the bot's scheduler (see cogs/utils/scheduler.py), identified by the name of their handler and a key
+-- unique for that handler
+
+CREATE TABLE IF NOT EXISTS `ScheduledJobs` (
+    `Handler` TEXT NOT NULL,
+    `Key`     TEXT NOT NULL,
+    `DueAt`   INTEGER NOT NULL, -- epoch at which the job is due
+    `Payload` TEXT,             -- JSON passed to the handler
+    PRIMARY KEY (`Handler`, `Key`)
+);
+
+CREATE INDEX IF NOT EXISTS `scheduled_jobs_due_at` ON `ScheduledJobs` (`DueAt`);
+
+-- Reminders used to be polled from the Reminders table, they are now scheduled as jobs
+INSERT INTO `ScheduledJobs`(`Handler`, `Key`, `DueAt`)
+    SELECT 'reminder', `ReminderID`,
+           CASE `Frequency`
+               WHEN 'once' THEN `Date`
+               WHEN 'daily' THEN `LastReminder` + 86400
+               WHEN 'weekly' THEN `LastReminder` + 7 * 86400
+               WHEN 'monthly' THEN `LastReminder` + 30 * 86400
+           END
+    FROM `Reminders`
+    WHERE `Frequency` IN ('once', 'daily', 'weekly', 'monthly')
+      AND (`Frequency` = 'once' AND `Date` IS NOT NULL OR `Frequency` <> 'once' AND `LastReminder` IS NOT NULL);
+
+-- So did the banner contest reminder and the weekly verification purge
+INSERT INTO `ScheduledJobs`(`Handler`, `Key`, `DueAt`)
+    SELECT 'banner_contest_reminder', '', CAST(json_extract(`Value`, '$.timestamp') AS INTEGER)
+    FROM `Settings`
+    WHERE `Key` = 'BannerContestInfo'
+      AND json_extract(`Value`, '$.send_reminder') = 1
+      AND json_extract(`Value`, '$.timestamp') IS NOT NULL;
+
+INSERT INTO `ScheduledJobs`(`Handler`, `Key`, `DueAt`)
+    SELECT 'verification_purge', '', CAST(`Value` AS INTEGER) + 7 * 86400
+    FROM `Settings`
+    WHERE `Key` = 'last_verification_purge_timestamp';
+
+DROP INDEX IF EXISTS `reminders_date`;
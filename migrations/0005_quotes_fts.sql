@@ -0,0 +1,61 @@
+/*
+ * Copyright (C) idoneam (2016-2022)
+ *
+ * This file is part of Canary
+ *
+ * Canary is free software; you can redistribute it and/or modify it
+ * under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Canary is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with Canary. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+
+-- Give each quote its own ID, and index the quotes for full-text search (FTS5). The index is an external content
+-- table, i.e. it does not store the quotes themselves, and is kept in sync with Quotes by triggers
+
+CREATE TABLE `Quotes_new` (
+    `ID`      INTEGER,
+    `Name`    TEXT,
+    `Quote`   TEXT,
+    `Date`    TEXT,
+    `QuoteID` INTEGER PRIMARY KEY
+);
+
+INSERT INTO `Quotes_new`(`ID`, `Name`, `Quote`, `Date`)
+    SELECT `ID`, `Name`, `Quote`, `Date` FROM `Quotes` ORDER BY rowid;
+
+DROP TABLE `Quotes`;
+ALTER TABLE `Quotes_new` RENAME TO `Quotes`;
+
+CREATE INDEX IF NOT EXISTS `quotes_id` ON `Quotes` (`ID`);
+
+CREATE VIRTUAL TABLE `QuotesFTS` USING fts5(
+    `Quote`,
+    content = 'Quotes',
+    content_rowid = 'QuoteID',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+INSERT INTO `QuotesFTS`(`QuotesFTS`) VALUES ('rebuild');
+
+CREATE TRIGGER `quotes_fts_insert` AFTER INSERT ON `Quotes` BEGIN
+    INSERT INTO `QuotesFTS`(rowid, `Quote`) VALUES (new.`QuoteID`, new.`Quote`);
+END;
+
+CREATE TRIGGER `quotes_fts_delete` AFTER DELETE ON `Quotes` BEGIN
+    INSERT INTO `QuotesFTS`(`QuotesFTS`, rowid, `Quote`) VALUES ('delete', old.`QuoteID`, old.`Quote`);
+END;
+
+CREATE TRIGGER `quotes_fts_update` AFTER UPDATE OF `Quote` ON `Quotes` BEGIN
+    INSERT INTO `QuotesFTS`(`QuotesFTS`, rowid, `Quote`) VALUES ('delete', old.`QuoteID`, old.`Quote`);
+    INSERT INTO `QuotesFTS`(rowid, `Quote`) VALUES (new.`QuoteID`, new.`Quote`);
+END;
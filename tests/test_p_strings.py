@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+
+import pytest
+
+from cogs.utils.p_strings import PStringEncodings, _get_required_literal
+
+
+@pytest.mark.parametrize(
+    "string,literal",
+    [
+        ("hello there", "hello there"),
+        ("%[hi, hello]% i like %1% a lot", " i like "),
+        ("%[hi, hello %[world, you]%]% again", " again"),
+        ("hi|hello", None),
+        ("%[(a+)+, b]% hello", None),
+        ("%[hi, %[(a+)+, b]%]% hello", None),
+        ("%[a.b, c]% hello", None),
+    ],
+)
+def test_get_required_literal(string, literal):
+    assert _get_required_literal(string) == literal
+
+
+def test_regex_in_choice_lists_is_timed():
+    encodings = PStringEncodings(
+        ["%[(a+)+, b]% hello", "%[hi, hey]% hello", "%1% and %2%"], ["evil", "nice", "both"], True
+    )
+    assert encodings._timed_keys == {0, 2}
+    assert 0 in encodings.other_keys
+    assert 1 in encodings._literal_by_key
+    assert encodings.parser("a" * 40 + "! hello", budget=0.05) is None
+    assert str(encodings.parser("hey hello", budget=0.05)) == "nice"
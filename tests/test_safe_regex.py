@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# Copyright (C) idoneam (2016-2022)
+#
+# This file is part of Canary
+#
+# Canary is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canary is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Canary. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from cogs.utils.safe_regex import required_literals
+
+
+@pytest.mark.parametrize(
+    "pattern,literals",
+    [
+        (r"hello \w+ world", ["hello ", " world"]),
+        (r"hi|hello", []),
+        (r"colou?r", ["colo", "r"]),
+        (r"a\.b", ["a.b"]),
+        (r"[abc] foo", [" foo"]),
+        (r"\p{L}+ foo", [" foo"]),
+        (r"\P{Lu} foo", [" foo"]),
+        (r"\pL foo", [" foo"]),
+        (r"\N{EM DASH} foo", [" foo"]),
+        (r"\x{1F600} foo", [" foo"]),
+        (r"bar\x41 foo", ["bar", " foo"]),
+        (r"bar\u00e9 foo", ["bar", " foo"]),
+        (r"bar\U0001F600 foo", ["bar", " foo"]),
+        (r"(a)b\12 foo", ["b", " foo"]),
+        (r"bar\012 foo", ["bar", " foo"]),
+    ],
+)
+def test_required_literals(pattern, literals):
+    assert required_literals(pattern) == literals